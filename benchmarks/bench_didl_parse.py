@@ -0,0 +1,109 @@
+"""Micro-benchmark of Browse response parsing
+
+Compare the parse time of the DIDL-Lite parser in content_browse with the
+former regex based extraction.
+
+usage: python bench_didl_parse.py [--items 10000] [--repeat 5]
+"""
+import argparse
+import html
+import logging
+import os
+import re
+import sys
+import time
+from xml.etree import ElementTree
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'dlnautil'))
+
+import content_browse  # noqa: E402
+
+_logger = logging.getLogger('dlnautil')
+
+
+def _legacy_item(item_str: str) -> dict:
+    item = {}
+    attrs = ['id', 'parentID', 'childCount', 'protocolInfo', 'resolution', 'duration', 'size']
+    for a in attrs:
+        m = re.search(f'{a}=\"([^\\s]+)\"', item_str)
+        if m:
+            item[a] = m.group().replace(f'{a}=\"', '').replace('\"', '')
+
+    attrs = ['dc\\:title', 'dc\\:date', 'upnp\\:class', 'upnp\\:album',
+             'pv\\:extension', 'pv\\:modificationTime', 'pv\\:addedTime', 'pv\\:lastUpdated']
+    for a in attrs:
+        m = re.search(f'<{a}>([^\\s]+)</{a}>', item_str)
+        if m:
+            a_ = a.replace('\\', '')
+            item[a.split(':')[-1]] = m.group().replace(f'<{a_}>', '').replace(f'</{a_}>', '')
+
+    m = re.search('<res .*>([^\\s]+)</res>', item_str)
+    if m:
+        item['res'] = m.group(1)
+    return item
+
+
+def _legacy_parse(s: str) -> list:
+    """Former regex based extraction (ClassType.extract + Item.__init__)"""
+    ret = []
+    for node in ElementTree.fromstring(s).iter('Result'):
+        for ct in ('container', 'item'):
+            for m in re.finditer(f'<{ct} .*</{ct}>', node.text):
+                for i in m.group().split(f'</{ct}>'):
+                    ret.append(_legacy_item(i))
+    return ret
+
+
+def _make_response(count: int) -> str:
+    didl = ['<DIDL-Lite xmlns="urn:schemas-upnp-org:metadata-1-0/DIDL-Lite/" '
+            'xmlns:dc="http://purl.org/dc/elements/1.1/" '
+            'xmlns:upnp="urn:schemas-upnp-org:metadata-1-0/upnp/" xmlns:pv="http://www.pv.com/pvns/">']
+    for i in range(count):
+        didl.append(f'<item id="64${i}" parentID="64" restricted="1">'
+                    f'<dc:title>20200102{i:06d}</dc:title><dc:date>2020-01-02</dc:date>'
+                    f'<upnp:class>object.item.videoItem</upnp:class><upnp:album>2020-01-02</upnp:album>'
+                    f'<pv:extension>m2ts</pv:extension><pv:modificationTime>1577934000</pv:modificationTime>'
+                    f'<pv:addedTime>1577934000</pv:addedTime><pv:lastUpdated>1577934000</pv:lastUpdated>'
+                    f'<res protocolInfo="http-get:*:video/vnd.dlna.mpeg-tts:*" size="{1000000 + i}" '
+                    f'duration="0:01:00.000" resolution="1920x1080">http://192.168.0.2:9000/{i}.m2ts</res></item>')
+    didl.append('</DIDL-Lite>')
+    return '<?xml version="1.0"?>' \
+           '<s:Envelope xmlns:s="http://schemas.xmlsoap.org/soap/envelope/"><s:Body>' \
+           '<u:BrowseResponse xmlns:u="urn:schemas-upnp-org:service:ContentDirectory:1">' \
+           f'<Result>{html.escape("".join(didl))}</Result>' \
+           f'<NumberReturned>{count}</NumberReturned><TotalMatches>{count}</TotalMatches><UpdateID>1</UpdateID>' \
+           '</u:BrowseResponse></s:Body></s:Envelope>'
+
+
+def _measure(func, s: str, repeat: int) -> float:
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(s)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def _main():
+    p = argparse.ArgumentParser()
+    p.add_argument('--items', type=int, default=10000, help='number of items in a response')
+    p.add_argument('--repeat', type=int, default=5, help='number of repetition (best time is used)')
+    args = p.parse_args()
+    _logger.setLevel(logging.WARNING)
+
+    s = _make_response(args.items)
+    legacy = _measure(_legacy_parse, s, args.repeat)
+    current = _measure(content_browse._parse, s, args.repeat)
+    projection = content_browse._projection(('id', 'title', 'class'))
+    projected = _measure(lambda x: content_browse._parse(x, projection), s, args.repeat)
+    per_10k = 10000 / args.items
+    print(f'items={args.items} response={len(s)} bytes')
+    print(f'legacy regex : {legacy * per_10k * 1000:.1f} ms / 10k items')
+    print(f'didl parser  : {current * per_10k * 1000:.1f} ms / 10k items')
+    print(f'didl parser (id,title,class) : {projected * per_10k * 1000:.1f} ms / 10k items')
+    print(f'speedup      : {legacy / current:.1f}x')
+
+
+if __name__ == '__main__':
+    _main()
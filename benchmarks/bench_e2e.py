@@ -0,0 +1,165 @@
+"""End-to-end benchmark against in-process fake devices
+
+Measure discovery latency (server_search), Browse throughput, parse cost
+per item and recursive crawl time (content_browse), and control round trip
+(content_play) with the stand-ins in fake_devices. Results are printed as
+text, or written as JSON with --output to compare runs (with --metrics, the
+recorded metrics are added to the JSON).
+
+usage: python bench_e2e.py [--items 5000] [--latency 0.002] [--repeat 3] [--output result.json]
+"""
+import argparse
+import json
+import logging
+import os
+import platform
+import statistics
+import sys
+import time
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'dlnautil'))
+
+import content_browse  # noqa: E402
+import content_play  # noqa: E402
+import fake_devices  # noqa: E402
+import metrics  # noqa: E402
+from http_session import SessionPool  # noqa: E402
+import server_search  # noqa: E402
+
+_logger = logging.getLogger('dlnautil')
+
+
+def _best(func, repeat: int) -> float:
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def bench_discovery(args) -> dict:
+    devices = [fake_devices.FakeMediaServer(containers=0, items=0, depth=0) for _ in range(args.devices)]
+    responder = fake_devices.FakeSsdpResponder(devices, delay=args.latency)
+    server_search.SSDP_ADDR = responder.address
+    times = []
+    try:
+        for _ in range(args.repeat):
+            with SessionPool() as pool:
+                start = time.perf_counter()
+                found = server_search.search(pool, timeout=2.0, max_results=args.devices)
+                times.append(time.perf_counter() - start)
+            if len(found) != args.devices:
+                _logger.warning(f'discovery found {len(found)} of {args.devices}')
+    finally:
+        responder.close()
+        for d in devices:
+            d.close()
+    return {'devices': args.devices, 'best_s': min(times), 'median_s': statistics.median(times)}
+
+
+def bench_browse(args) -> dict:
+    with fake_devices.FakeMediaServer(containers=1, items=args.items, depth=1, page_cap=args.page_cap,
+                                      latency=args.latency) as server, SessionPool() as pool:
+        count = 0
+
+        def run():
+            nonlocal count
+            count = sum(1 for _ in content_browse.iter_browse(server.control_url, server.service_type, '0/0',
+                                                              pool=pool))
+
+        before = server.bytes_sent
+        elapsed = _best(run, args.repeat)
+        bytes_per_run = (server.bytes_sent - before) / args.repeat
+    return {'items': count, 'page_cap': args.page_cap, 'best_s': elapsed, 'items_per_s': count / elapsed,
+            'bytes_per_s': bytes_per_run / elapsed}
+
+
+def bench_parse(args) -> dict:
+    with fake_devices.FakeMediaServer(containers=1, items=args.items, depth=1, page_cap=args.items) as server:
+        arguments = ('<ObjectID>0/0</ObjectID><BrowseFlag>BrowseDirectChildren</BrowseFlag><Filter>*</Filter>'
+                     f'<StartingIndex>0</StartingIndex><RequestedCount>{args.items}</RequestedCount>'
+                     '<SortCriteria></SortCriteria>')
+        s = content_browse._request_action(server.control_url, server.service_type, 'Browse', arguments)
+    elapsed = _best(lambda: content_browse._parse(s), args.repeat)
+    projection = content_browse._projection(('id', 'title', 'class'))
+    projected = _best(lambda: content_browse._parse(s, projection), args.repeat)
+    return {'items': args.items, 'response_bytes': len(s), 'us_per_item': elapsed / args.items * 1e6,
+            'us_per_item_projected': projected / args.items * 1e6}
+
+
+def bench_crawl(args) -> dict:
+    with fake_devices.FakeMediaServer(containers=args.containers, items=args.crawl_items, depth=args.depth,
+                                      page_cap=args.page_cap, latency=args.latency) as server:
+        results = {'containers': server.container_count, 'items': server.item_count}
+        for concurrency in (1, content_browse.DEFAULT_SERVER_CONCURRENCY):
+            with SessionPool() as pool:
+                elapsed = _best(lambda: content_browse.crawl(server.control_url, server.service_type,
+                                                             concurrency=concurrency, pool=pool), args.repeat)
+            results[f'best_s_concurrency_{concurrency}'] = elapsed
+    return results
+
+
+def bench_control(args) -> dict:
+    with fake_devices.FakeRenderer(latency=args.latency) as device, SessionPool() as pool:
+        renderer = content_play.Renderer.from_description(device.location, pool)
+        renderer.set_content_uri('http://127.0.0.1/content.mp4')
+        times = []
+        for i in range(args.calls):
+            result = renderer.play() if i % 2 == 0 else renderer.pause()
+            times.append(result.elapsed)
+    times.sort()
+    return {'calls': len(times), 'p50_ms': times[len(times) // 2] * 1000,
+            'p95_ms': times[int(len(times) * 0.95)] * 1000, 'max_ms': times[-1] * 1000}
+
+
+_BENCHMARKS = {
+    'discovery': bench_discovery,
+    'browse': bench_browse,
+    'parse': bench_parse,
+    'crawl': bench_crawl,
+    'control': bench_control,
+}
+
+
+def _main():
+    p = argparse.ArgumentParser()
+    p.add_argument('--only', action='append', choices=list(_BENCHMARKS), help='benchmark to run (can be repeated)')
+    p.add_argument('--items', type=int, default=5000, help='number of items in a container for browse/parse')
+    p.add_argument('--page_cap', type=int, default=100, help='max number of entries in a Browse response')
+    p.add_argument('--containers', type=int, default=4, help='number of containers in each container for crawl')
+    p.add_argument('--depth', type=int, default=3, help='depth of container tree for crawl')
+    p.add_argument('--crawl_items', type=int, default=20, help='number of items in each container for crawl')
+    p.add_argument('--devices', type=int, default=4, help='number of devices for discovery')
+    p.add_argument('--calls', type=int, default=200, help='number of control calls')
+    p.add_argument('--latency', type=float, default=0.002, help='seconds fake devices wait before responding')
+    p.add_argument('--repeat', type=int, default=3, help='number of repetition (best time is used)')
+    p.add_argument('--output', help='write results as JSON to this file')
+    p.add_argument('--metrics', action='store_true', help='record metrics and add them to the JSON output')
+    args = p.parse_args()
+    _logger.setLevel(logging.WARNING)
+    recorded = metrics.enable() if args.metrics else None
+
+    results = {}
+    for name in args.only if args.only else _BENCHMARKS:
+        results[name] = _BENCHMARKS[name](args)
+        print(f'{name:10s} ' + ' '.join(f'{k}={v:.4g}' if isinstance(v, float) else f'{k}={v}'
+                                         for k, v in results[name].items()))
+
+    if args.output:
+        report = {
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'parameters': {k: v for k, v in vars(args).items() if k != 'output'},
+            'results': results,
+        }
+        if recorded:
+            report['metrics'] = recorded.snapshot()
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == '__main__':
+    _main()
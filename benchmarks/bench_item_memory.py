@@ -0,0 +1,63 @@
+"""Memory benchmark of content_browse.Item
+
+Compare bytes per item of the former dict backed Item with the current
+slotted Item, both built from the same Browse response.
+
+usage: python bench_item_memory.py [--items 100000]
+"""
+import argparse
+import gc
+import logging
+import os
+import sys
+import tracemalloc
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'dlnautil'))
+
+import content_browse  # noqa: E402
+from bench_didl_parse import _make_response  # noqa: E402
+
+_logger = logging.getLogger('dlnautil')
+
+
+class _DictItem:
+    """Former Item representation (free-form dict + instance __dict__)"""
+
+    def __init__(self, item: dict, ctype: str):
+        self.item = item
+        self.class_type = ctype
+
+
+def _measure(build) -> int:
+    gc.collect()
+    tracemalloc.start()
+    before, _ = tracemalloc.get_traced_memory()
+    items = build()
+    after, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del items
+    return after - before
+
+
+def _main():
+    p = argparse.ArgumentParser()
+    p.add_argument('--items', type=int, default=100000, help='number of items')
+    args = p.parse_args()
+    _logger.setLevel(logging.WARNING)
+
+    # parse outside of the measurement so that only the resulting objects are counted
+    parsed, _, _, _ = content_browse._parse(_make_response(args.items))
+    # string values as the former parser produced them (one new str per value)
+    raw = [{k: str(v) for k, v in i.get_data().items()} for i in parsed]
+    del parsed
+
+    legacy = _measure(lambda: [_DictItem({k: ''.join(v) for k, v in d.items()}, 'item') for d in raw])
+    current = _measure(lambda: [content_browse.Item({k: ''.join(v) for k, v in d.items()}, 'item') for d in raw])
+    print(f'items={args.items}')
+    print(f'dict item    : {legacy / args.items:.0f} bytes / item')
+    print(f'slotted item : {current / args.items:.0f} bytes / item')
+    print(f'ratio        : {current / legacy:.2f}')
+
+
+if __name__ == '__main__':
+    _main()
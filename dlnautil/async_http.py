@@ -0,0 +1,237 @@
+import asyncio
+import logging
+from typing import Dict, List, Optional, Tuple, Union
+from urllib.parse import urlparse
+import weakref
+
+import requests
+from requests.structures import CaseInsensitiveDict
+
+from http_session import DEFAULT_POOL_SIZE, DEFAULT_TIMEOUT
+
+_logger = logging.getLogger('dlnautil')
+
+
+class AsyncResponse:
+    """HTTP response read by AsyncSessionPool
+
+    It has the attributes of requests.Response used by dlnautil, so the
+    same code can handle responses of both pools.
+    """
+
+    def __init__(self, url: str, status_code: int, reason: str, headers: CaseInsensitiveDict, content: bytes):
+        self.url = url
+        self.status_code = status_code
+        self.reason = reason
+        self.headers = headers
+        self.content = content
+
+    @property
+    def encoding(self) -> str:
+        for param in self.headers.get('Content-Type', '').split(';')[1:]:
+            key, _, value = param.strip().partition('=')
+            if key.lower() == 'charset' and value:
+                return value.strip('"\'')
+        return 'utf-8'
+
+    @property
+    def text(self) -> str:
+        return self.content.decode(self.encoding, errors='replace')
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise requests.HTTPError(f'{self.status_code} Error: {self.reason} for url: {self.url}', response=self)
+
+    def __repr__(self):
+        return f'AsyncResponse({self.status_code})'
+
+
+class _Host:
+    def __init__(self, pool_size: int):
+        self.idle = []
+        self.semaphore = asyncio.Semaphore(pool_size)
+
+
+class AsyncSessionPool:
+    """Keep-alive HTTP/1.1 connections on asyncio streams shared per host
+
+    The non-blocking counterpart of http_session.SessionPool: at most
+    pool_size requests run at once on each scheme://host:port (the others
+    wait for a free connection) and idle connections are reused. A pool
+    belongs to the event loop that used it first.
+
+    Errors are raised as requests exceptions (ConnectionError, Timeout,
+    HTTPError by raise_for_status) so that the handling of the blocking
+    API applies. A cancelled request closes its connection.
+    """
+
+    def __init__(self, pool_size: int = DEFAULT_POOL_SIZE,
+                 timeout: Union[float, Tuple[float, float]] = DEFAULT_TIMEOUT):
+        """
+        :param pool_size: max number of connections (and requests at once) per host
+        :param timeout: default timeout of requests (connect, read) in seconds
+        """
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self._hosts: Dict[Tuple[str, str, int], _Host] = {}
+
+    def _host(self, key: Tuple[str, str, int]) -> _Host:
+        host = self._hosts.get(key)
+        if host is None:
+            _logger.debug(f'new async host : {key[0]}://{key[1]}:{key[2]}')
+            host = self._hosts[key] = _Host(self.pool_size)
+        return host
+
+    async def request(self, method: str, url: str, data: bytes = None, headers: Dict[str, str] = None,
+                      timeout: Union[float, Tuple[float, float]] = None) -> AsyncResponse:
+        """Send request and read the whole response
+
+        :param method: HTTP method
+        :param url: request URL
+        :param data: request body
+        :param headers: request headers
+        :param timeout: (connect, read) or both in seconds (timeout of the pool if None)
+        :return: response
+        """
+        timeout = timeout if timeout is not None else self.timeout
+        connect_timeout, read_timeout = timeout if isinstance(timeout, tuple) else (timeout, timeout)
+        urlinfo = urlparse(url)
+        scheme = urlinfo.scheme or 'http'
+        port = urlinfo.port or (443 if scheme == 'https' else 80)
+        key = (scheme, urlinfo.hostname, port)
+        path = urlinfo.path or '/'
+        if urlinfo.query:
+            path += f'?{urlinfo.query}'
+        lines = [f'{method} {path} HTTP/1.1', f'Host: {urlinfo.netloc}', 'Accept-Encoding: identity']
+        lines += [f'{k}: {v}' for k, v in (headers or {}).items()]
+        if data is not None or method in ('POST', 'PUT'):
+            lines.append(f'Content-Length: {len(data) if data else 0}')
+        request = ('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1') + (data or b'')
+
+        host = self._host(key)
+        async with host.semaphore:
+            fresh = False
+            while True:
+                reader, writer = (None, None) if fresh else self._pop_idle(host)
+                reused = reader is not None
+                if not reused:
+                    try:
+                        reader, writer = await asyncio.wait_for(
+                            asyncio.open_connection(key[1], port, ssl=scheme == 'https'), connect_timeout)
+                    except asyncio.TimeoutError:
+                        raise requests.ConnectTimeout(f'connect timeout : {url}') from None
+                    except OSError as e:
+                        raise requests.ConnectionError(f'{e} : {url}') from e
+                keep = False
+                received = False
+                try:
+                    writer.write(request)
+                    await asyncio.wait_for(writer.drain(), read_timeout)
+                    first = await asyncio.wait_for(reader.readexactly(1), read_timeout)
+                    received = True
+                    response, keep = await self._read_response(url, method, first, reader, read_timeout)
+                    return response
+                except asyncio.TimeoutError:
+                    raise requests.ReadTimeout(f'read timeout : {url}') from None
+                except (OSError, asyncio.IncompleteReadError, asyncio.LimitOverrunError, ValueError) as e:
+                    if reused and not received:
+                        # keep-alive connection closed by the server before it read the request,
+                        # send it once more on a new connection
+                        _logger.debug(f'stale connection : {url} : {e!r}')
+                        fresh = True
+                        continue
+                    raise requests.ConnectionError(f'{e!r} : {url}') from e
+                finally:
+                    if keep:
+                        host.idle.append((reader, writer))
+                    else:
+                        writer.close()
+
+    @staticmethod
+    def _pop_idle(host: _Host) -> Tuple[Optional[asyncio.StreamReader], Optional[asyncio.StreamWriter]]:
+        # like urllib3 is_connection_dropped, connections closed while idle are not reused
+        while host.idle:
+            reader, writer = host.idle.pop()
+            if not reader.at_eof() and not writer.is_closing() and reader.exception() is None:
+                return reader, writer
+            writer.close()
+        return None, None
+
+    @staticmethod
+    async def _read_response(url: str, method: str, first: bytes, reader: asyncio.StreamReader,
+                             read_timeout: float) -> Tuple[AsyncResponse, bool]:
+        async def read(coro):
+            return await asyncio.wait_for(coro, read_timeout)
+
+        while True:
+            head = first + await read(reader.readuntil(b'\r\n\r\n'))
+            first = b''
+            status_line, *header_lines = head.decode('latin-1').split('\r\n')
+            version, _, rest = status_line.partition(' ')
+            code, _, reason = rest.partition(' ')
+            status_code = int(code)
+            # skip interim responses (e.g. 100 Continue)
+            if status_code >= 200 or status_code == 101:
+                break
+
+        headers = CaseInsensitiveDict()
+        for line in header_lines:
+            if line:
+                name, _, value = line.partition(':')
+                value = value.strip()
+                headers[name] = f'{headers[name]}, {value}' if name in headers else value
+        connection = headers.get('Connection', '').lower()
+        keep = 'close' not in connection and (version != 'HTTP/1.0' or 'keep-alive' in connection)
+
+        if method == 'HEAD' or status_code in (204, 304) or status_code < 200:
+            content = b''
+        elif 'chunked' in headers.get('Transfer-Encoding', '').lower():
+            chunks: List[bytes] = []
+            while True:
+                size = int((await read(reader.readuntil(b'\r\n'))).split(b';', 1)[0], 16)
+                if size == 0:
+                    # trailer
+                    while (await read(reader.readuntil(b'\r\n'))) != b'\r\n':
+                        pass
+                    break
+                chunks.append((await read(reader.readexactly(size + 2)))[:-2])
+            content = b''.join(chunks)
+        elif 'Content-Length' in headers:
+            content = await read(reader.readexactly(int(headers['Content-Length'])))
+        else:
+            content = await read(reader.read())
+            keep = False
+        return AsyncResponse(url, status_code, reason, headers, content), keep
+
+    async def get(self, url: str, **kwargs) -> AsyncResponse:
+        return await self.request('GET', url, **kwargs)
+
+    async def post(self, url: str, **kwargs) -> AsyncResponse:
+        return await self.request('POST', url, **kwargs)
+
+    def close(self):
+        for host in self._hosts.values():
+            for _, writer in host.idle:
+                writer.close()
+            host.idle.clear()
+        self._hosts.clear()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+_default_pools = weakref.WeakKeyDictionary()
+
+
+def get_pool(pool: AsyncSessionPool = None) -> AsyncSessionPool:
+    """Get pool (default pool of the running event loop if None)"""
+    if pool is not None:
+        return pool
+    loop = asyncio.get_running_loop()
+    default = _default_pools.get(loop)
+    if default is None:
+        default = _default_pools[loop] = AsyncSessionPool()
+    return default
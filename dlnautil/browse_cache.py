@@ -0,0 +1,168 @@
+from collections import OrderedDict
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from typing import Optional, Tuple
+
+_logger = logging.getLogger('dlnautil')
+
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+DEFAULT_VALIDATE_INTERVAL = 5.0
+
+# names of files written in directory (clear removes only these)
+_FILE_PREFIX = 'dlnautil-browse-'
+_FILE_SUFFIX = '.json'
+_TMP_SUFFIX = '.tmp'
+
+
+class BrowseCache:
+    """Cache of Browse responses keyed by (server, ObjectID, page)
+
+    Entries are kept in an in-memory LRU bounded by max_bytes. If directory
+    is given, entries are also written there as json files (named
+    dlnautil-browse-*.json, other files are left alone) so that a new
+    process starts with a warm cache. Validity is decided by content_browse
+    with the UpdateID of each response and GetSystemUpdateID of the server.
+    """
+
+    def __init__(self, max_bytes: int = DEFAULT_MAX_BYTES, directory: str = None,
+                 validate_interval: float = DEFAULT_VALIDATE_INTERVAL):
+        """
+        :param max_bytes: max total size of entries in memory
+        :param directory: directory of on-disk tier (memory only if None)
+        :param validate_interval: seconds to reuse GetSystemUpdateID result of a server
+        """
+        self.max_bytes = max_bytes
+        self.directory = directory
+        self.validate_interval = validate_interval
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._size = 0
+        self._system_update_ids = {}
+        self._lock = threading.Lock()
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    @staticmethod
+    def key(url: str, item_id: str, start_index: int, count: int, criteria: str = None,
+            browse_filter: str = None) -> Tuple:
+        key = (url, item_id, start_index, count)
+        if criteria is not None:
+            key += (criteria,)
+        if browse_filter and browse_filter != '*':
+            key += (f'filter={browse_filter}',)
+        return key
+
+    def _path(self, key: Tuple) -> str:
+        name = hashlib.sha1(json.dumps(key).encode('utf-8')).hexdigest()
+        return os.path.join(self.directory, f'{_FILE_PREFIX}{name}{_FILE_SUFFIX}')
+
+    def _put_memory(self, key: Tuple, entry: dict, size: int):
+        old = self._entries.pop(key, None)
+        if old:
+            self._size -= old[1]
+        self._entries[key] = (entry, size)
+        self._size += size
+        while self._size > self.max_bytes and self._entries:
+            _, (_, evicted) = self._entries.popitem(last=False)
+            self._size -= evicted
+
+    def get(self, key: Tuple) -> Optional[dict]:
+        """Get entry
+
+        :param key: key made by BrowseCache.key
+        :return: entry dict (items, returned, total, update_id, system_update_id) or None
+        """
+        with self._lock:
+            value = self._entries.get(key)
+            if value:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return value[0]
+
+        entry = None
+        if self.directory:
+            path = self._path(key)
+            if os.path.exists(path):
+                try:
+                    with open(path, encoding='utf-8') as f:
+                        s = f.read()
+                    entry = json.loads(s)
+                    with self._lock:
+                        self._put_memory(key, entry, len(s))
+                except (OSError, ValueError) as e:
+                    _logger.warning(f'cache read error : {path} : {e}')
+
+        with self._lock:
+            if entry:
+                self.hits += 1
+            else:
+                self.misses += 1
+        return entry
+
+    def put(self, key: Tuple, entry: dict):
+        """Put entry
+
+        :param key: key made by BrowseCache.key
+        :param entry: entry dict (items, returned, total, update_id, system_update_id)
+        """
+        s = json.dumps(entry, ensure_ascii=False)
+        with self._lock:
+            self._put_memory(key, entry, len(s))
+
+        if self.directory:
+            path = self._path(key)
+            tmp = None
+            try:
+                # a temp file of its own, puts of the same key may run at once in crawl workers
+                fd, tmp = tempfile.mkstemp(suffix=_TMP_SUFFIX, prefix=_FILE_PREFIX, dir=self.directory)
+                with open(fd, 'w', encoding='utf-8') as f:
+                    f.write(s)
+                os.replace(tmp, path)
+            except OSError as e:
+                _logger.warning(f'cache write error : {path} : {e}')
+                if tmp:
+                    try:
+                        os.remove(tmp)
+                    except OSError:
+                        pass
+
+    def get_system_update_id(self, url: str) -> Tuple[bool, Optional[str]]:
+        """Get SystemUpdateID of server checked within validate_interval
+
+        :param url: control URL of server
+        :return: (whether checked recently, SystemUpdateID)
+        """
+        with self._lock:
+            value = self._system_update_ids.get(url)
+        if value and time.time() - value[0] < self.validate_interval:
+            return True, value[1]
+        return False, None
+
+    def set_system_update_id(self, url: str, system_update_id: Optional[str]):
+        with self._lock:
+            self._system_update_ids[url] = (time.time(), system_update_id)
+
+    def size(self) -> int:
+        """Total size of entries in memory"""
+        return self._size
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+            self._system_update_ids.clear()
+        if self.directory:
+            for name in os.listdir(self.directory):
+                # temp files are left by an interrupted put
+                if name.startswith(_FILE_PREFIX) and name.endswith((_FILE_SUFFIX, _TMP_SUFFIX)):
+                    try:
+                        os.remove(os.path.join(self.directory, name))
+                    except FileNotFoundError:
+                        # renamed or removed by a concurrent put / clear
+                        pass
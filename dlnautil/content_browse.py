@@ -1,204 +1,1039 @@
 import argparse
+import asyncio
+from collections import deque
+import contextlib
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 from enum import Enum
-import json
+import functools
 import logging
-import re
 import requests
-from typing import List, Tuple
-
+import sys
+import threading
+import time
+from typing import AsyncIterator, Callable, Dict, Iterator, List, Optional, Tuple
+from urllib.parse import urlparse
 from xml.etree import ElementTree
+from xml.sax.saxutils import escape
+
+import async_http
+from browse_cache import BrowseCache
+import content_export
+import metrics
+import search_criteria
+from http_session import SessionPool, get_pool
 
 logging.basicConfig(level=logging.INFO)
 _logger = logging.getLogger('dlnautil')
 
+DEFAULT_SERVER_CONCURRENCY = 4
+# RequestedCount of Browse (0 means as many as the server returns at once)
+DEFAULT_PAGE_SIZE = 0
+# max number of page requests in flight for one container
+DEFAULT_MAX_IN_FLIGHT = 4
+DEFAULT_PAGE_RETRIES = 2
+
+# max number of page requests in flight to each server (by host:port)
+_server_limits = {}
+_server_limits_lock = threading.Lock()
+
+
+class _RequestLimit:
+    """Max number of requests in flight, which can be changed while held"""
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.active = 0
+        self._condition = threading.Condition()
+
+    def set_limit(self, limit: int):
+        with self._condition:
+            self.limit = limit
+            self._condition.notify_all()
+
+    def __enter__(self):
+        with self._condition:
+            while self.active >= self.limit:
+                self._condition.wait()
+            self.active += 1
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        with self._condition:
+            self.active -= 1
+            self._condition.notify()
+
 
 class ClassType(Enum):
     CONTAINER = 'container'
     ITEM = 'item'
 
-    def extract(self, c: ElementTree):
-        ret = []
-        ct = self.value
-        for m in re.finditer(f'<{ct} .*</{ct}>', c.text):
-            items = m.group().split(f'</{ct}>')
-            for i in items:
-                item = Item(i, self.value)
-                if item:
-                    ret.append(item)
-        return ret
+
+# DIDL-Lite attributes of container/item element and its first res element
+_OBJECT_ATTRS = ('id', 'parentID', 'childCount')
+_RES_ATTRS = ('protocolInfo', 'resolution', 'duration', 'size')
+# DIDL-Lite property elements (local name without namespace)
+_PROPERTY_TAGS = ('title', 'date', 'class', 'album', 'extension', 'modificationTime', 'addedTime', 'lastUpdated')
+
+# fields of Item in the order of its values tuple
+_FIELDS = tuple(sys.intern(f) for f in _OBJECT_ATTRS + _RES_ATTRS + _PROPERTY_TAGS + ('res',))
+_FIELD_INDEX = {f: i for i, f in enumerate(_FIELDS)}
+_INT_FIELDS = frozenset(('childCount', 'size', 'modificationTime', 'addedTime', 'lastUpdated'))
+# fields whose values repeat among items (shared as interned strings)
+_INTERN_FIELDS = frozenset(('parentID', 'protocolInfo', 'resolution', 'date', 'class', 'album', 'extension'))
+
+
+def _convert(field: str, value: str):
+    if field in _INT_FIELDS:
+        try:
+            return int(value)
+        except ValueError:
+            return value
+    if field in _INTERN_FIELDS:
+        return sys.intern(value)
+    return value
 
 
 class Item:
+    """Container or item of DLNA ContentDirectory
+
+    Values are kept in a tuple aligned to the fixed field names, so an item
+    costs one small object and no per-item dict. childCount, size and
+    timestamps are int.
+    """
+    __slots__ = ('class_type', '_values')
 
-    def __init__(self, item_str: str, ctype: str):
-        item = {}
-        _logger.debug(item_str)
-        attrs = ['id', 'parentID', 'childCount', 'protocolInfo', 'resolution', 'duration', 'size']
-        for a in attrs:
-            m = re.search(f'{a}=\"([^\s]+)\"', item_str)
-            if m:
-                v = m.group().replace(f'{a}=\"', '').replace(f'\"', '')
-                item[a] = v
-
-        attrs = ['dc\:title', 'dc\:date', 'upnp\:class','upnp\:album',
-                 'pv\:extension', 'pv\:modificationTime', 'pv\:addedTime', 'pv\:lastUpdated']
-        for a in attrs:
-            m = re.search(f'<{a}>([^\s]+)</{a}>', item_str)
-            if m:
-                a_ = a.replace('\\', '')
-                v = m.group().replace(f'<{a_}>', '').replace(f'</{a_}>', '')
-                item[a.split(':')[-1]] = v
-
-        m = re.search(f'<res .*>([^\s]+)</res>', item_str)
-        if m:
-            v = m.group(1).replace(f'<{a_}>', '').replace(f'</{a_}>', '')
-            item['res'] = v
-
-        _logger.debug(f'{item_str} : {item}')
-        self.item = item
+    def __init__(self, item: dict, ctype: str):
+        values = [None] * len(_FIELDS)
+        for k, v in item.items():
+            i = _FIELD_INDEX.get(k)
+            if i is not None and v is not None:
+                values[i] = _convert(k, v) if isinstance(v, str) else v
+        self._values = tuple(values)
         self.class_type = ctype
 
-    def get_data(self):
-        return self.item
+    @classmethod
+    def _from_values(cls, values: tuple, ctype: str) -> 'Item':
+        item = cls.__new__(cls)
+        item._values = values
+        item.class_type = ctype
+        return item
 
+    def get(self, key: str, default=None):
+        i = _FIELD_INDEX.get(key)
+        if i is None:
+            return default
+        v = self._values[i]
+        return default if v is None else v
 
-def _parse_xml_recursive(node: ElementTree, level: int = 0) -> Tuple[List, int, int]:
-    level = level+1
-    ret = []
-    returned = 0
-    total = 0
-    for c in node:
-        # print(f'{level} *** {c.tag} : {c.attrib} : {c.text}')
-        results, returned_, total_ = _parse_xml_recursive(c, level)
-        ret.extend(results)
+    def get_data(self) -> dict:
+        """Get attributes of the item as a new dict"""
+        return {k: v for k, v in zip(_FIELDS, self._values) if v is not None}
+
+    @property
+    def item(self) -> dict:
+        return self.get_data()
 
-        if 'Result' == c.tag:
-            _logger.debug('Result------')
-            ret.extend(ClassType.CONTAINER.extract(c))
-            ret.extend(ClassType.ITEM.extract(c))
-        elif 'NumberReturned' == c.tag:
-            _logger.debug(f'returned count = {c.text}')
-            returned = int(c.text)
-        elif 'TotalMatches' == c.tag:
-            _logger.debug(f'total count = {c.text}')
-            total = int(c.text)
 
-        if returned_ > 0 or total_ > 0:
-            returned = returned_
-            total = total_
+_local_names = {}
 
-    # print(f'level={level}: {returned}, {total}')
 
-    return ret, returned, total
+def _local_name(tag: str) -> str:
+    name = _local_names.get(tag)
+    if name is None:
+        name = _local_names[tag] = tag.rpartition('}')[2]
+    return name
 
 
-def _parse(s: str) -> Tuple[List, int, int]:
+# Browse/Search Filter property of each field
+_FILTER_PROPERTIES = {
+    'id': '@id', 'parentID': '@parentID', 'childCount': '@childCount',
+    'protocolInfo': 'res', 'resolution': 'res@resolution', 'duration': 'res@duration', 'size': 'res@size',
+    'title': 'dc:title', 'date': 'dc:date', 'class': 'upnp:class', 'album': 'upnp:album',
+    'extension': 'pv:extension', 'modificationTime': 'pv:modificationTime', 'addedTime': 'pv:addedTime',
+    'lastUpdated': 'pv:lastUpdated', 'res': 'res',
+}
+# fields always parsed (needed to walk containers)
+_REQUIRED_FIELDS = ('id', 'class')
+
+
+class _Projection:
+    """Filter string and parse tables for a set of fields"""
+
+    def __init__(self, fields: Tuple[str, ...] = None):
+        if fields is None:
+            self.filter = '*'
+            fields = _FIELDS
+        else:
+            unknown = [f for f in fields if f not in _FIELD_INDEX]
+            if unknown:
+                raise ValueError(f'unknown fields : {unknown}')
+            fields = set(fields) | set(_REQUIRED_FIELDS)
+            self.filter = ','.join(sorted(set(_FILTER_PROPERTIES[f] for f in fields)))
+        self.object_attrs = tuple((a, _FIELD_INDEX[a]) for a in _OBJECT_ATTRS if a in fields)
+        self.res_attrs = tuple((a, _FIELD_INDEX[a]) for a in _RES_ATTRS if a in fields)
+        self.properties = {t: _FIELD_INDEX[t] for t in _PROPERTY_TAGS if t in fields}
+        self.res = 'res' in fields or bool(self.res_attrs)
+        self.res_url = 'res' in fields
+
+
+@functools.lru_cache(maxsize=64)
+def _projection(fields: Tuple[str, ...] = None) -> _Projection:
+    return _Projection(fields)
+
+
+def _fields_key(fields: List[str] = None) -> Optional[Tuple[str, ...]]:
+    return tuple(sorted(set(fields))) if fields is not None else None
+
+
+_RES_INDEX = _FIELD_INDEX['res']
+
+
+def _parse_didl(didl: str, projection: _Projection = None) -> List[Item]:
+    """Parse DIDL-Lite document of Browse Result into containers and items in document order
+
+    Only the fields of projection are extracted (all fields if None).
+    """
+    try:
+        root = ElementTree.fromstring(didl)
+    except ElementTree.ParseError as e:
+        _logger.error(f'DIDL-Lite parse error : {e}')
+        return []
+
+    projection = projection if projection else _projection()
+    object_attrs = projection.object_attrs
+    res_attrs = projection.res_attrs
+    properties = projection.properties
+    want_res = projection.res
+    res_url = projection.res_url
+
+    ctypes = {ClassType.CONTAINER.value: ClassType.CONTAINER.value, ClassType.ITEM.value: ClassType.ITEM.value}
+    ret = []
+    for node in root:
+        ctype = ctypes.get(_local_name(node.tag))
+        if ctype is None:
+            continue
+
+        values = [None] * len(_FIELDS)
+        attrib = node.attrib
+        for a, i in object_attrs:
+            if a in attrib:
+                values[i] = _convert(a, attrib[a])
+        has_res = False
+        for c in node:
+            tag = _local_name(c.tag)
+            if tag == 'res':
+                if want_res and not has_res:
+                    has_res = True
+                    attrib = c.attrib
+                    for a, i in res_attrs:
+                        if a in attrib:
+                            values[i] = _convert(a, attrib[a])
+                    if res_url:
+                        values[_RES_INDEX] = c.text.strip() if c.text else ''
+            else:
+                i = properties.get(tag)
+                if i is not None and values[i] is None:
+                    values[i] = _convert(tag, c.text.strip() if c.text else '')
+
+        ret.append(Item._from_values(tuple(values), ctype))
+    return ret
+
+
+def _parse(s: str, projection: _Projection = None) -> Tuple[List, int, int, str]:
     et = ElementTree.fromstring(s)
-    ret, returned, total = _parse_xml_recursive(et)
-    return ret, returned, total
+    ret = []
+    returned = 0
+    total = 0
+    update_id = None
+    for c in et.iter():
+        tag = _local_name(c.tag)
+        if 'Result' == tag:
+            ret = _parse_didl(c.text, projection) if c.text else []
+        elif 'NumberReturned' == tag:
+            _logger.debug(f'returned count = {c.text}')
+            returned = int(c.text)
+        elif 'TotalMatches' == tag:
+            _logger.debug(f'total count = {c.text}')
+            total = int(c.text)
+        elif 'UpdateID' == tag:
+            update_id = c.text
+    return ret, returned, total, update_id
 
 
-def _request_dlna_one(url: str, st: str, item_id: str = '0', start_index: int = 0) -> Tuple[List, int, int]:
-    headers = {'Content-Type': "text/xml; charset=utf-8", 'SOAPACTION': f'{st}#Browse'}
+def _soap_request(st: str, action: str, arguments: str) -> Tuple[bytes, Dict[str, str]]:
+    headers = {'Content-Type': "text/xml; charset=utf-8", 'SOAPACTION': f'{st}#{action}'}
 
     # print(headers)
     data = f"""\
         <?xml version="1.0"?>
         <s:Envelope xmlns:s="http://schemas.xmlsoap.org/soap/envelope/" s:encodingStyle="http://schemas.xmlsoap.org/soap/encoding/">
           <s:Body>
-            <u:Browse xmlns:u="{st}">
-              <ObjectID>{item_id}</ObjectID>
-              <BrowseFlag>BrowseDirectChildren</BrowseFlag>
-              <Filter>*</Filter>
-              <StartingIndex>{start_index}</StartingIndex>
-              <RequestedCount>0</RequestedCount>
-              <SortCriteria></SortCriteria>
-            </u:Browse>
+            <u:{action} xmlns:u="{st}">{arguments}
+            </u:{action}>
           </s:Body>
         </s:Envelope>
         """
-    data = data.encode('utf-8')
+    return data.encode('utf-8'), headers
+
+
+def _response_text(action: str, ret, elapsed: float) -> str:
+    """Check status of response (requests.Response or async_http.AsyncResponse) and get its body"""
+    if ret.status_code != 200:
+        _logger.error(f'error{ret.status_code}')
+        ret.raise_for_status()
+    m = metrics.get_metrics()
+    if m is not None:
+        m.observe(metrics.REQUEST_SECONDS, elapsed, action=action)
+        m.observe(metrics.RESPONSE_BYTES, len(ret.content), action=action)
+    return ret.text
+
+
+def _request_error(action: str):
+    m = metrics.get_metrics()
+    if m is not None:
+        m.inc(metrics.REQUEST_ERRORS, action=action)
+
+
+def _request_action(url: str, st: str, action: str, arguments: str, pool: SessionPool = None) -> str:
+    data, headers = _soap_request(st, action, arguments)
     # print(url)
     # print(data)
-    ret = requests.post(url, data=data, headers=headers)
+    start = time.perf_counter()
+    try:
+        ret = get_pool(pool).post(url, data=data, headers=headers)
+        return _response_text(action, ret, time.perf_counter() - start)
+    except requests.RequestException:
+        _request_error(action)
+        raise
+
+
+async def _async_request_action(url: str, st: str, action: str, arguments: str,
+                                pool: async_http.AsyncSessionPool = None) -> str:
+    data, headers = _soap_request(st, action, arguments)
+    start = time.perf_counter()
+    try:
+        ret = await async_http.get_pool(pool).post(url, data=data, headers=headers)
+        return _response_text(action, ret, time.perf_counter() - start)
+    except requests.RequestException:
+        _request_error(action)
+        raise
+
 
-    items = []
-    if ret.status_code == 200:
-        result = ret.text
-        # print(ret.text)
-        items, returned, total = _parse(result)
+def _page_request(item_id: str, start_index: int, requested_count: int, criteria: str,
+                  projection: _Projection) -> Tuple[str, str]:
+    if criteria is None:
+        action = 'Browse'
+        arguments = f"""
+              <ObjectID>{escape(item_id)}</ObjectID>
+              <BrowseFlag>BrowseDirectChildren</BrowseFlag>"""
     else:
-        _logger.error(f'error{ret.status_code}')
+        action = 'Search'
+        arguments = f"""
+              <ContainerID>{escape(item_id)}</ContainerID>
+              <SearchCriteria>{escape(criteria)}</SearchCriteria>"""
+    arguments += f"""
+              <Filter>{escape(projection.filter)}</Filter>
+              <StartingIndex>{start_index}</StartingIndex>
+              <RequestedCount>{requested_count}</RequestedCount>
+              <SortCriteria></SortCriteria>"""
+    return action, arguments
+
+
+def _parse_page(action: str, result: str, projection: _Projection) -> Tuple[List, int, int, str]:
+    m = metrics.get_metrics()
+    if m is None:
+        return _parse(result, projection)
+    start = time.perf_counter()
+    ret = _parse(result, projection)
+    m.observe(metrics.PARSE_SECONDS, time.perf_counter() - start, action=action)
+    m.inc(metrics.PAGES, action=action)
+    m.inc(metrics.ITEMS_PARSED, len(ret[0]), action=action)
+    return ret
+
+
+def _request_dlna_one(url: str, st: str, item_id: str = '0', start_index: int = 0,
+                      pool: SessionPool = None, requested_count: int = 0,
+                      criteria: str = None, fields: Tuple[str, ...] = None,
+                      limit: _RequestLimit = None) -> Tuple[List, int, int, str]:
+    projection = _projection(fields)
+    action, arguments = _page_request(item_id, start_index, requested_count, criteria, projection)
+    # the limit of the call is taken first not to hold a slot of the server while waiting
+    with limit if limit else contextlib.nullcontext(), _get_server_limit(url):
+        result = _request_action(url, st, action, arguments, pool)
+    # print(result)
+    return _parse_page(action, result, projection)
+
+
+async def _async_request_dlna_one(url: str, st: str, item_id: str = '0', start_index: int = 0,
+                                  pool: async_http.AsyncSessionPool = None, requested_count: int = 0,
+                                  criteria: str = None,
+                                  fields: Tuple[str, ...] = None) -> Tuple[List, int, int, str]:
+    projection = _projection(fields)
+    action, arguments = _page_request(item_id, start_index, requested_count, criteria, projection)
+    result = await _async_request_action(url, st, action, arguments, pool)
+    return _parse_page(action, result, projection)
+
+
+def get_system_update_id(url: str, st: str, pool: SessionPool = None) -> Optional[str]:
+    """Get SystemUpdateID of DLNA ContentDirectory server
+
+    :param url: control URL of DLNA ContentDirectory server
+    :param st: service type
+    :param pool: HTTP session pool (default pool if None)
+    :return: SystemUpdateID (None if the server does not answer)
+    """
+    try:
+        result = _request_action(url, st, 'GetSystemUpdateID', '', pool)
+        for c in ElementTree.fromstring(result).iter():
+            if _local_name(c.tag) == 'Id':
+                return c.text
+    except (requests.RequestException, ElementTree.ParseError) as e:
+        _logger.warning(f'GetSystemUpdateID error : {e}')
+    return None
+
+
+# seconds to reuse SearchCaps of a server
+SEARCH_CAPABILITIES_TTL = 600.0
+
+# (url, st) -> (time of reply, SearchCaps)
+_search_capabilities = {}
+_search_capabilities_lock = threading.Lock()
+
+
+def get_search_capabilities(url: str, st: str, pool: SessionPool = None) -> List[str]:
+    """Get SearchCaps of DLNA ContentDirectory server
+
+    Successful replies are cached for SEARCH_CAPABILITIES_TTL seconds.
+    A failed request is not cached, so the next call asks again.
+
+    :param url: control URL of DLNA ContentDirectory server
+    :param st: service type
+    :param pool: HTTP session pool (default pool if None)
+    :return: list of searchable properties (['*'] if any, empty if the server can not search)
+    """
+    key = (url, st)
+    with _search_capabilities_lock:
+        cached = _search_capabilities.get(key)
+    if cached and time.monotonic() - cached[0] < SEARCH_CAPABILITIES_TTL:
+        return cached[1]
+
+    caps = []
+    try:
+        result = _request_action(url, st, 'GetSearchCapabilities', '', pool)
+        for c in ElementTree.fromstring(result).iter():
+            if _local_name(c.tag) == 'SearchCaps' and c.text:
+                caps = [cap.strip() for cap in c.text.split(',') if cap.strip()]
+    except (requests.RequestException, ElementTree.ParseError) as e:
+        _logger.warning(f'GetSearchCapabilities error : {e}')
+        return caps
+    _logger.debug(f'SearchCaps={caps}')
+    with _search_capabilities_lock:
+        _search_capabilities[key] = (time.monotonic(), caps)
+    return caps
 
-    return items, returned, total
 
+def clear_search_capabilities():
+    """Forget cached SearchCaps of all servers"""
+    with _search_capabilities_lock:
+        _search_capabilities.clear()
 
-def _request_dlna(url: str, st: str, item_id: str = '0') -> List:
-    results, returned, total = _request_dlna_one(url, st, item_id, start_index=0)
 
-    if returned < total:
-        start_index = returned
-        while start_index < total:
-            tmp, returned, total = _request_dlna_one(url, st, item_id, start_index=start_index)
-            results.extend(tmp)
-            _logger.debug(f'requested : {start_index} ~ {start_index + returned - 1} / {total}')
-            if returned == 0:
+def _request_window(url: str, st: str, item_id: str, start_index: int, count: int, pool: SessionPool = None,
+                    page_size: int = 0, retries: int = DEFAULT_PAGE_RETRIES, criteria: str = None,
+                    fields: Tuple[str, ...] = None, limit: _RequestLimit = None) -> List:
+    """Request items [start_index, start_index + count) and retry only the missing part"""
+    results = []
+    failures = 0
+    while len(results) < count:
+        index = start_index + len(results)
+        requested = min(page_size, count - len(results)) if page_size else count - len(results)
+        try:
+            tmp, returned, _, _ = _request_dlna_one(url, st, item_id, index, pool, requested, criteria, fields,
+                                                    limit)
+        except requests.RequestException as e:
+            _logger.warning(f'request error : {index} ~ {index + requested - 1} : {e}')
+            tmp, returned = [], 0
+        _logger.debug(f'requested : {index} ~ {index + returned - 1}')
+        results.extend(tmp[:count - len(results)])
+        if returned == 0:
+            failures += 1
+            if failures > retries:
+                _logger.error(f'missing items : {index} ~ {start_index + count - 1} of {item_id}')
+                break
+            time.sleep(0.1 * failures)
+    return results
+
+
+def _cache_entry(items: List, returned: int, total: int, update_id: str, system_update_id: str) -> dict:
+    return {'items': [[i.class_type, i.get_data()] for i in items], 'returned': returned, 'total': total,
+            'update_id': update_id, 'system_update_id': system_update_id}
+
+
+def _cached_items(entry: dict) -> List:
+    return [Item(dict(data), ctype) for ctype, data in entry['items']]
+
+
+def _iter_request_dlna(url: str, st: str, item_id: str = '0', pool: SessionPool = None,
+                       page_size: int = None, max_in_flight: int = None, cache: BrowseCache = None,
+                       criteria: str = None, fields: Tuple[str, ...] = None,
+                       limit: _RequestLimit = None) -> Iterator[List]:
+    """Yield each page of Browse (or Search if criteria is given) results of item_id in order
+    as soon as it is parsed
+
+    The first response tells TotalMatches, then the remaining StartingIndex
+    windows are requested concurrently (at most max_in_flight at once).
+    With cache, pages are served locally while the SystemUpdateID of the
+    server, or the UpdateID of the first page, is unchanged.
+    """
+    page_size = DEFAULT_PAGE_SIZE if page_size is None else page_size
+    max_in_flight = max_in_flight if max_in_flight else DEFAULT_MAX_IN_FLIGHT
+    browse_filter = _projection(fields).filter
+
+    validated = False
+    system_update_id = None
+    first = None
+    m = metrics.get_metrics() if cache else None
+    if cache:
+        checked, system_update_id = cache.get_system_update_id(url)
+        if not checked:
+            system_update_id = get_system_update_id(url, st, pool)
+            cache.set_system_update_id(url, system_update_id)
+        first = cache.get(BrowseCache.key(url, item_id, 0, page_size, criteria, browse_filter))
+        validated = bool(first) and system_update_id is not None and first['system_update_id'] == system_update_id
+
+    if m is not None:
+        m.inc(metrics.CACHE_REQUESTS, cache='browse', result='hit' if validated else 'miss')
+    if validated:
+        _logger.debug(f'cache hit : {item_id} (SystemUpdateID={system_update_id})')
+        results, returned, total = _cached_items(first), first['returned'], first['total']
+    else:
+        for retry in range(DEFAULT_PAGE_RETRIES, -1, -1):
+            try:
+                results, returned, total, update_id = _request_dlna_one(url, st, item_id, 0, pool, page_size,
+                                                                        criteria, fields, limit)
                 break
-            start_index += returned
+            except requests.RequestException as e:
+                if retry == 0:
+                    raise
+                _logger.warning(f'request error : {item_id} : {e}')
+        if cache:
+            validated = bool(first) and update_id is not None and first['update_id'] == update_id
+            cache.put(BrowseCache.key(url, item_id, 0, page_size, criteria, browse_filter),
+                      _cache_entry(results, returned, total, update_id, system_update_id))
+    count = len(results)
+    yield results
 
-    if len(results) < total:
-        _logger.error(f'Can not get all items. {len(results)} / {total}')
+    def request_window(start: int, window_count: int) -> List:
+        key = BrowseCache.key(url, item_id, start, window_count, criteria, browse_filter)
+        if validated:
+            entry = cache.get(key)
+            if m is not None:
+                m.inc(metrics.CACHE_REQUESTS, cache='browse', result='hit' if entry else 'miss')
+            if entry:
+                return _cached_items(entry)
+        elif m is not None:
+            m.inc(metrics.CACHE_REQUESTS, cache='browse', result='miss')
+        tmp = _request_window(url, st, item_id, start, window_count, pool, page_size, criteria=criteria,
+                              fields=fields, limit=limit)
+        if cache and len(tmp) == window_count:
+            cache.put(key, _cache_entry(tmp, len(tmp), total, None, system_update_id))
+        return tmp
+
+    window = page_size if page_size else returned
+    if 0 < returned < total:
+        def submit(start: int):
+            return executor.submit(request_window, start, min(window, total - start))
+
+        starts = iter(range(returned, total, window))
+        with ThreadPoolExecutor(max_workers=max_in_flight) as executor:
+            in_flight = deque(submit(start) for _, start in zip(range(max_in_flight), starts))
+            while in_flight:
+                tmp = in_flight.popleft().result()
+                start = next(starts, None)
+                if start is not None:
+                    in_flight.append(submit(start))
+                count += len(tmp)
+                yield tmp
+
+    if count < total:
+        _logger.error(f'Can not get all items. {count} / {total}')
+
+
+def _request_dlna(url: str, st: str, item_id: str = '0', pool: SessionPool = None,
+                  page_size: int = None, max_in_flight: int = None, cache: BrowseCache = None,
+                  fields: Tuple[str, ...] = None, limit: _RequestLimit = None) -> List:
+    results = []
+    for page in _iter_request_dlna(url, st, item_id, pool, page_size, max_in_flight, cache, fields=fields,
+                                   limit=limit):
+        results.extend(page)
     return results
 
 
-def _get_items_recursive(url: str, st: str, items: List) -> List:
+def _is_container(item: 'Item') -> bool:
+    return ClassType.CONTAINER.value in item.get('class', '')
+
+
+def _iter_items_recursive(url: str, st: str, container_ids: List[str], pool: SessionPool = None,
+                          page_size: int = None, max_in_flight: int = None,
+                          cache: BrowseCache = None, fields: Tuple[str, ...] = None) -> Iterator['Item']:
+    # same order as the depth first walk: children of a container, then their descendants
+    for container_id in container_ids:
+        child_ids = []
+        for page in _iter_request_dlna(url, st, container_id, pool, page_size, max_in_flight, cache, fields=fields):
+            for item in page:
+                if _is_container(item):
+                    child_ids.append(item.get('id'))
+                yield item
+        yield from _iter_items_recursive(url, st, child_ids, pool, page_size, max_in_flight, cache, fields)
+
+
+def set_server_concurrency(url: str, limit: int):
+    """Set max number of concurrent Browse requests to a server
+
+    The limit is shared by all calls, and applies to requests already waiting.
+
+    :param url: control URL of DLNA ContentDirectory server
+    :param limit: max number of requests in flight to the server
+    """
+    _get_server_limit(url).set_limit(limit)
+
+
+def _get_server_limit(url: str) -> _RequestLimit:
+    netloc = urlparse(url).netloc
+    with _server_limits_lock:
+        limit = _server_limits.get(netloc)
+        if limit is None:
+            limit = _server_limits[netloc] = _RequestLimit(DEFAULT_SERVER_CONCURRENCY)
+        return limit
+
+
+class CrawlStats:
+    """Throughput of a recursive crawl"""
+
+    def __init__(self):
+        self.containers = 0
+        self.items = 0
+        self.elapsed = 0.0
+
+    def containers_per_sec(self) -> float:
+        return self.containers / self.elapsed if self.elapsed > 0 else 0.0
+
+    def items_per_sec(self) -> float:
+        return self.items / self.elapsed if self.elapsed > 0 else 0.0
+
+    def __str__(self):
+        return f'containers={self.containers} items={self.items} elapsed={self.elapsed:.3f}s ' \
+               f'({self.containers_per_sec():.1f} containers/s, {self.items_per_sec():.1f} items/s)'
+
+
+def _walk_order(item_id: str, children: Dict[str, List]) -> List:
+    # reassemble in the serial walk order (children of a container, then their descendants)
     ret = []
-    for child in items:
-        item_data = child.get_data()
-        if ClassType.CONTAINER.value in item_data.get('class', ''):
-            results = _request_dlna(url, st, item_data['id'])
-            results.extend(_get_items_recursive(url, st, results))
-            ret.extend(results)
-
-    _logger.debug(f'*** {len(ret)}')
+    stack = [item_id]
+    while stack:
+        results = children.get(stack.pop(), [])
+        ret.extend(results)
+        stack.extend(reversed([i.get('id') for i in results if _is_container(i)]))
     return ret
 
 
-def browse(url: str, st: str, item_id: str = '0', recursive: str = None, output_filename: str = None) -> List:
-    """Browse contents in DLNA ContentDirectory server
+def crawl(url: str, st: str, item_id: str = '0', concurrency: int = None, pool: SessionPool = None,
+          page_size: int = None, max_in_flight: int = None, cache: BrowseCache = None,
+          on_results: Callable[[List], None] = None, fields: List[str] = None) -> Tuple[List, CrawlStats]:
+    """Browse all contents under item_id recursively with a bounded worker pool
+
+    Containers found in each response are pushed to a frontier and browsed
+    by the workers concurrently. The returned list has the same order as
+    the serial depth first walk.
+
+    :param url: control URL of DLNA ContentDirectory server
+    :param st: service type
+    :param item_id: item_id of DLNA ContentDirectory server
+    :param concurrency: max number of requests in flight for this crawl
+        (the limit of the server set by set_server_concurrency applies too)
+    :param pool: HTTP session pool (default pool if None)
+    :param page_size: RequestedCount of each Browse request (0 means server default)
+    :param max_in_flight: max number of concurrent page requests for one container
+    :param cache: browse cache (no cache if None)
+    :param on_results: called with the children of each container as soon as it is browsed
+        (in the order of completion)
+    :param fields: fields to request with Filter (all fields if None)
+    :return: list of contents and throughput of the crawl
+    """
+    limit = _RequestLimit(concurrency) if concurrency else None
+    workers = concurrency if concurrency else _get_server_limit(url).limit
+    fields = _fields_key(fields)
+
+    def fetch(container_id: str) -> List:
+        return _request_dlna(url, st, container_id, pool, page_size, max_in_flight, cache, fields, limit)
+
+    stats = CrawlStats()
+    children: Dict[str, List] = {}
+    seen = {item_id}
+    start = time.time()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        pending = {executor.submit(fetch, item_id): item_id}
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                container_id = pending.pop(future)
+                results = future.result()
+                children[container_id] = results
+                stats.containers += 1
+                stats.items += len(results)
+                if on_results:
+                    on_results(results)
+                for item in results:
+                    child_id = item.get('id')
+                    if _is_container(item) and child_id not in seen:
+                        seen.add(child_id)
+                        pending[executor.submit(fetch, child_id)] = child_id
+    stats.elapsed = time.time() - start
+
+    _logger.info(f'crawl {url} : {stats}')
+    return _walk_order(item_id, children), stats
+
+
+def iter_browse(url: str, st: str, item_id: str = '0', recursive: str = None, pool: SessionPool = None,
+                page_size: int = None, max_in_flight: int = None, cache: BrowseCache = None,
+                fields: List[str] = None) -> Iterator['Item']:
+    """Browse contents in DLNA ContentDirectory server lazily
+
+    Browse requests are sent page by page, and items of a page are yielded
+    as soon as the page is parsed.
 
     :param url: control URL of DLNA ContentDirectory server
     :param st: service type
     :param item_id: item_id of DLNA ContentDirectory server
     :param recursive: whether search contents recursively if item is container
-    :param output_filename: json output filename if want to output resuts to file
-    :return: list of contents
+    :param pool: HTTP session pool (default pool if None)
+    :param page_size: RequestedCount of each Browse request (0 means server default)
+    :param max_in_flight: max number of concurrent page requests for one container
+    :param cache: browse cache (no cache if None)
+    :param fields: fields to request with Filter (all fields if None, id and class are always included)
+    :return: iterator of contents
     """
+    item_id = item_id if item_id else '0'
+    fields = _fields_key(fields)
     _logger.debug(f'request item_id={item_id}')
 
-    items = _request_dlna(url, st, item_id)
-
     if recursive == 'true':
-        items.extend(_get_items_recursive(url, st, items))
+        yield from _iter_items_recursive(url, st, [item_id], pool, page_size, max_in_flight, cache, fields)
+    else:
+        for page in _iter_request_dlna(url, st, item_id, pool, page_size, max_in_flight, cache, fields=fields):
+            yield from page
+
+
+def browse(url: str, st: str, item_id: str = '0', recursive: str = None, output_filename: str = None,
+           concurrency: int = None, pool: SessionPool = None, page_size: int = None,
+           max_in_flight: int = None, cache: BrowseCache = None, output_format: str = None,
+           fields: List[str] = None) -> List:
+    """Browse contents in DLNA ContentDirectory server
 
+    :param url: control URL of DLNA ContentDirectory server
+    :param st: service type
+    :param item_id: item_id of DLNA ContentDirectory server
+    :param recursive: whether search contents recursively if item is container
+    :param output_filename: output filename if want to output resuts to file (written page by page)
+    :param concurrency: max number of concurrent requests to the server for recursive browse
+    :param pool: HTTP session pool (default pool if None)
+    :param page_size: RequestedCount of each Browse request (0 means server default)
+    :param max_in_flight: max number of concurrent page requests for one container
+    :param cache: browse cache (no cache if None)
+    :param output_format: jsonl, csv, parquet or columnar (decided from output_filename extension if None)
+    :param fields: fields to request with Filter (all fields if None, id and class are always included)
+    :return: list of contents
+    """
+    writer = None
     if output_filename:
-        output_filename = output_filename if output_filename.endswith('.json') else f'{output_filename}.json'
-        with open(output_filename, 'w') as f:
-            for item in items:
-                f.write(json.dumps(item))
-        _logger.info(f'output to {output_filename}')
+        writer = content_export.open_writer(output_filename, _FIELDS, _INT_FIELDS, output_format)
+
+    try:
+        if recursive == 'true':
+            items, _ = crawl(url, st, item_id if item_id else '0', concurrency, pool, page_size, max_in_flight, cache,
+                             on_results=writer.write if writer else None, fields=fields)
+        else:
+            items = []
+            for page in _iter_request_dlna(url, st, item_id if item_id else '0', pool, page_size, max_in_flight,
+                                           cache, fields=_fields_key(fields)):
+                items.extend(page)
+                if writer:
+                    writer.write(page)
+    finally:
+        if writer:
+            writer.close()
+            _logger.info(f'output {writer.count} items to {writer.filename}')
     return items
 
 
+def iter_search(url: str, st: str, container_id: str = '0', criteria: str = '*', pool: SessionPool = None,
+                page_size: int = None, max_in_flight: int = None, cache: BrowseCache = None,
+                fallback: bool = True, fields: List[str] = None) -> Iterator['Item']:
+    """Search contents under container_id in DLNA ContentDirectory server lazily
+
+    The Search action is sent if GetSearchCapabilities of the server covers
+    the properties in criteria. Otherwise all contents under container_id are
+    browsed recursively and filtered on the client (if fallback is True).
+
+    :param url: control URL of DLNA ContentDirectory server
+    :param st: service type
+    :param container_id: item_id of container to search in
+    :param criteria: SearchCriteria (e.g. 'upnp:class derivedfrom "object.item.videoItem"')
+    :param pool: HTTP session pool (default pool if None)
+    :param page_size: RequestedCount of each request (0 means server default)
+    :param max_in_flight: max number of concurrent page requests
+    :param cache: browse cache (no cache if None)
+    :param fallback: whether filter on the client if the server can not search with criteria
+    :param fields: fields to request with Filter (all fields if None, id and class are always included)
+    :return: iterator of matched contents
+    """
+    container_id = container_id if container_id else '0'
+    criteria = criteria if criteria else '*'
+    match = search_criteria.compile_criteria(criteria)
+
+    if search_criteria.is_supported(criteria, get_search_capabilities(url, st, pool)):
+        for page in _iter_request_dlna(url, st, container_id, pool, page_size, max_in_flight, cache, criteria,
+                                       _fields_key(fields)):
+            yield from page
+    elif fallback:
+        _logger.info(f'server can not search with "{criteria}", filter on the client')
+        if fields is not None:
+            # properties in criteria are needed to filter (the ones Item does not have never match anyway)
+            needed = set(search_criteria.field_name(p) for p in search_criteria.criteria_properties(criteria))
+            unknown = needed.difference(_FIELD_INDEX)
+            if unknown:
+                _logger.debug(f'fields not in Item, not requested : {sorted(unknown)}')
+            fields = list(fields) + sorted(needed.intersection(_FIELD_INDEX))
+        for item in _iter_items_recursive(url, st, [container_id], pool, page_size, max_in_flight, cache,
+                                          _fields_key(fields)):
+            if match(item):
+                yield item
+    else:
+        raise ValueError(f'server can not search with "{criteria}"')
+
+
+def search(url: str, st: str, container_id: str = '0', criteria: str = '*', pool: SessionPool = None,
+           page_size: int = None, max_in_flight: int = None, cache: BrowseCache = None, fallback: bool = True,
+           output_filename: str = None, output_format: str = None, fields: List[str] = None) -> List:
+    """Search contents under container_id in DLNA ContentDirectory server
+
+    :param url: control URL of DLNA ContentDirectory server
+    :param st: service type
+    :param container_id: item_id of container to search in
+    :param criteria: SearchCriteria (e.g. 'upnp:class derivedfrom "object.item.videoItem"')
+    :param pool: HTTP session pool (default pool if None)
+    :param page_size: RequestedCount of each request (0 means server default)
+    :param max_in_flight: max number of concurrent page requests
+    :param cache: browse cache (no cache if None)
+    :param fallback: whether filter on the client if the server can not search with criteria
+    :param output_filename: output filename if want to output resuts to file
+    :param output_format: jsonl, csv, parquet or columnar (decided from output_filename extension if None)
+    :param fields: fields to request with Filter (all fields if None, id and class are always included)
+    :return: list of matched contents
+    """
+    items = iter_search(url, st, container_id, criteria, pool, page_size, max_in_flight, cache, fallback, fields)
+    if not output_filename:
+        return list(items)
+
+    ret = []
+    with content_export.open_writer(output_filename, _FIELDS, _INT_FIELDS, output_format) as writer:
+        for item in items:
+            ret.append(item)
+            writer.write((item,))
+    _logger.info(f'output {writer.count} items to {writer.filename}')
+    return ret
+
+
+async def _async_request_window(url: str, st: str, item_id: str, start_index: int, count: int,
+                                pool: async_http.AsyncSessionPool = None, page_size: int = 0,
+                                retries: int = DEFAULT_PAGE_RETRIES, criteria: str = None,
+                                fields: Tuple[str, ...] = None) -> List:
+    """Request items [start_index, start_index + count) and retry only the missing part (see _request_window)"""
+    results = []
+    failures = 0
+    while len(results) < count:
+        index = start_index + len(results)
+        requested = min(page_size, count - len(results)) if page_size else count - len(results)
+        try:
+            tmp, returned, _, _ = await _async_request_dlna_one(url, st, item_id, index, pool, requested, criteria,
+                                                                fields)
+        except requests.RequestException as e:
+            _logger.warning(f'request error : {index} ~ {index + requested - 1} : {e}')
+            tmp, returned = [], 0
+        results.extend(tmp[:count - len(results)])
+        if returned == 0:
+            failures += 1
+            if failures > retries:
+                _logger.error(f'missing items : {index} ~ {start_index + count - 1} of {item_id}')
+                break
+            await asyncio.sleep(0.1 * failures)
+    return results
+
+
+async def _async_iter_request_dlna(url: str, st: str, item_id: str = '0', pool: async_http.AsyncSessionPool = None,
+                                   page_size: int = None, max_in_flight: int = None, criteria: str = None,
+                                   fields: Tuple[str, ...] = None) -> AsyncIterator[List]:
+    """Yield each page of Browse (or Search) results of item_id in order (see _iter_request_dlna)
+
+    Window requests are tasks of the event loop, cancelled when the
+    iteration stops early or is cancelled.
+    """
+    page_size = DEFAULT_PAGE_SIZE if page_size is None else page_size
+    max_in_flight = max_in_flight if max_in_flight else DEFAULT_MAX_IN_FLIGHT
+
+    for retry in range(DEFAULT_PAGE_RETRIES, -1, -1):
+        try:
+            results, returned, total, _ = await _async_request_dlna_one(url, st, item_id, 0, pool, page_size,
+                                                                        criteria, fields)
+            break
+        except requests.RequestException as e:
+            if retry == 0:
+                raise
+            _logger.warning(f'request error : {item_id} : {e}')
+    count = len(results)
+    yield results
+
+    window = page_size if page_size else returned
+    if 0 < returned < total:
+        def submit(start: int) -> asyncio.Task:
+            return asyncio.ensure_future(_async_request_window(url, st, item_id, start, min(window, total - start),
+                                                               pool, page_size, criteria=criteria, fields=fields))
+
+        starts = iter(range(returned, total, window))
+        in_flight = deque(submit(start) for _, start in zip(range(max_in_flight), starts))
+        try:
+            while in_flight:
+                tmp = await in_flight.popleft()
+                start = next(starts, None)
+                if start is not None:
+                    in_flight.append(submit(start))
+                count += len(tmp)
+                yield tmp
+        finally:
+            for task in in_flight:
+                task.cancel()
+
+    if count < total:
+        _logger.error(f'Can not get all items. {count} / {total}')
+
+
+async def async_iter_browse(url: str, st: str, item_id: str = '0', recursive: str = None,
+                            pool: async_http.AsyncSessionPool = None, page_size: int = None,
+                            max_in_flight: int = None, fields: List[str] = None) -> AsyncIterator['Item']:
+    """Browse contents in DLNA ContentDirectory server lazily without blocking the event loop
+
+    The asyncio counterpart of iter_browse (without cache): requests go
+    through async_http, and items of a page are yielded as soon as it is
+    parsed.
+
+    usage: async for item in async_iter_browse(url, st): ...
+
+    :param url: control URL of DLNA ContentDirectory server
+    :param st: service type
+    :param item_id: item_id of DLNA ContentDirectory server
+    :param recursive: whether search contents recursively if item is container
+    :param pool: async HTTP session pool (default pool of the event loop if None)
+    :param page_size: RequestedCount of each Browse request (0 means server default)
+    :param max_in_flight: max number of concurrent page requests for one container
+    :param fields: fields to request with Filter (all fields if None, id and class are always included)
+    :return: async iterator of contents
+    """
+    fields = _fields_key(fields)
+    container_ids = [item_id if item_id else '0']
+    while container_ids:
+        # same order as iter_browse: children of a container, then their descendants
+        container_id = container_ids.pop()
+        child_ids = []
+        async for page in _async_iter_request_dlna(url, st, container_id, pool, page_size, max_in_flight,
+                                                   fields=fields):
+            for item in page:
+                if recursive == 'true' and _is_container(item):
+                    child_ids.append(item.get('id'))
+                yield item
+        container_ids.extend(reversed(child_ids))
+
+
+async def async_browse(url: str, st: str, item_id: str = '0', recursive: str = None,
+                       pool: async_http.AsyncSessionPool = None, page_size: int = None, max_in_flight: int = None,
+                       concurrency: int = DEFAULT_SERVER_CONCURRENCY, fields: List[str] = None) -> List['Item']:
+    """Browse contents in DLNA ContentDirectory server without blocking the event loop
+
+    With recursive, containers are browsed concurrently (at most
+    concurrency at once) as crawl does, and the result has the same order
+    as the serial walk. Cancel the task or use asyncio.wait_for to bound
+    the time, pending requests are cancelled with it.
+
+    :param url: control URL of DLNA ContentDirectory server
+    :param st: service type
+    :param item_id: item_id of DLNA ContentDirectory server
+    :param recursive: whether search contents recursively if item is container
+    :param pool: async HTTP session pool (default pool of the event loop if None)
+    :param page_size: RequestedCount of each Browse request (0 means server default)
+    :param max_in_flight: max number of concurrent page requests for one container
+    :param concurrency: max number of containers browsed at once with recursive
+    :param fields: fields to request with Filter (all fields if None, id and class are always included)
+    :return: list of contents
+    """
+    item_id = item_id if item_id else '0'
+    fields = _fields_key(fields)
+    if recursive != 'true':
+        return [item async for item in async_iter_browse(url, st, item_id, None, pool, page_size, max_in_flight,
+                                                         fields)]
+
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def fetch(container_id: str) -> List:
+        async with semaphore:
+            results = []
+            async for page in _async_iter_request_dlna(url, st, container_id, pool, page_size, max_in_flight,
+                                                       fields=fields):
+                results.extend(page)
+            return results
+
+    children: Dict[str, List] = {}
+    seen = {item_id}
+    pending = {asyncio.ensure_future(fetch(item_id)): item_id}
+    try:
+        while pending:
+            done, _ = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                container_id = pending.pop(task)
+                results = children[container_id] = task.result()
+                for item in results:
+                    child_id = item.get('id')
+                    if _is_container(item) and child_id not in seen:
+                        seen.add(child_id)
+                        pending[asyncio.ensure_future(fetch(child_id))] = child_id
+    finally:
+        for task in pending:
+            task.cancel()
+    return _walk_order(item_id, children)
+
+
 def _main():
     p = argparse.ArgumentParser()
     p.add_argument('url', help='url')
     p.add_argument('st', help='st')
     p.add_argument('--id', help='item id')
     p.add_argument('--recursive', help='recursive or not (true or false)')
-    p.add_argument('--output', help='output file name(json)')
+    p.add_argument('--search', help='SearchCriteria to search under item id instead of browse')
+    p.add_argument('--output', help='output file name(.jsonl, .jsonl.gz, .csv or .parquet)')
+    p.add_argument('--output_format', help='output format (jsonl, csv, parquet or columnar)')
+    p.add_argument('--concurrency', type=int, help='max concurrent requests for recursive browse')
+    p.add_argument('--page_size', type=int, help='RequestedCount of each Browse request')
+    p.add_argument('--max_in_flight', type=int, help='max concurrent page requests for one container')
+    p.add_argument('--cache_dir', help='directory of browse cache')
+    p.add_argument('--fields', help='comma separated fields to request (e.g. id,title,class)')
     args = p.parse_args()
-    _items = browse(args.url, args.st, args.id, args.recursive, args.output)
+    cache = BrowseCache(directory=args.cache_dir) if args.cache_dir else None
+    fields = args.fields.split(',') if args.fields else None
+    if args.search:
+        _items = search(args.url, args.st, args.id, args.search, page_size=args.page_size,
+                        max_in_flight=args.max_in_flight, cache=cache, output_filename=args.output,
+                        output_format=args.output_format, fields=fields)
+    else:
+        _items = browse(args.url, args.st, args.id, args.recursive, args.output, args.concurrency,
+                        page_size=args.page_size, max_in_flight=args.max_in_flight, cache=cache,
+                        output_format=args.output_format, fields=fields)
 
     # dump only 10 items
     print(f'##### results = {len(_items)}')
@@ -0,0 +1,472 @@
+import argparse
+import asyncio
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import logging
+import re
+import socket
+import threading
+import time
+from typing import AsyncIterator, Callable, Dict, Optional
+from urllib.parse import urlparse
+from xml.etree import ElementTree
+
+import requests
+
+import async_http
+from http_session import SessionPool, get_pool
+
+_logger = logging.getLogger('dlnautil')
+
+DEFAULT_SUBSCRIPTION_TIMEOUT = 1800
+# subscription is renewed when this ratio of its timeout has passed
+RENEW_RATIO = 0.8
+# min seconds between renewals
+MIN_RENEW_INTERVAL = 5.0
+
+_EVENT_NS = 'urn:schemas-upnp-org:event-1-0'
+# events for SIDs not known yet are kept a while (initial events may arrive before SUBSCRIBE response)
+# max number of such SIDs, max number of events per SID (older ones are dropped) and seconds to keep them
+_MAX_PENDING = 16
+_MAX_PENDING_EVENTS = 8
+_PENDING_SECONDS = 30.0
+
+
+def parse_last_change(xml: str) -> Dict[int, Dict[str, str]]:
+    """Parse LastChange of AVTransport (or RenderingControl)
+
+    :param xml: LastChange value (Event document)
+    :return: changed variables per InstanceID
+    """
+    ret = {}
+    try:
+        et = ElementTree.fromstring(xml)
+    except ElementTree.ParseError as e:
+        _logger.warning(f'LastChange parse error : {e}')
+        return ret
+    for instance in et:
+        if instance.tag.rsplit('}', 1)[-1] != 'InstanceID':
+            continue
+        try:
+            instance_id = int(instance.get('val', 0))
+        except ValueError:
+            continue
+        values = ret.setdefault(instance_id, {})
+        for c in instance:
+            values[c.tag.rsplit('}', 1)[-1]] = c.get('val', '')
+    return ret
+
+
+def _parse_propertyset(body: bytes) -> Dict[str, str]:
+    ret = {}
+    et = ElementTree.fromstring(body)
+    for prop in et.iter(f'{{{_EVENT_NS}}}property'):
+        for c in prop:
+            ret[c.tag.rsplit('}', 1)[-1]] = c.text if c.text is not None else ''
+    return ret
+
+
+class TransportEvent:
+    """Change of transport state notified by a renderer
+
+    changes has variables in this notification, state has all variables
+    known so far and previous has state before this notification.
+    """
+
+    def __init__(self, subscription: 'Subscription', changes: Dict[str, str], state: Dict[str, str],
+                 previous: Dict[str, str]):
+        self.subscription = subscription
+        self.changes = changes
+        self.state = state
+        self.previous = previous
+        self.time = time.time()
+
+    @property
+    def transport_state(self) -> Optional[str]:
+        return self.state.get('TransportState')
+
+    @property
+    def track_ended(self) -> bool:
+        """Whether the playing track has ended (stopped, or moved to the next URI)"""
+        if self.previous.get('TransportState') != 'PLAYING':
+            return False
+        if self.changes.get('TransportState') in ('STOPPED', 'NO_MEDIA_PRESENT'):
+            return True
+        uri = self.changes.get('AVTransportURI', self.changes.get('CurrentTrackURI'))
+        return uri is not None and uri != self.previous.get('AVTransportURI', self.previous.get('CurrentTrackURI'))
+
+    def __repr__(self):
+        return f'TransportEvent({self.changes})'
+
+
+class _NotifyHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        _logger.debug(f'event server : {format % args}')
+
+    def do_NOTIFY(self):
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        sid = self.headers.get('SID')
+        seq = self.headers.get('SEQ', '0')
+        self.send_response(200)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+        if sid:
+            self.server.event_server.dispatch(sid, int(seq) if seq.isdigit() else 0, body)
+
+
+class EventServer:
+    """Local HTTP server which receives GENA NOTIFY of subscriptions
+
+    One server is shared by all subscriptions (see get_event_server).
+    """
+
+    def __init__(self, host: str = '', port: int = 0):
+        """
+        :param host: address to listen (all addresses if empty)
+        :param port: port to listen (any free port if 0)
+        """
+        self._httpd = ThreadingHTTPServer((host, port), _NotifyHandler)
+        self._httpd.daemon_threads = True
+        self._httpd.event_server = self
+        self._subscriptions = {}
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._thread = threading.Thread(target=self._httpd.serve_forever, name='event-server', daemon=True)
+        self._thread.start()
+        _logger.debug(f'event server on port {self.port}')
+
+    @property
+    def port(self) -> int:
+        return self._httpd.server_address[1]
+
+    def callback_url(self, remote_url: str) -> str:
+        """URL of this server seen from a device
+
+        :param remote_url: URL of the device (to select local address which reaches it)
+        :return: callback URL
+        """
+        host = self._httpd.server_address[0]
+        if host in ('', '0.0.0.0'):
+            host = _local_address(urlparse(remote_url).hostname)
+        return f'http://{host}:{self.port}/event'
+
+    def register(self, sid: str, subscription: 'Subscription'):
+        with self._lock:
+            self._subscriptions[sid] = subscription
+            _, pending = self._pending.pop(sid, (0.0, ()))
+        for seq, body in pending:
+            subscription._receive(seq, body)
+
+    def unregister(self, sid: str):
+        with self._lock:
+            self._subscriptions.pop(sid, None)
+
+    def dispatch(self, sid: str, seq: int, body: bytes):
+        with self._lock:
+            subscription = self._subscriptions.get(sid)
+            if subscription is None:
+                self._keep_pending(sid, seq, body)
+                return
+        subscription._receive(seq, body)
+
+    def _keep_pending(self, sid: str, seq: int, body: bytes):
+        now = time.monotonic()
+        for expired in [k for k, (t, _) in self._pending.items() if now - t > _PENDING_SECONDS]:
+            _logger.debug(f'drop events of unknown SID : {expired}')
+            del self._pending[expired]
+        if sid not in self._pending:
+            if len(self._pending) >= _MAX_PENDING:
+                return
+            self._pending[sid] = (now, deque(maxlen=_MAX_PENDING_EVENTS))
+        self._pending[sid][1].append((seq, body))
+
+    def close(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+
+def _local_address(remote_host: str) -> str:
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    try:
+        # no packet is sent, only the route is looked up
+        sock.connect((remote_host, 1900))
+        return sock.getsockname()[0]
+    except OSError:
+        return socket.gethostbyname(socket.gethostname())
+    finally:
+        sock.close()
+
+
+_event_server = None
+_event_server_lock = threading.Lock()
+
+
+def get_event_server() -> EventServer:
+    """Get event server shared by subscriptions (started at first call)"""
+    global _event_server
+    with _event_server_lock:
+        if _event_server is None:
+            _event_server = EventServer()
+        return _event_server
+
+
+class Subscription:
+    """GENA subscription to a service (e.g. AVTransport) of a renderer
+
+    The subscription is renewed automatically before its timeout. Each
+    notification updates state and is passed to callbacks as
+    TransportEvent, or can be awaited with events().
+
+    usage:
+        with Subscription(event_sub_url, callback) as subscription:
+            ...
+    """
+
+    def __init__(self, event_sub_url: str, callback: Callable[[TransportEvent], None] = None,
+                 timeout: int = DEFAULT_SUBSCRIPTION_TIMEOUT, pool: SessionPool = None,
+                 server: EventServer = None, instance_id: int = 0):
+        """
+        :param event_sub_url: eventSubURL of the service
+        :param callback: function called with TransportEvent on each notification
+        :param timeout: requested subscription timeout in seconds
+        :param pool: HTTP session pool (default pool if None)
+        :param server: server receiving notifications (shared server if None)
+        :param instance_id: InstanceID of LastChange to follow
+        """
+        self.event_sub_url = event_sub_url
+        self.timeout = timeout
+        self.pool = pool
+        self.server = server
+        self.instance_id = instance_id
+        self.sid = None
+        self.state = {}
+        self.renewals = 0
+        self._callbacks = [callback] if callback else []
+        self._queues = []
+        self._seq = -1
+        self._timer = None
+        # event loop and pool of async_subscribe (renewals run on the loop)
+        self._loop = None
+        self._async_pool = None
+        self._renew_task = None
+        self._lock = threading.Lock()
+
+    def add_callback(self, callback: Callable[[TransportEvent], None]):
+        self._callbacks.append(callback)
+
+    def _subscribe_headers(self) -> Dict[str, str]:
+        if self.server is None:
+            self.server = get_event_server()
+        return {'CALLBACK': f'<{self.server.callback_url(self.event_sub_url)}>',
+                'NT': 'upnp:event',
+                'TIMEOUT': f'Second-{self.timeout}'}
+
+    def _subscribed(self, res):
+        if res.status_code != 200 or not res.headers.get('SID'):
+            _logger.error(f'SUBSCRIBE Error : {self.event_sub_url} : {res.status_code}')
+            res.raise_for_status()
+            raise requests.HTTPError(f'no SID : {self.event_sub_url}', response=res)
+        with self._lock:
+            self.sid = res.headers['SID']
+            self._seq = -1
+        self.server.register(self.sid, self)
+        _logger.debug(f'subscribed : {self.event_sub_url} : {self.sid}')
+        self._schedule(res.headers.get('TIMEOUT'))
+
+    def subscribe(self):
+        """Send SUBSCRIBE and start automatic renewal"""
+        res = get_pool(self.pool).request('SUBSCRIBE', self.event_sub_url, headers=self._subscribe_headers())
+        self._subscribed(res)
+
+    async def async_subscribe(self, pool: async_http.AsyncSessionPool = None):
+        """Send SUBSCRIBE with async_http and start automatic renewal on the running loop
+
+        Call async_unsubscribe() when finished (not to block the loop).
+
+        :param pool: async HTTP session pool (default pool of the event loop if None)
+        """
+        self._loop = asyncio.get_running_loop()
+        self._async_pool = pool
+        headers = self._subscribe_headers()
+        res = await async_http.get_pool(pool).request('SUBSCRIBE', self.event_sub_url, headers=headers)
+        self._subscribed(res)
+
+    def _schedule(self, timeout_header: Optional[str]):
+        m = re.match(r'Second-(\d+)', timeout_header or '', re.IGNORECASE)
+        granted = int(m.group(1)) if m else self.timeout
+        delay = max(granted * RENEW_RATIO, MIN_RENEW_INTERVAL)
+        if self._loop is not None:
+            # TimerHandle has cancel() as threading.Timer
+            self._timer = self._loop.call_later(delay, self._start_async_renew)
+            return
+        self._timer = threading.Timer(delay, self._renew)
+        self._timer.daemon = True
+        self._timer.start()
+
+    def _renew_headers(self, sid: str) -> Dict[str, str]:
+        return {'SID': sid, 'TIMEOUT': f'Second-{self.timeout}'}
+
+    def _renewed(self, sid: str, res) -> bool:
+        if res.status_code != 200:
+            _logger.warning(f'renew Error : {sid} : {res.status_code}')
+            return False
+        self.renewals += 1
+        _logger.debug(f'renewed : {sid}')
+        if self.sid == sid:
+            # not unsubscribed while renewing
+            self._schedule(res.headers.get('TIMEOUT'))
+        return True
+
+    def _resubscribe_later(self, e: Exception):
+        _logger.error(f'SUBSCRIBE Error : {self.event_sub_url} : {e}')
+        self._schedule(f'Second-{int(MIN_RENEW_INTERVAL / RENEW_RATIO)}')
+
+    def _renew(self):
+        sid = self.sid
+        if sid is None:
+            return
+        try:
+            res = get_pool(self.pool).request('SUBSCRIBE', self.event_sub_url, headers=self._renew_headers(sid))
+            if self._renewed(sid, res):
+                return
+        except requests.RequestException as e:
+            _logger.warning(f'renew Error : {sid} : {e}')
+
+        # subscription is lost (e.g. renderer restarted), subscribe again
+        self.server.unregister(sid)
+        if self.sid != sid:
+            return
+        try:
+            self.subscribe()
+        except requests.RequestException as e:
+            self._resubscribe_later(e)
+
+    def _start_async_renew(self):
+        self._renew_task = self._loop.create_task(self._async_renew())
+
+    async def _async_renew(self):
+        sid = self.sid
+        if sid is None:
+            return
+        pool = async_http.get_pool(self._async_pool)
+        try:
+            res = await pool.request('SUBSCRIBE', self.event_sub_url, headers=self._renew_headers(sid))
+            if self._renewed(sid, res):
+                return
+        except requests.RequestException as e:
+            _logger.warning(f'renew Error : {sid} : {e}')
+
+        # subscription is lost, subscribe again
+        self.server.unregister(sid)
+        if self.sid != sid:
+            return
+        try:
+            await self.async_subscribe(self._async_pool)
+        except requests.RequestException as e:
+            self._resubscribe_later(e)
+
+    def _stop(self) -> Optional[str]:
+        if self._timer:
+            self._timer.cancel()
+            self._timer = None
+        sid, self.sid = self.sid, None
+        if sid is not None:
+            self.server.unregister(sid)
+        return sid
+
+    def unsubscribe(self):
+        """Stop renewal and send UNSUBSCRIBE"""
+        sid = self._stop()
+        if sid is None:
+            return
+        try:
+            get_pool(self.pool).request('UNSUBSCRIBE', self.event_sub_url, headers={'SID': sid})
+        except requests.RequestException as e:
+            _logger.warning(f'UNSUBSCRIBE Error : {sid} : {e}')
+
+    async def async_unsubscribe(self):
+        """Stop renewal and send UNSUBSCRIBE with async_http"""
+        sid = self._stop()
+        if sid is None:
+            return
+        try:
+            await async_http.get_pool(self._async_pool).request('UNSUBSCRIBE', self.event_sub_url,
+                                                                headers={'SID': sid})
+        except requests.RequestException as e:
+            _logger.warning(f'UNSUBSCRIBE Error : {sid} : {e}')
+
+    def __enter__(self):
+        self.subscribe()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.unsubscribe()
+
+    def _receive(self, seq: int, body: bytes):
+        with self._lock:
+            # SEQ wraps to 1 after 4294967295, 0 is the initial event
+            if seq != 0 and 0 <= self._seq and seq <= self._seq and self._seq - seq < 2 ** 31:
+                _logger.debug(f'old event ignored : {self.sid} : {seq}')
+                return
+            self._seq = seq
+            try:
+                properties = _parse_propertyset(body)
+            except ElementTree.ParseError as e:
+                _logger.warning(f'event parse error : {self.sid} : {e}')
+                return
+            changes = {k: v for k, v in properties.items() if k != 'LastChange'}
+            if 'LastChange' in properties:
+                changes.update(parse_last_change(properties['LastChange']).get(self.instance_id, {}))
+            previous = self.state
+            self.state = {**previous, **changes}
+            event = TransportEvent(self, changes, self.state, previous)
+            callbacks = list(self._callbacks)
+            queues = list(self._queues)
+
+        _logger.debug(f'event : {self.sid} : {seq} : {changes}')
+        for callback in callbacks:
+            try:
+                callback(event)
+            except Exception as e:
+                _logger.warning(f'event callback error : {e}')
+        for loop, queue in queues:
+            loop.call_soon_threadsafe(queue.put_nowait, event)
+
+    async def events(self) -> AsyncIterator[TransportEvent]:
+        """Async stream of events
+
+        usage: async for event in subscription.events(): ...
+        """
+        entry = (asyncio.get_running_loop(), asyncio.Queue())
+        with self._lock:
+            self._queues.append(entry)
+        try:
+            while True:
+                yield await entry[1].get()
+        finally:
+            with self._lock:
+                self._queues.remove(entry)
+
+
+def _main():
+    p = argparse.ArgumentParser()
+    p.add_argument('url', help='eventSubURL of renderer AVTransport')
+    p.add_argument('--timeout', type=int, default=DEFAULT_SUBSCRIPTION_TIMEOUT, help='subscription timeout')
+    args = p.parse_args()
+
+    def on_event(event: TransportEvent):
+        _logger.info(f'{event.changes}{" (track ended)" if event.track_ended else ""}')
+
+    with Subscription(args.url, on_event, args.timeout):
+        try:
+            while True:
+                time.sleep(1)
+        except KeyboardInterrupt:
+            pass
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    _main()
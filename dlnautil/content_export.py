@@ -0,0 +1,181 @@
+import csv
+import gzip
+import json
+import logging
+from typing import Dict, Iterable, List, Optional
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+_logger = logging.getLogger('dlnautil')
+
+FORMAT_JSONL = 'jsonl'
+FORMAT_CSV = 'csv'
+FORMAT_PARQUET = 'parquet'
+# parquet if pyarrow is available, csv otherwise
+FORMAT_COLUMNAR = 'columnar'
+
+_EXTENSIONS = {
+    '.json': FORMAT_JSONL,
+    '.jsonl': FORMAT_JSONL,
+    '.json.gz': FORMAT_JSONL,
+    '.jsonl.gz': FORMAT_JSONL,
+    '.csv': FORMAT_CSV,
+    '.csv.gz': FORMAT_CSV,
+    '.parquet': FORMAT_PARQUET,
+}
+
+
+class JsonLinesWriter:
+    """Write items as JSON Lines (gzip compressed if filename ends with .gz)"""
+
+    def __init__(self, filename: str):
+        self.filename = filename
+        self.count = 0
+        if filename.endswith('.gz'):
+            self._f = gzip.open(filename, 'wt', encoding='utf-8')
+        else:
+            self._f = open(filename, 'w', encoding='utf-8')
+
+    def write(self, items: Iterable):
+        for i in items:
+            self._f.write(json.dumps(i.get_data(), ensure_ascii=False))
+            self._f.write('\n')
+            self.count += 1
+        self._f.flush()
+
+    def close(self):
+        self._f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+class CsvWriter:
+    """Write items as CSV with a fixed column per field (gzip compressed if filename ends with .gz)"""
+
+    def __init__(self, filename: str, fields: List[str]):
+        self.filename = filename
+        self.count = 0
+        if filename.endswith('.gz'):
+            self._f = gzip.open(filename, 'wt', encoding='utf-8', newline='')
+        else:
+            self._f = open(filename, 'w', encoding='utf-8', newline='')
+        self._writer = csv.DictWriter(self._f, fieldnames=fields, extrasaction='ignore')
+        self._writer.writeheader()
+
+    def write(self, items: Iterable):
+        for i in items:
+            self._writer.writerow(i.get_data())
+            self.count += 1
+        self._f.flush()
+
+    def close(self):
+        self._f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+class ParquetWriter:
+    """Write items as Parquet, one row group per written page (needs pyarrow)
+
+    Values of int fields which are not int (nor a decimal string) are
+    written as null, logged and counted in dropped by field.
+    """
+
+    def __init__(self, filename: str, fields: List[str], int_fields: Iterable[str] = ()):
+        if pyarrow is None:
+            raise ImportError('pyarrow is required for parquet output')
+        self.filename = filename
+        self.count = 0
+        # number of values written as null because they are not int, by field
+        self.dropped: Dict[str, int] = {}
+        self._int_fields = set(int_fields)
+        self._fields = list(fields)
+        self._schema = pyarrow.schema([(f, pyarrow.int64() if f in self._int_fields else pyarrow.string())
+                                       for f in self._fields])
+        self._writer = pyarrow.parquet.ParquetWriter(filename, self._schema)
+
+    def write(self, items: Iterable):
+        rows = [i.get_data() for i in items]
+        if not rows:
+            return
+        columns = {}
+        for f in self._fields:
+            values = [r.get(f) for r in rows]
+            if f in self._int_fields:
+                columns[f] = [self._int_value(f, v) for v in values]
+            else:
+                columns[f] = [None if v is None else str(v) for v in values]
+        self._writer.write_table(pyarrow.table(columns, schema=self._schema))
+        self.count += len(rows)
+
+    def _int_value(self, field: str, value) -> Optional[int]:
+        if value is None or isinstance(value, int):
+            return value
+        try:
+            return int(value)
+        except (TypeError, ValueError):
+            if field not in self.dropped:
+                _logger.warning(f'not int value of {field} is written as null : {value!r}')
+            self.dropped[field] = self.dropped.get(field, 0) + 1
+            return None
+
+    def close(self):
+        self._writer.close()
+        if self.dropped:
+            _logger.warning(f'not int values written as null : {self.dropped}')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+def get_format(filename: str) -> str:
+    """Get output format from extension of filename
+
+    :param filename: output filename
+    :return: format name (None if unknown extension)
+    """
+    for ext, fmt in _EXTENSIONS.items():
+        if filename.endswith(ext):
+            return fmt
+    return None
+
+
+def open_writer(filename: str, fields: List[str], int_fields: Iterable[str] = (), output_format: str = None):
+    """Open streaming writer of items
+
+    :param filename: output filename (extension is added if it does not match the format)
+    :param fields: field names of items (columns of csv/parquet)
+    :param int_fields: fields which have int values
+    :param output_format: jsonl, csv, parquet or columnar (decided from filename extension if None)
+    :return: writer which has write(items) and close()
+    """
+    output_format = output_format if output_format else get_format(filename)
+    output_format = output_format if output_format else FORMAT_JSONL
+    if output_format == FORMAT_COLUMNAR:
+        output_format = FORMAT_PARQUET if pyarrow is not None else FORMAT_CSV
+    if get_format(filename) != output_format:
+        filename = f'{filename}.{output_format}'
+
+    _logger.debug(f'open {output_format} writer : {filename}')
+    if output_format == FORMAT_JSONL:
+        return JsonLinesWriter(filename)
+    elif output_format == FORMAT_CSV:
+        return CsvWriter(filename, fields)
+    elif output_format == FORMAT_PARQUET:
+        return ParquetWriter(filename, fields, int_fields)
+    raise ValueError(f'unknown output format : {output_format}')
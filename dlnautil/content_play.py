@@ -1,147 +1,546 @@
 import argparse
+import functools
 import logging
-import requests
 import re
+import requests
+import time
 
-from typing import List
-from urllib.parse import urlparse
+from typing import Callable, Dict, Optional, Sequence, Tuple
 from xml.etree import ElementTree
+from xml.sax.saxutils import escape
+
+import async_http
+import content_event
+import device_description
+import metrics
+from http_session import SessionPool, get_pool
 
 
 logging.basicConfig(level=logging.INFO)
 _logger = logging.getLogger('content_play')
 
 
-def _parse_xml(node: ElementTree, root_namespace: str, is_retrieve: bool = False) -> List:
-    ret = {}
-    child_ret = []
-    extract_tags = ['deviceType', 'friendlyName', 'manufacturer', 'modelName', 'modelNumber']
-    for c in node:
-        real_tag = c.tag.replace(f'{{{root_namespace}}}', '')
-        # print(f'{real_tag} : {c.attrib} : {c.text}')
-        is_retrieve_child = True if real_tag == 'service' else False
-        # print(f'is_retrieve={is_retrieve_child}')
-        child_ret.extend(_parse_xml(c, root_namespace, is_retrieve_child))
+SERVICE_AVTRANSPORT = 'urn:schemas-upnp-org:service:AVTransport:1'
 
-        if is_retrieve or real_tag in extract_tags:
-            ret[real_tag] = c.text
+_SOAP_NS = 'http://schemas.xmlsoap.org/soap/envelope/'
+_CONTROL_NS = 'urn:schemas-upnp-org:control-1-0'
+_QUOTE = {'"': '&quot;'}
 
-    if ret:
-        child_ret.append(ret)
 
-    return child_ret
+class SoapError(Exception):
+    """SOAP fault (UPnPError) or HTTP error returned by an action"""
 
+    def __init__(self, action: str, status_code: int, error_code: int = None, description: str = None):
+        super().__init__(f'{action} Error : {status_code} : {error_code} {description}')
+        self.action = action
+        self.status_code = status_code
+        self.error_code = error_code
+        self.description = description
 
-def _get_root_namespace(et: ElementTree) -> str:
-    m = re.match('{(.*)}(.*)', et.tag)
-    if m:
-        ns = m.group(1)
-        return ns
 
-    return None
+class ActionResult:
+    """Result of an action
 
+    values has output arguments of the response (e.g. TrackDuration) and
+    elapsed has seconds from sending the request to parsing the response.
+    """
 
-def _add_url_to_rendererinfo(url: str, infos: List) -> List:
-    urlinfo = urlparse(url)
-    for info in infos:
-        _logger.debug(f'{info}')
-        controlURL = info.get('controlURL')
-        if controlURL:
-            info['url'] = f'{urlinfo.scheme}://{urlinfo.netloc}{controlURL}'
-    return infos
+    def __init__(self, action: str, status_code: int, values: dict, elapsed: float):
+        self.action = action
+        self.status_code = status_code
+        self.values = values
+        self.elapsed = elapsed
 
+    def get(self, key: str, default=None):
+        return self.values.get(key, default)
 
-def _request(url: str, action: str, data: str):
-    headers = {'Content-Type': "text/xml; charset=utf-8",
-               'SOAPACTION': f'"urn:schemas-upnp-org:service:AVTransport:1#{action}"'}
-    body = f"""<?xml version="1.0"?>
-               <s:Envelope xmlns:s="http://schemas.xmlsoap.org/soap/envelope/" s:encodingStyle="http://schemas.xmlsoap.org/soap/encoding/">
-                 <s:Body>
-                   <u:{action} xmlns:u="urn:schemas-upnp-org:service:AVTransport:1">
-                   {data}
-                   </u:{action}>
-                 </s:Body>
-               </s:Envelope>"""
-    _logger.debug(url)
-    _logger.debug(headers)
-    _logger.debug(body)
-
-    body = body.encode('utf-8')
-    ret = requests.post(url, data=body, headers=headers)
-    _logger.debug(ret.text)
-
-    if ret.status_code == 200:
-        _logger.info(f'{action} OK')
-    else:
-        _logger.error(f'{action} Error : {ret.status_code}')
+    def __repr__(self):
+        return f'ActionResult({self.action}, {self.status_code}, {self.values}, {self.elapsed * 1000:.1f}ms)'
 
 
-def get_rendererinfo(url: str):
+def parse_duration(value: Optional[str]) -> Optional[float]:
+    """Parse duration / time of AVTransport (H+:MM:SS[.F+] or H+:MM:SS[.F0/F1])
+
+    :param value: e.g. 0:01:23.500
+    :return: seconds (None if NOT_IMPLEMENTED or invalid)
+    """
+    if not value:
+        return None
+    m = re.match(r'^([+-]?)(\d+):(\d{1,2}):(\d{1,2})(?:\.(\d+)(?:/(\d+))?)?$', value.strip())
+    if not m:
+        return None
+    sign, h, mi, sec, frac, div = m.groups()
+    seconds = int(h) * 3600 + int(mi) * 60 + int(sec)
+    if frac:
+        seconds += int(frac) / int(div) if div else float(f'0.{frac}')
+    return -seconds if sign == '-' else seconds
+
+
+def _parse_int(value: Optional[str]) -> Optional[int]:
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+class PositionInfo:
+    """Result of GetPositionInfo (times in seconds, None if not implemented)"""
+
+    def __init__(self, values: dict):
+        self.track = _parse_int(values.get('Track'))
+        self.track_duration = parse_duration(values.get('TrackDuration'))
+        self.track_metadata = values.get('TrackMetaData')
+        self.track_uri = values.get('TrackURI')
+        self.rel_time = parse_duration(values.get('RelTime'))
+        self.abs_time = parse_duration(values.get('AbsTime'))
+        self.rel_count = _parse_int(values.get('RelCount'))
+        self.abs_count = _parse_int(values.get('AbsCount'))
+
+    @property
+    def remaining(self) -> Optional[float]:
+        """Seconds to the end of the track"""
+        if self.track_duration is None or self.rel_time is None:
+            return None
+        return max(self.track_duration - self.rel_time, 0.0)
+
+    def __repr__(self):
+        return f'PositionInfo({self.track_uri}, {self.rel_time}/{self.track_duration})'
+
+
+class TransportInfo:
+    """Result of GetTransportInfo"""
+
+    def __init__(self, values: dict):
+        self.state = values.get('CurrentTransportState')
+        self.status = values.get('CurrentTransportStatus')
+        self.speed = values.get('CurrentSpeed')
+
+    @property
+    def playing(self) -> bool:
+        return self.state in ('PLAYING', 'TRANSITIONING')
+
+    def __repr__(self):
+        return f'TransportInfo({self.state}, {self.status}, {self.speed})'
+
+
+class MediaInfo:
+    """Result of GetMediaInfo"""
+
+    def __init__(self, values: dict):
+        self.nr_tracks = _parse_int(values.get('NrTracks'))
+        self.media_duration = parse_duration(values.get('MediaDuration'))
+        self.current_uri = values.get('CurrentURI')
+        self.current_uri_metadata = values.get('CurrentURIMetaData')
+        self.next_uri = values.get('NextURI')
+        self.next_uri_metadata = values.get('NextURIMetaData')
+        self.play_medium = values.get('PlayMedium')
+
+    def __repr__(self):
+        return f'MediaInfo({self.current_uri}, next={self.next_uri})'
+
+
+def didl_metadata(uri: str, title: str = '', upnp_class: str = 'object.item.videoItem',
+                  protocol_info: str = 'http-get:*:*:*', duration: str = None, item_id: str = '0',
+                  parent_id: str = '-1') -> str:
+    """Build DIDL-Lite metadata of a content (CurrentURIMetaData / NextURIMetaData)
+
+    :param uri: content URL
+    :param title: dc:title
+    :param upnp_class: upnp:class
+    :param protocol_info: protocolInfo of res (e.g. http-get:*:video/mp4:*)
+    :param duration: duration of res (H:MM:SS)
+    :param item_id: id of item in its server
+    :param parent_id: parentID of item in its server
+    :return: DIDL-Lite document
+    """
+    res_attrs = f' protocolInfo="{escape(protocol_info, _QUOTE)}"'
+    if duration:
+        res_attrs += f' duration="{escape(duration, _QUOTE)}"'
+    return ('<DIDL-Lite xmlns="urn:schemas-upnp-org:metadata-1-0/DIDL-Lite/" '
+            'xmlns:dc="http://purl.org/dc/elements/1.1/" xmlns:upnp="urn:schemas-upnp-org:metadata-1-0/upnp/">'
+            f'<item id="{escape(item_id, _QUOTE)}" parentID="{escape(parent_id, _QUOTE)}" restricted="1">'
+            f'<dc:title>{escape(title)}</dc:title><upnp:class>{escape(upnp_class)}</upnp:class>'
+            f'<res{res_attrs}>{escape(uri)}</res></item></DIDL-Lite>')
+
+
+@functools.lru_cache(maxsize=None)
+def _envelope(service_type: str, action: str) -> Tuple[bytes, bytes, Dict[str, str]]:
+    # envelope before and after arguments, and headers of an action
+    prefix = ('<?xml version="1.0"?>'
+              f'<s:Envelope xmlns:s="{_SOAP_NS}" s:encodingStyle="http://schemas.xmlsoap.org/soap/encoding/">'
+              f'<s:Body><u:{action} xmlns:u="{service_type}">')
+    suffix = f'</u:{action}></s:Body></s:Envelope>'
+    headers = {'Content-Type': 'text/xml; charset="utf-8"',
+               'SOAPACTION': f'"{service_type}#{action}"'}
+    return prefix.encode('utf-8'), suffix.encode('utf-8'), headers
+
+
+def _encode_arguments(arguments: Sequence[Tuple[str, object]]) -> bytes:
+    return ''.join(f'<{k}>{escape(str(v))}</{k}>' for k, v in arguments).encode('utf-8')
+
+
+def _parse_response(action: str, status_code: int, content: bytes) -> dict:
+    try:
+        body = ElementTree.fromstring(content).find(f'{{{_SOAP_NS}}}Body')
+    except ElementTree.ParseError:
+        body = None
+    if status_code != 200:
+        error_code, description = None, None
+        error = body.find(f'.//{{{_CONTROL_NS}}}UPnPError') if body is not None else None
+        if error is not None:
+            code = error.findtext(f'{{{_CONTROL_NS}}}errorCode')
+            error_code = int(code) if code and code.strip().isdigit() else code
+            description = error.findtext(f'{{{_CONTROL_NS}}}errorDescription')
+        raise SoapError(action, status_code, error_code, description)
+
+    values = {}
+    if body is not None:
+        for response in body:
+            for c in response:
+                values[c.tag.rsplit('}', 1)[-1]] = c.text if c.text is not None else ''
+    return values
+
+
+def _action_request(service_type: str, instance_id: int, action: str,
+                    arguments: Sequence[Tuple[str, object]]) -> Tuple[bytes, Dict[str, str]]:
+    prefix, suffix, headers = _envelope(service_type, action)
+    body = b''.join((prefix, _encode_arguments((('InstanceID', instance_id),) + tuple(arguments)), suffix))
+    return body, headers
+
+
+def _action_result(action: str, res, start: float) -> ActionResult:
+    """Parse response (requests.Response or async_http.AsyncResponse) of request sent at start"""
+    received = time.perf_counter()
+    values = _parse_response(action, res.status_code, res.content)
+    elapsed = time.perf_counter() - start
+    m = metrics.get_metrics()
+    if m is not None:
+        m.observe(metrics.REQUEST_SECONDS, received - start, action=action)
+        m.observe(metrics.RESPONSE_BYTES, len(res.content), action=action)
+        m.observe(metrics.PARSE_SECONDS, start + elapsed - received, action=action)
+    _logger.debug(f'{action} : {elapsed * 1000:.1f}ms : {values}')
+    return ActionResult(action, res.status_code, values, elapsed)
+
+
+def _request_error(action: str):
+    m = metrics.get_metrics()
+    if m is not None:
+        m.inc(metrics.REQUEST_ERRORS, action=action)
+
+
+class Renderer:
+    """AVTransport client bound to one control URL
+
+    The keep-alive session of the host is held, and envelopes are built
+    from templates encoded once per action, so a command costs one round
+    trip on a warm connection. Responses are parsed into ActionResult and
+    faults raise SoapError.
+    """
+
+    def __init__(self, control_url: str, service_type: str = SERVICE_AVTRANSPORT, pool: SessionPool = None,
+                 timeout: float = None, instance_id: int = 0, event_sub_url: str = None):
+        """
+        :param control_url: AVTransport control URL
+        :param service_type: serviceType of the control URL
+        :param pool: HTTP session pool (default pool if None)
+        :param timeout: request timeout in seconds (default timeout of pool if None)
+        :param instance_id: AVTransport InstanceID
+        :param event_sub_url: AVTransport eventSubURL (needed for subscribe)
+        """
+        self.control_url = control_url
+        self.event_sub_url = event_sub_url
+        self.pool = pool
+        self.service_type = service_type
+        self.instance_id = instance_id
+        self.timeout = timeout if timeout else get_pool(pool).timeout
+        # seconds taken by the last call
+        self.last_elapsed = None
+        self._session = get_pool(pool).session(control_url)
+
+    @classmethod
+    def from_description(cls, location: str, pool: SessionPool = None, **kwargs) -> 'Renderer':
+        """Create client from renderer description URL
+
+        :param location: renderer URL for description
+        :param pool: HTTP session pool (default pool if None)
+        :return: client of AVTransport of the renderer
+        """
+        service = device_description.get_description(location, pool).find_service(SERVICE_AVTRANSPORT)
+        if not service:
+            raise ValueError(f'AVTransport not found : {location}')
+        return cls(service.control_url, pool=pool, event_sub_url=service.event_sub_url, **kwargs)
+
+    def call(self, action: str, arguments: Sequence[Tuple[str, object]] = ()) -> ActionResult:
+        """Call action
+
+        :param action: action name (e.g. Play)
+        :param arguments: input arguments in order of the action (InstanceID is not included)
+        :return: result of the action
+        """
+        body, headers = _action_request(self.service_type, self.instance_id, action, arguments)
+        start = time.perf_counter()
+        try:
+            res = self._session.post(self.control_url, data=body, headers=headers, timeout=self.timeout)
+            result = _action_result(action, res, start)
+        except (requests.RequestException, SoapError):
+            _request_error(action)
+            raise
+        self.last_elapsed = result.elapsed
+        return result
+
+    def set_content_uri(self, item_url: str, metadata: str = '') -> ActionResult:
+        """Set content URL to play
+
+        :param item_url: content URL
+        :param metadata: DIDL-Lite of the content
+        """
+        return self.call('SetAVTransportURI', (('CurrentURI', item_url), ('CurrentURIMetaData', metadata)))
+
+    def set_next_content_uri(self, item_url: str, metadata: str = '') -> ActionResult:
+        """Set content URL played after the current one without a gap (optional action)
+
+        :param item_url: content URL
+        :param metadata: DIDL-Lite of the content
+        """
+        return self.call('SetNextAVTransportURI', (('NextURI', item_url), ('NextURIMetaData', metadata)))
+
+    def play(self, speed: str = '1') -> ActionResult:
+        return self.call('Play', (('Speed', speed),))
+
+    def pause(self) -> ActionResult:
+        return self.call('Pause')
+
+    def stop(self) -> ActionResult:
+        return self.call('Stop')
+
+    def get_position_info(self) -> PositionInfo:
+        return PositionInfo(self.call('GetPositionInfo').values)
+
+    def get_transport_info(self) -> TransportInfo:
+        return TransportInfo(self.call('GetTransportInfo').values)
+
+    def get_media_info(self) -> MediaInfo:
+        return MediaInfo(self.call('GetMediaInfo').values)
+
+    def subscribe(self, callback: Callable[[content_event.TransportEvent], None] = None,
+                  timeout: int = content_event.DEFAULT_SUBSCRIPTION_TIMEOUT) -> content_event.Subscription:
+        """Subscribe transport state changes (LastChange) of the renderer
+
+        :param callback: function called with content_event.TransportEvent on each change
+        :param timeout: requested subscription timeout in seconds (renewed automatically)
+        :return: subscription (call unsubscribe() when finished)
+        """
+        if not self.event_sub_url:
+            raise ValueError(f'eventSubURL is unknown : {self.control_url}')
+        subscription = content_event.Subscription(self.event_sub_url, callback, timeout, self.pool,
+                                                  instance_id=self.instance_id)
+        subscription.subscribe()
+        return subscription
+
+
+class AsyncRenderer:
+    """AVTransport client bound to one control URL for asyncio
+
+    The same actions as Renderer as coroutines: requests are sent with
+    async_http, so many renderers can be controlled from one event loop
+    without a thread per call. A call can be cancelled or bounded with
+    asyncio.wait_for (timeout also applies to each request).
+
+    usage:
+        renderer = await AsyncRenderer.from_description(url)
+        await renderer.set_content_uri(item_url)
+        await renderer.play()
+    """
+
+    def __init__(self, control_url: str, service_type: str = SERVICE_AVTRANSPORT,
+                 pool: async_http.AsyncSessionPool = None, timeout: float = None, instance_id: int = 0,
+                 event_sub_url: str = None):
+        """
+        :param control_url: AVTransport control URL
+        :param service_type: serviceType of the control URL
+        :param pool: async HTTP session pool (default pool of the event loop if None)
+        :param timeout: request timeout in seconds (default timeout of pool if None)
+        :param instance_id: AVTransport InstanceID
+        :param event_sub_url: AVTransport eventSubURL (needed for subscribe)
+        """
+        self.control_url = control_url
+        self.event_sub_url = event_sub_url
+        self.pool = pool
+        self.service_type = service_type
+        self.instance_id = instance_id
+        self.timeout = timeout
+        # seconds taken by the last call
+        self.last_elapsed = None
+
+    @classmethod
+    async def from_description(cls, location: str, pool: async_http.AsyncSessionPool = None,
+                               **kwargs) -> 'AsyncRenderer':
+        """Create client from renderer description URL
+
+        :param location: renderer URL for description
+        :param pool: async HTTP session pool (default pool of the event loop if None)
+        :return: client of AVTransport of the renderer
+        """
+        description = await device_description.async_get_description(location, pool)
+        service = description.find_service(SERVICE_AVTRANSPORT)
+        if not service:
+            raise ValueError(f'AVTransport not found : {location}')
+        return cls(service.control_url, pool=pool, event_sub_url=service.event_sub_url, **kwargs)
+
+    async def call(self, action: str, arguments: Sequence[Tuple[str, object]] = ()) -> ActionResult:
+        """Call action
+
+        :param action: action name (e.g. Play)
+        :param arguments: input arguments in order of the action (InstanceID is not included)
+        :return: result of the action
+        """
+        body, headers = _action_request(self.service_type, self.instance_id, action, arguments)
+        start = time.perf_counter()
+        try:
+            res = await async_http.get_pool(self.pool).post(self.control_url, data=body, headers=headers,
+                                                            timeout=self.timeout)
+            result = _action_result(action, res, start)
+        except (requests.RequestException, SoapError):
+            _request_error(action)
+            raise
+        self.last_elapsed = result.elapsed
+        return result
+
+    async def set_content_uri(self, item_url: str, metadata: str = '') -> ActionResult:
+        """Set content URL to play
+
+        :param item_url: content URL
+        :param metadata: DIDL-Lite of the content
+        """
+        return await self.call('SetAVTransportURI', (('CurrentURI', item_url), ('CurrentURIMetaData', metadata)))
+
+    async def set_next_content_uri(self, item_url: str, metadata: str = '') -> ActionResult:
+        """Set content URL played after the current one without a gap (optional action)
+
+        :param item_url: content URL
+        :param metadata: DIDL-Lite of the content
+        """
+        return await self.call('SetNextAVTransportURI', (('NextURI', item_url), ('NextURIMetaData', metadata)))
+
+    async def play(self, speed: str = '1') -> ActionResult:
+        return await self.call('Play', (('Speed', speed),))
+
+    async def pause(self) -> ActionResult:
+        return await self.call('Pause')
+
+    async def stop(self) -> ActionResult:
+        return await self.call('Stop')
+
+    async def get_position_info(self) -> PositionInfo:
+        return PositionInfo((await self.call('GetPositionInfo')).values)
+
+    async def get_transport_info(self) -> TransportInfo:
+        return TransportInfo((await self.call('GetTransportInfo')).values)
+
+    async def get_media_info(self) -> MediaInfo:
+        return MediaInfo((await self.call('GetMediaInfo')).values)
+
+    async def subscribe(self, callback: Callable[[content_event.TransportEvent], None] = None,
+                        timeout: int = content_event.DEFAULT_SUBSCRIPTION_TIMEOUT) -> content_event.Subscription:
+        """Subscribe transport state changes (LastChange) of the renderer
+
+        SUBSCRIBE is sent with the async pool of the renderer, then events
+        can be read with `async for event in subscription.events()`.
+
+        :param callback: function called with content_event.TransportEvent on each change
+        :param timeout: requested subscription timeout in seconds (renewed automatically)
+        :return: subscription (await async_unsubscribe() when finished)
+        """
+        if not self.event_sub_url:
+            raise ValueError(f'eventSubURL is unknown : {self.control_url}')
+        subscription = content_event.Subscription(self.event_sub_url, callback, timeout,
+                                                  instance_id=self.instance_id)
+        await subscription.async_subscribe(self.pool)
+        return subscription
+
+
+def _call(func: Callable[..., ActionResult], *args):
+    try:
+        result = func(*args)
+        _logger.info(f'{result.action} OK')
+    except SoapError as e:
+        _logger.error(str(e))
+
+
+def get_rendererinfo(url: str, pool: SessionPool = None):
     """Get renderer information.
 
+    The parsed description is cached per URL (see device_description).
+
     :param url: renderer URL for description
+    :param pool: HTTP session pool (default pool if None)
     :return: list of renderer various control URLs
     """
-    headers = {'Content-Type': "text/xml; charset=utf-8"}
-    ret = requests.get(url, headers=headers)
-
-    if ret.status_code == 200:
-        # print(ret.text)
-        et = ElementTree.fromstring(ret.text)
-        root_ns = _get_root_namespace(et)
-        infos = _parse_xml(et, root_ns)
-        infos = _add_url_to_rendererinfo(url, infos)
-        return infos
-    else:
-        _logger.error(f'Error : {ret.status_code}')
+    try:
+        description = device_description.get_description(url, pool)
+    except (requests.RequestException, ElementTree.ParseError) as e:
+        _logger.error(f'Error : {e}')
+        return None
+
+    infos = []
+    for device in description.iter_devices():
+        infos += [service.get_data() for service in device.services]
+        infos.append({k: v for k, v in device.info.items() if v is not None})
+    return infos
+
+
+def get_control_url(url: str, service: str = 'AVTransport', pool: SessionPool = None) -> Optional[str]:
+    """Get control URL of renderer service
+
+    :param url: renderer URL for description
+    :param service: serviceType, short name or serviceId
+    :param pool: HTTP session pool (default pool if None)
+    :return: control URL (None if the renderer does not have the service)
+    """
+    found = device_description.get_description(url, pool).find_service(service)
+    return found.control_url if found else None
 
 
-def set_content_uri(url: str, item_url: str):
+def set_content_uri(url: str, item_url: str, pool: SessionPool = None, metadata: str = ''):
     """Set content URL to play.
 
     :param url: Renderer SetAVTransport control URL
     :param item_url: content URL
+    :param pool: HTTP session pool (default pool if None)
+    :param metadata: DIDL-Lite of the content (see didl_metadata)
     :return:
     """
-    action = 'SetAVTransportURI'
-    data = f"""<InstanceID>0</InstanceID>
-               <CurrentURI>{item_url}</CurrentURI>
-               <CurrentURIMetaData></CurrentURIMetaData>"""
-    _request(url, action, data)
+    _call(Renderer(url, pool=pool).set_content_uri, item_url, metadata)
 
 
-def play(url: str):
+def play(url: str, pool: SessionPool = None):
     """Play (set_content_uri should be called before play)
 
     :param url: Renderer SetAVTransport control URL
+    :param pool: HTTP session pool (default pool if None)
     :return:
     """
-    action = 'Play'
-    data = f"""<InstanceID>0</InstanceID>
-               <Speed>1</Speed>"""
-    _request(url, action, data)
+    _call(Renderer(url, pool=pool).play)
 
 
-def pause(url: str):
+def pause(url: str, pool: SessionPool = None):
     """Pause
 
     :param url:
+    :param pool: HTTP session pool (default pool if None)
     :return:
     """
-    action = 'Pause'
-    data = '<InstanceID>0</InstanceID>'
-    _request(url, action, data)
+    _call(Renderer(url, pool=pool).pause)
 
 
-def stop(url: str):
+def stop(url: str, pool: SessionPool = None):
     """Stop
 
     :param url:
+    :param pool: HTTP session pool (default pool if None)
     :return:
     """
-    action = 'Stop'
-    data = '<InstanceID>0</InstanceID>'
-    _request(url, action, data)
+    _call(Renderer(url, pool=pool).stop)
 
 
 def _main():
@@ -0,0 +1,263 @@
+import argparse
+import logging
+import threading
+from typing import Callable, List, Optional, Union
+
+import requests
+
+from content_event import TransportEvent
+from content_play import Renderer, SoapError, didl_metadata
+from renderer_state import RendererState
+
+_logger = logging.getLogger('dlnautil')
+
+_STOPPED_STATES = ('STOPPED', 'NO_MEDIA_PRESENT')
+# number of Set + Play tries of an entry before it is skipped
+_PLAY_ATTEMPTS = 2
+
+
+class PlaylistEntry:
+    """Content in a playlist"""
+
+    def __init__(self, uri: str, title: str = '', metadata: str = None, **kwargs):
+        """
+        :param uri: content URL
+        :param title: title of content
+        :param metadata: DIDL-Lite of content (built by didl_metadata with title and kwargs if None)
+        """
+        self.uri = uri
+        self.title = title
+        self.metadata = metadata if metadata is not None else didl_metadata(uri, title, **kwargs)
+
+    @classmethod
+    def from_item(cls, item) -> 'PlaylistEntry':
+        """Create entry from content_browse.Item (or its get_data())
+
+        :param item: browsed item which has res
+        :return: entry
+        """
+        if not item.get('res'):
+            raise ValueError(f'item has no res : {item.get("id")} {item.get("title")}')
+        kwargs = {k: item.get(f) for k, f in (('upnp_class', 'class'), ('protocol_info', 'protocolInfo'),
+                                               ('duration', 'duration'), ('item_id', 'id'),
+                                               ('parent_id', 'parentID')) if item.get(f)}
+        return cls(item.get('res'), item.get('title') or '', **kwargs)
+
+    def __repr__(self):
+        return f'PlaylistEntry({self.title}, {self.uri})'
+
+
+class Playlist:
+    """Queue of contents played on a renderer without gaps
+
+    The next entry is preloaded with SetNextAVTransportURI so that the
+    renderer moves to it by itself when the current one ends. Renderers
+    which do not support the action get SetAVTransportURI + Play when the
+    current entry has stopped. Progress is followed by GENA events of
+    AVTransport if the renderer has eventSubURL, by polling otherwise.
+
+    usage:
+        playlist = Playlist(Renderer.from_description(url), [PlaylistEntry(u) for u in urls])
+        playlist.start()
+    """
+
+    def __init__(self, renderer: Renderer, entries: List[Union[PlaylistEntry, str]] = (), use_next: bool = True,
+                 on_change: Callable[['Playlist'], None] = None, state: RendererState = None):
+        """
+        :param renderer: renderer client (from Renderer.from_description to follow events)
+        :param entries: entries or content URLs
+        :param use_next: whether preload next entry with SetNextAVTransportURI
+        :param on_change: function called when current entry changes or the playlist ends
+        :param state: state cache polled when events are not available (created if None)
+        """
+        self.renderer = renderer
+        self.entries = [self._entry(e) for e in entries]
+        self.use_next = use_next
+        self.on_change = on_change
+        self.index = -1
+        self.gapless_transitions = 0
+        self.fallback_transitions = 0
+        # entries skipped because Set + Play failed
+        self.failed_entries = 0
+        self._state = state
+        self._polling = False
+        self._subscription = None
+        self._preloaded = None
+        # whether the renderer has been seen playing the current entry
+        self._confirmed = False
+        self._running = False
+        self._lock = threading.RLock()
+
+    @staticmethod
+    def _entry(entry: Union[PlaylistEntry, str]) -> PlaylistEntry:
+        return entry if isinstance(entry, PlaylistEntry) else PlaylistEntry(entry)
+
+    @property
+    def current(self) -> Optional[PlaylistEntry]:
+        with self._lock:
+            return self.entries[self.index] if 0 <= self.index < len(self.entries) else None
+
+    def _next_entry(self) -> Optional[PlaylistEntry]:
+        return self.entries[self.index + 1] if self.index + 1 < len(self.entries) else None
+
+    def add(self, entry: Union[PlaylistEntry, str]):
+        """Append entry (preloaded at once if it is the next one)"""
+        with self._lock:
+            self.entries.append(self._entry(entry))
+            if self._running and self._preloaded is None:
+                self._preload()
+
+    def start(self, index: int = 0):
+        """Start playing from entry of index
+
+        :param index: index of entry to play first
+        """
+        with self._lock:
+            self._running = True
+            self._follow()
+            self._play(index)
+
+    def next(self):
+        """Skip to the next entry"""
+        with self._lock:
+            self._play(self.index + 1)
+
+    def stop(self):
+        """Stop playing and following the renderer"""
+        with self._lock:
+            self._running = False
+        if self._subscription:
+            self._subscription.unsubscribe()
+            self._subscription = None
+        if self._polling:
+            self._state.stop()
+            self._polling = False
+        try:
+            self.renderer.stop()
+        except (SoapError, requests.RequestException) as e:
+            _logger.warning(f'stop error : {e}')
+
+    def _follow(self):
+        if self._subscription or self._polling:
+            return
+        if self.renderer.event_sub_url:
+            try:
+                self._subscription = self.renderer.subscribe(self._on_event)
+                return
+            except requests.RequestException as e:
+                _logger.warning(f'subscribe error, poll instead : {e}')
+        if self._state is None:
+            self._state = RendererState(self.renderer)
+        self._state.start(self._on_poll)
+        self._polling = True
+
+    def _play(self, index: int):
+        self._preloaded = None
+        self._confirmed = False
+        if index >= len(self.entries):
+            _logger.debug('playlist end')
+            self.index = len(self.entries)
+            self._changed()
+            return
+        entry = self.entries[index]
+        _logger.debug(f'play {index} : {entry}')
+        self.renderer.set_content_uri(entry.uri, entry.metadata)
+        self.renderer.play()
+        # index moves only when the renderer took the entry
+        self.index = index
+        self._changed()
+        self._preload()
+
+    def _preload(self):
+        entry = self._next_entry()
+        if not self.use_next or entry is None:
+            return
+        try:
+            self.renderer.set_next_content_uri(entry.uri, entry.metadata)
+            self._preloaded = entry
+            _logger.debug(f'preloaded {self.index + 1} : {entry}')
+        except SoapError as e:
+            # SetNextAVTransportURI is optional, play next entry by Set + Play
+            _logger.info(f'SetNextAVTransportURI is not supported, fall back to Set + Play : {e}')
+            self.use_next = False
+        except requests.RequestException as e:
+            # try again with the next entry
+            _logger.warning(f'preload error : {e}')
+
+    def _changed(self):
+        if self.on_change:
+            try:
+                self.on_change(self)
+            except Exception as e:
+                _logger.warning(f'playlist callback error : {e}')
+
+    def _update(self, transport_state: Optional[str], uri: Optional[str]):
+        with self._lock:
+            if not self._running or self.current is None:
+                return
+            if uri and self._preloaded is not None and uri == self._preloaded.uri:
+                # the renderer moved to the preloaded entry by itself
+                self.index += 1
+                self.gapless_transitions += 1
+                self._preloaded = None
+                self._confirmed = True
+                _logger.debug(f'gapless to {self.index} : {self.current}')
+                self._changed()
+                self._preload()
+                return
+            if transport_state == 'PLAYING' and (not uri or uri == self.current.uri):
+                self._confirmed = True
+            elif transport_state in _STOPPED_STATES and self._confirmed:
+                if self._next_entry():
+                    self.fallback_transitions += 1
+                self._play_or_skip(self.index + 1)
+
+    def _play_or_skip(self, index: int):
+        # called on the event / poll thread, errors are handled here not to stall the playlist
+        while True:
+            for _ in range(_PLAY_ATTEMPTS):
+                try:
+                    self._play(index)
+                    return
+                except (SoapError, requests.RequestException) as e:
+                    _logger.warning(f'play error : {index} : {e}')
+            _logger.warning(f'skip {index} : {self.entries[index]}')
+            self.failed_entries += 1
+            index += 1
+
+    def _on_event(self, event: TransportEvent):
+        uri = event.changes.get('AVTransportURI') or event.changes.get('CurrentTrackURI')
+        self._update(event.changes.get('TransportState'), uri)
+
+    def _on_poll(self, state: RendererState):
+        self._update(state.transport_info().state, state.position_info().track_uri)
+
+
+def _main():
+    p = argparse.ArgumentParser()
+    p.add_argument('url', help='renderer url for description')
+    p.add_argument('item_url', nargs='+', help='content urls to play in order')
+    p.add_argument('--no_next', action='store_true', help='do not use SetNextAVTransportURI')
+    args = p.parse_args()
+
+    finished = threading.Event()
+
+    def on_change(playlist: Playlist):
+        if playlist.current:
+            _logger.info(f'playing {playlist.index} : {playlist.current.uri}')
+        else:
+            finished.set()
+
+    playlist = Playlist(Renderer.from_description(args.url), args.item_url, not args.no_next, on_change)
+    playlist.start()
+    try:
+        while not finished.wait(1):
+            pass
+    except KeyboardInterrupt:
+        pass
+    playlist.stop()
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    _main()
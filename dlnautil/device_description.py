@@ -0,0 +1,391 @@
+import argparse
+import logging
+import re
+import threading
+import time
+from typing import Dict, Iterator, List, Optional, Tuple, Union
+from urllib.parse import urljoin
+from xml.etree import ElementTree
+
+import requests
+
+import async_http
+from http_session import SessionPool, get_pool
+import metrics
+
+_logger = logging.getLogger('dlnautil')
+
+# seconds a fetched description is used before it is revalidated (if the response has no max-age)
+DESCRIPTION_MAX_AGE = 300.0
+
+_DEVICE_TAGS = ('deviceType', 'friendlyName', 'manufacturer', 'modelName', 'modelNumber', 'UDN')
+
+
+def _tag(node: ElementTree.Element) -> str:
+    # strip namespace
+    return node.tag.rsplit('}', 1)[-1]
+
+
+def _children(node: ElementTree.Element, tag: str) -> Iterator[ElementTree.Element]:
+    return (c for c in node if _tag(c) == tag)
+
+
+def _child_text(node: ElementTree.Element, tag: str) -> Optional[str]:
+    for c in _children(node, tag):
+        return c.text.strip() if c.text else c.text
+    return None
+
+
+def short_type(type_: str) -> str:
+    """Get short name of device/service type
+
+    e.g. urn:schemas-upnp-org:service:AVTransport:1 -> AVTransport
+
+    :param type_: deviceType or serviceType
+    :return: short name
+    """
+    parts = type_.split(':') if type_ else []
+    return parts[-2] if len(parts) >= 2 else type_
+
+
+class Service:
+    """Service in device description with URLs resolved by base URL"""
+
+    def __init__(self, service_type: str, service_id: str, control_url: str, event_sub_url: str, scpd_url: str,
+                 udn: str):
+        self.service_type = service_type
+        self.service_id = service_id
+        self.control_url = control_url
+        self.event_sub_url = event_sub_url
+        self.scpd_url = scpd_url
+        # UDN of device which has the service
+        self.udn = udn
+
+    def get_data(self) -> dict:
+        """Get service as dict (keys of device description, 'url' is control URL)"""
+        return {
+            'serviceType': self.service_type,
+            'serviceId': self.service_id,
+            'SCPDURL': self.scpd_url,
+            'eventSubURL': self.event_sub_url,
+            'url': self.control_url,
+        }
+
+    def __repr__(self):
+        return f'Service({self.service_type}, {self.control_url})'
+
+
+class Device:
+    """Device (root or embedded) in device description"""
+
+    def __init__(self, info: dict, services: List[Service], devices: List['Device']):
+        self.info = info
+        self.services = services
+        self.devices = devices
+
+    @property
+    def device_type(self) -> str:
+        return self.info.get('deviceType')
+
+    @property
+    def friendly_name(self) -> str:
+        return self.info.get('friendlyName')
+
+    @property
+    def udn(self) -> str:
+        return self.info.get('UDN')
+
+    def __repr__(self):
+        return f'Device({self.device_type}, {self.friendly_name})'
+
+
+class DeviceDescription:
+    """Parsed device description with indexes of devices and services
+
+    Services are looked up by full serviceType, its short name (e.g.
+    AVTransport) or serviceId, devices by UDN or deviceType.
+    """
+
+    def __init__(self, location: str, base_url: str, root: Device):
+        self.location = location
+        self.base_url = base_url
+        self.root = root
+        # document the description was parsed from (to persist it, see restore)
+        self.xml: Optional[bytes] = None
+        # validators for conditional GET
+        self.etag = None
+        self.last_modified = None
+        # time.monotonic() until which get_description uses it without revalidation
+        self.expires = 0.0
+        self._services = {}
+        self._devices = {}
+        for device in self.iter_devices():
+            for key in (device.udn, device.device_type, short_type(device.device_type)):
+                if key:
+                    self._devices.setdefault(key, device)
+            for service in device.services:
+                for key in (service.service_type, short_type(service.service_type), service.service_id):
+                    if key:
+                        self._services.setdefault(key, []).append(service)
+
+    def iter_devices(self) -> Iterator[Device]:
+        """Iterate root device and embedded devices (depth first)"""
+        stack = [self.root]
+        while stack:
+            device = stack.pop()
+            yield device
+            stack.extend(reversed(device.devices))
+
+    def find_service(self, service: str) -> Optional[Service]:
+        """Find first service of the type
+
+        :param service: serviceType, short name (e.g. AVTransport) or serviceId
+        :return: service or None
+        """
+        services = self._services.get(service)
+        return services[0] if services else None
+
+    def services(self, service: str = None) -> List[Service]:
+        """Get services
+
+        :param service: serviceType, short name or serviceId (all services if None)
+        :return: list of services
+        """
+        if service is None:
+            return [s for d in self.iter_devices() for s in d.services]
+        return list(self._services.get(service, []))
+
+    def find_device(self, device: str) -> Optional[Device]:
+        """Find device
+
+        :param device: UDN, deviceType or its short name (e.g. MediaRenderer)
+        :return: device or None
+        """
+        return self._devices.get(device)
+
+
+def _parse_device(node: ElementTree.Element, base_url: str) -> Device:
+    info = {t: _child_text(node, t) for t in _DEVICE_TAGS}
+    services = []
+    for service_list in _children(node, 'serviceList'):
+        for s in _children(service_list, 'service'):
+            urls = [_child_text(s, t) for t in ('controlURL', 'eventSubURL', 'SCPDURL')]
+            urls = [urljoin(base_url, u) if u else u for u in urls]
+            services.append(Service(_child_text(s, 'serviceType'), _child_text(s, 'serviceId'), *urls,
+                                    udn=info['UDN']))
+    devices = []
+    for device_list in _children(node, 'deviceList'):
+        devices += [_parse_device(d, base_url) for d in _children(device_list, 'device')]
+    return Device(info, services, devices)
+
+
+def parse(xml: Union[str, bytes], location: str) -> DeviceDescription:
+    """Parse device description
+
+    :param xml: device description document
+    :param location: URL of the description (base of relative URLs if URLBase is missing)
+    :return: parsed description
+    """
+    et = ElementTree.fromstring(xml)
+    base_url = _child_text(et, 'URLBase') or location
+    for node in _children(et, 'device'):
+        description = DeviceDescription(location, base_url, _parse_device(node, base_url))
+        description.xml = xml if isinstance(xml, bytes) else xml.encode('utf-8')
+        return description
+    raise ElementTree.ParseError(f'no device in description : {location}')
+
+
+_descriptions: Dict[str, DeviceDescription] = {}
+_lock = threading.Lock()
+
+
+def _conditional_headers(location: str, etag: str = None,
+                         last_modified: str = None) -> Tuple[Optional[DeviceDescription], Dict[str, str]]:
+    with _lock:
+        cached = _descriptions.get(location)
+    if cached:
+        etag, last_modified = cached.etag, cached.last_modified
+    headers = {}
+    if etag:
+        headers['If-None-Match'] = etag
+    if last_modified:
+        headers['If-Modified-Since'] = last_modified
+    return cached, headers
+
+
+def _max_age(headers) -> float:
+    m = re.search(r'max-age\s*=\s*(\d+)', headers.get('Cache-Control', ''), re.IGNORECASE)
+    return float(m.group(1)) if m else DESCRIPTION_MAX_AGE
+
+
+def _received(location: str, res, cached: Optional[DeviceDescription], headers: Dict[str, str],
+              elapsed: float) -> DeviceDescription:
+    """Parse and cache description from response (requests.Response or async_http.AsyncResponse)"""
+    m = metrics.get_metrics()
+    if m is not None:
+        m.observe(metrics.REQUEST_SECONDS, elapsed, action='description')
+        m.observe(metrics.RESPONSE_BYTES, len(res.content), action='description')
+        m.inc(metrics.CACHE_REQUESTS, cache='description',
+              result='hit' if res.status_code == 304 and headers else 'miss')
+    if res.status_code == 304 and headers:
+        _logger.debug(f'not modified : {location}')
+        cached.expires = time.monotonic() + _max_age(res.headers)
+        return cached
+    if res.status_code != 200:
+        _logger.warning(f'description error : {location} : {res.status_code}')
+        if m is not None:
+            m.inc(metrics.REQUEST_ERRORS, action='description')
+        res.raise_for_status()
+
+    start = time.perf_counter()
+    description = parse(res.content, location)
+    if m is not None:
+        m.observe(metrics.PARSE_SECONDS, time.perf_counter() - start, action='description')
+    description.etag = res.headers.get('ETag')
+    description.last_modified = res.headers.get('Last-Modified')
+    description.expires = time.monotonic() + _max_age(res.headers)
+    with _lock:
+        _descriptions[location] = description
+    return description
+
+
+def _refetch(location: str, res, cached: Optional[DeviceDescription], headers: Dict[str, str]) -> bool:
+    # the caller's validators matched, but there is no parsed description to return
+    if res.status_code == 304 and headers and cached is None:
+        _logger.debug(f'not modified but not cached, fetch again : {location}')
+        return True
+    return False
+
+
+def _request_error():
+    m = metrics.get_metrics()
+    if m is not None:
+        m.inc(metrics.REQUEST_ERRORS, action='description')
+
+
+def fetch_description(location: str, pool: SessionPool = None, timeout: float = None, etag: str = None,
+                      last_modified: str = None) -> DeviceDescription:
+    """Fetch device description and cache it for the location
+
+    The request is conditional (If-None-Match / If-Modified-Since) with the
+    validators of the cached description or the given ones.
+
+    :param location: URL of device description (LOCATION of SSDP)
+    :param pool: HTTP session pool (default pool if None)
+    :param timeout: request timeout in seconds (default timeout of pool if None)
+    :param etag: ETag of the description the caller already has
+    :param last_modified: Last-Modified of the description the caller already has
+    :return: description (the cached one if not modified)
+    """
+    cached, headers = _conditional_headers(location, etag, last_modified)
+    kwargs = {'timeout': timeout} if timeout else {}
+    start = time.perf_counter()
+    try:
+        res = get_pool(pool).get(location, headers=headers, **kwargs)
+        if _refetch(location, res, cached, headers):
+            headers = {}
+            res = get_pool(pool).get(location, **kwargs)
+    except requests.RequestException:
+        _request_error()
+        raise
+    return _received(location, res, cached, headers, time.perf_counter() - start)
+
+
+async def async_fetch_description(location: str, pool: async_http.AsyncSessionPool = None,
+                                  timeout: float = None, etag: str = None,
+                                  last_modified: str = None) -> DeviceDescription:
+    """Fetch device description without blocking the event loop (see fetch_description)
+
+    :param location: URL of device description (LOCATION of SSDP)
+    :param pool: async HTTP session pool (default pool of the event loop if None)
+    :param timeout: request timeout in seconds (default timeout of pool if None)
+    :param etag: ETag of the description the caller already has
+    :param last_modified: Last-Modified of the description the caller already has
+    :return: description (the cached one if not modified)
+    """
+    cached, headers = _conditional_headers(location, etag, last_modified)
+    start = time.perf_counter()
+    try:
+        res = await async_http.get_pool(pool).get(location, headers=headers, timeout=timeout)
+        if _refetch(location, res, cached, headers):
+            headers = {}
+            res = await async_http.get_pool(pool).get(location, timeout=timeout)
+    except requests.RequestException:
+        _request_error()
+        raise
+    return _received(location, res, cached, headers, time.perf_counter() - start)
+
+
+def _fresh(location: str) -> Optional[DeviceDescription]:
+    with _lock:
+        cached = _descriptions.get(location)
+    return cached if cached and time.monotonic() < cached.expires else None
+
+
+def get_description(location: str, pool: SessionPool = None, timeout: float = None) -> DeviceDescription:
+    """Get device description, fetched only if not cached
+
+    A cached description older than its max-age (Cache-Control of the
+    response, DESCRIPTION_MAX_AGE if missing) is revalidated by conditional GET.
+
+    :param location: URL of device description (LOCATION of SSDP)
+    :param pool: HTTP session pool (default pool if None)
+    :param timeout: request timeout in seconds (default timeout of pool if None)
+    :return: description
+    """
+    cached = _fresh(location)
+    return cached if cached else fetch_description(location, pool, timeout)
+
+
+async def async_get_description(location: str, pool: async_http.AsyncSessionPool = None,
+                                timeout: float = None) -> DeviceDescription:
+    """Get device description without blocking the event loop, fetched only if not cached (see get_description)
+
+    :param location: URL of device description (LOCATION of SSDP)
+    :param pool: async HTTP session pool (default pool of the event loop if None)
+    :param timeout: request timeout in seconds (default timeout of pool if None)
+    :return: description
+    """
+    cached = _fresh(location)
+    return cached if cached else await async_fetch_description(location, pool, timeout)
+
+
+def restore(location: str, xml: bytes, etag: str = None, last_modified: str = None) -> DeviceDescription:
+    """Parse description kept by an earlier process and cache it for the location
+
+    The next fetch_description of the location is a conditional GET with
+    the given validators, and the restored description is used on 304.
+
+    :param location: URL of device description
+    :param xml: description document (DeviceDescription.xml)
+    :param etag: ETag the document was fetched with
+    :param last_modified: Last-Modified the document was fetched with
+    :return: description
+    """
+    description = parse(xml, location)
+    description.etag = etag
+    description.last_modified = last_modified
+    with _lock:
+        _descriptions.setdefault(location, description)
+    return description
+
+
+def clear_cache():
+    with _lock:
+        _descriptions.clear()
+
+
+def _main():
+    p = argparse.ArgumentParser()
+    p.add_argument('location', help='URL of device description')
+    args = p.parse_args()
+    description = get_description(args.location)
+    for device in description.iter_devices():
+        _logger.info(f'--- {device.friendly_name} : {device.device_type} : {device.udn}')
+        for service in device.services:
+            _logger.info(f'{service.service_type} : {service.control_url}')
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    _main()
@@ -0,0 +1,212 @@
+import json
+import logging
+import os
+import threading
+import time
+from typing import Callable, List, Optional
+from xml.etree import ElementTree
+
+import device_description
+from server_search import DETAIL_FAILED, DETAIL_OK, DETAIL_PENDING, Server
+
+_logger = logging.getLogger('dlnautil')
+
+EVENT_ADDED = 'added'
+EVENT_UPDATED = 'updated'
+EVENT_REMOVED = 'removed'
+
+
+class DeviceRegistry:
+    """Discovered devices keyed by USN, persisted to a json file
+
+    Each device expires by CACHE-CONTROL max-age of its SSDP message. With
+    path, the registry is loaded on creation and saved by save(), so that a
+    new process can use known devices without waiting an M-SEARCH window.
+    Device descriptions are kept too with their validators (ETag,
+    Last-Modified), so that find_service works at once and descriptions
+    are revalidated by conditional GET.
+    Callbacks added by add_callback are called with (event, server) on
+    every change, e.g. to follow devices reported by ssdp_listener.
+    """
+
+    def __init__(self, path: str = None):
+        """
+        :param path: json file to load and save devices (memory only if None)
+        """
+        self.path = path
+        self._servers = {}
+        self._scanning = False
+        self._callbacks = []
+        self._lock = threading.Lock()
+        if path:
+            self.load()
+
+    def add_callback(self, callback: Callable[[str, Server], None]):
+        """Add function called on changes of devices
+
+        :param callback: function called with (event, server), event is 'added', 'updated' or 'removed'
+        """
+        with self._lock:
+            self._callbacks.append(callback)
+
+    def remove_callback(self, callback: Callable[[str, Server], None]):
+        with self._lock:
+            if callback in self._callbacks:
+                self._callbacks.remove(callback)
+
+    def _notify(self, event: str, servers: List[Server]):
+        with self._lock:
+            callbacks = list(self._callbacks)
+        for server in servers:
+            for callback in callbacks:
+                try:
+                    callback(event, server)
+                except Exception as e:
+                    _logger.warning(f'registry callback error : {e}')
+
+    def get(self, usn: str) -> Optional[Server]:
+        with self._lock:
+            return self._servers.get(usn)
+
+    def add(self, server: Server):
+        """Add or replace device
+
+        :param server: device found by SSDP (USN header is used as key)
+        """
+        usn = server.info.get('USN')
+        if not usn:
+            return
+        with self._lock:
+            event = EVENT_UPDATED if usn in self._servers else EVENT_ADDED
+            self._servers[usn] = server
+        self._notify(event, [server])
+
+    def remove(self, usn: str) -> Optional[Server]:
+        with self._lock:
+            server = self._servers.pop(usn, None)
+        if server:
+            self._notify(EVENT_REMOVED, [server])
+        return server
+
+    def remove_device(self, udn: str) -> List[Server]:
+        """Remove all entries of a device (e.g. by ssdp:byebye)
+
+        :param udn: UDN of device (uuid:...)
+        :return: removed entries
+        """
+        with self._lock:
+            usns = [usn for usn in self._servers if usn == udn or usn.startswith(f'{udn}::')]
+            removed = [self._servers.pop(usn) for usn in usns]
+        self._notify(EVENT_REMOVED, removed)
+        return removed
+
+    def remove_expired(self) -> List[Server]:
+        """Remove devices whose max-age has passed (e.g. not answered to the last scan)
+
+        :return: removed devices
+        """
+        now = time.time()
+        with self._lock:
+            expired = [usn for usn, s in self._servers.items() if s.is_expired(now)]
+            removed = [self._servers.pop(usn) for usn in expired]
+        self._notify(EVENT_REMOVED, removed)
+        return removed
+
+    def servers(self, include_expired: bool = False) -> List[Server]:
+        """Get devices
+
+        :param include_expired: include devices whose max-age has passed
+        :return: list of devices
+        """
+        now = time.time()
+        with self._lock:
+            return [s for s in self._servers.values() if include_expired or not s.is_expired(now)]
+
+    def has_expired(self) -> bool:
+        """Whether some devices have expired (i.e. a new scan is needed)"""
+        now = time.time()
+        with self._lock:
+            return not self._servers or any(s.is_expired(now) for s in self._servers.values())
+
+    def start_scan(self) -> bool:
+        """Mark background scan running
+
+        :return: False if another scan is already running
+        """
+        with self._lock:
+            if self._scanning:
+                return False
+            self._scanning = True
+            return True
+
+    def finish_scan(self):
+        with self._lock:
+            self._scanning = False
+
+    def load(self):
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, encoding='utf-8') as f:
+                entries = json.load(f)
+        except (OSError, ValueError) as e:
+            _logger.warning(f'registry read error : {self.path} : {e}')
+            return
+
+        servers = {}
+        for usn, entry in entries.items():
+            server = Server(entry['info'])
+            server.expires = entry.get('expires', 0)
+            server.interface = entry.get('interface')
+            self._restore_description(server, entry)
+            servers[usn] = server
+        with self._lock:
+            self._servers = servers
+        _logger.debug(f'registry loaded : {self.path} : {len(servers)} devices')
+
+    @staticmethod
+    def _restore_description(server: Server, entry: dict):
+        location = entry.get('detail_location')
+        xml = entry.get('description')
+        if not location or not xml or not entry.get('detail'):
+            # a description not fetched by the last process is fetched again
+            return
+        try:
+            # the document is saved as latin-1 text to keep its bytes as they were
+            description = device_description.restore(location, xml.encode('latin-1'), entry.get('etag'),
+                                                     entry.get('last_modified'))
+        except (ElementTree.ParseError, UnicodeEncodeError) as e:
+            _logger.warning(f'registry description error : {location} : {e}')
+            return
+        server.description = description
+        server.detail = entry['detail']
+        server.detail_status = DETAIL_OK
+        server.detail_location = location
+        server.etag = description.etag
+        server.last_modified = description.last_modified
+
+    @staticmethod
+    def _entry(server: Server) -> dict:
+        detailed = server.detail_status != DETAIL_FAILED and server.description is not None
+        return {
+            'info': server.info,
+            'detail': server.detail if detailed else None,
+            'description': server.description.xml.decode('latin-1') if detailed and server.description.xml else None,
+            'expires': server.expires,
+            'detail_location': server.detail_location,
+            'etag': server.etag,
+            'last_modified': server.last_modified,
+            'interface': server.interface,
+        }
+
+    def save(self):
+        if not self.path:
+            return
+        with self._lock:
+            entries = {usn: self._entry(s) for usn, s in self._servers.items()}
+        try:
+            with open(f'{self.path}.tmp', 'w', encoding='utf-8') as f:
+                json.dump(entries, f, ensure_ascii=False)
+            os.replace(f'{self.path}.tmp', self.path)
+        except OSError as e:
+            _logger.warning(f'registry write error : {self.path} : {e}')
@@ -0,0 +1,540 @@
+"""In-process stand-ins of DLNA devices for tests and benchmarks
+
+FakeMediaServer serves a generated ContentDirectory tree, FakeRenderer
+answers AVTransport actions and GENA subscriptions, and FakeSsdpResponder
+answers M-SEARCH on loopback. They listen on 127.0.0.1 with free ports, so
+the other modules can be driven without hardware on the LAN:
+
+    with FakeMediaServer(containers=10, items=100) as server:
+        content_browse.browse(server.control_url, server.service_type, recursive='true')
+
+    with FakeSsdpResponder([server]) as responder:
+        server_search.SSDP_ADDR = responder.address
+        server_search.search()
+"""
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import logging
+import queue
+import socket
+import threading
+import time
+from typing import Dict, List, Optional, Sequence, Tuple
+import urllib.request
+import uuid
+from xml.etree import ElementTree
+from xml.sax.saxutils import escape
+
+import search_criteria
+
+_logger = logging.getLogger('dlnautil')
+
+_SOAP_NS = 'http://schemas.xmlsoap.org/soap/envelope/'
+
+_DESCRIPTION = ('<?xml version="1.0"?><root xmlns="urn:schemas-upnp-org:device-1-0">'
+                '<specVersion><major>1</major><minor>0</minor></specVersion><device>'
+                '<deviceType>{device_type}</deviceType><friendlyName>{name}</friendlyName>'
+                '<manufacturer>dlnautil</manufacturer><modelName>fake</modelName><UDN>{udn}</UDN><serviceList>'
+                '<service><serviceType>urn:schemas-upnp-org:service:ConnectionManager:1</serviceType>'
+                '<serviceId>urn:upnp-org:serviceId:ConnectionManager</serviceId><SCPDURL>/cm.xml</SCPDURL>'
+                '<controlURL>/cm/control</controlURL><eventSubURL>/cm/event</eventSubURL></service>'
+                '<service><serviceType>{service_type}</serviceType><serviceId>{service_id}</serviceId>'
+                '<SCPDURL>/scpd.xml</SCPDURL><controlURL>/control</controlURL><eventSubURL>/event</eventSubURL>'
+                '</service></serviceList></device></root>')
+
+_FAULT = ('<?xml version="1.0"?><s:Envelope xmlns:s="http://schemas.xmlsoap.org/soap/envelope/" '
+          's:encodingStyle="http://schemas.xmlsoap.org/soap/encoding/"><s:Body><s:Fault>'
+          '<faultcode>s:Client</faultcode><faultstring>UPnPError</faultstring><detail>'
+          '<UPnPError xmlns="urn:schemas-upnp-org:control-1-0"><errorCode>{code}</errorCode>'
+          '<errorDescription>{description}</errorDescription></UPnPError></detail></s:Fault></s:Body></s:Envelope>')
+
+
+class ActionFault(Exception):
+
+    def __init__(self, code: int, description: str):
+        super().__init__(f'{code} {description}')
+        self.code = code
+        self.description = description
+
+
+def _response(service_type: str, action: str, values: Sequence[Tuple[str, object]]) -> bytes:
+    body = ''.join(f'<{k}>{escape(str(v))}</{k}>' for k, v in values)
+    return ('<?xml version="1.0"?><s:Envelope xmlns:s="http://schemas.xmlsoap.org/soap/envelope/" '
+            's:encodingStyle="http://schemas.xmlsoap.org/soap/encoding/"><s:Body>'
+            f'<u:{action}Response xmlns:u="{service_type}">{body}</u:{action}Response>'
+            '</s:Body></s:Envelope>').encode('utf-8')
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # headers and body are separate writes, TCP_NODELAY keeps them from waiting delayed ACK
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status: int, body: bytes = b'', headers: Dict[str, str] = None):
+        self.send_response(status)
+        for k, v in (headers or {}).items():
+            self.send_header(k, v)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+        self.server.device.bytes_sent += len(body)
+
+    def _body(self) -> bytes:
+        return self.rfile.read(int(self.headers.get('Content-Length', 0)))
+
+    def do_GET(self):
+        device = self.server.device
+        device.wait()
+        self._send(200, device.description(), {'Content-Type': 'text/xml; charset="utf-8"'})
+
+    def do_POST(self):
+        device = self.server.device
+        body = self._body()
+        action = self.headers.get('SOAPACTION', '').strip('"').rpartition('#')[2]
+        device.requests += 1
+        device.wait()
+        arguments = {}
+        try:
+            # content_browse indents the envelope before the XML declaration
+            for node in ElementTree.fromstring(body.strip()).iter(f'{{{_SOAP_NS}}}Body'):
+                for a in node:
+                    arguments = {c.tag.rsplit('}', 1)[-1]: c.text or '' for c in a}
+            values = device.action(action, arguments)
+            self._send(200, _response(device.service_type, action, values),
+                       {'Content-Type': 'text/xml; charset="utf-8"'})
+        except ActionFault as e:
+            self._send(500, _FAULT.format(code=e.code, description=escape(e.description)).encode('utf-8'),
+                       {'Content-Type': 'text/xml; charset="utf-8"'})
+        except ElementTree.ParseError:
+            self._send(500, _FAULT.format(code=402, description='Invalid Args').encode('utf-8'))
+
+    def do_SUBSCRIBE(self):
+        self._body()
+        status, headers = self.server.device.subscribe(self.headers)
+        self._send(status, headers=headers)
+
+    def do_UNSUBSCRIBE(self):
+        self._body()
+        self._send(self.server.device.unsubscribe(self.headers))
+
+
+class _FakeDevice:
+    device_type = None
+    service_type = None
+    service_id = None
+
+    def __init__(self, latency: float = 0.0, name: str = None):
+        """
+        :param latency: seconds to wait before each response
+        :param name: friendlyName
+        """
+        self.latency = latency
+        self.name = name if name else type(self).__name__
+        self.udn = f'uuid:{uuid.uuid4()}'
+        self.requests = 0
+        self.bytes_sent = 0
+        self._httpd = ThreadingHTTPServer(('127.0.0.1', 0), _Handler)
+        self._httpd.daemon_threads = True
+        self._httpd.device = self
+        self._thread = threading.Thread(target=self._httpd.serve_forever, name=self.name, daemon=True)
+        self._thread.start()
+
+    @property
+    def base_url(self) -> str:
+        return f'http://127.0.0.1:{self._httpd.server_address[1]}'
+
+    @property
+    def location(self) -> str:
+        """URL of device description"""
+        return f'{self.base_url}/description.xml'
+
+    @property
+    def control_url(self) -> str:
+        return f'{self.base_url}/control'
+
+    @property
+    def event_sub_url(self) -> str:
+        return f'{self.base_url}/event'
+
+    def wait(self):
+        if self.latency:
+            time.sleep(self.latency)
+
+    def description(self) -> bytes:
+        return _DESCRIPTION.format(device_type=self.device_type, name=escape(self.name), udn=self.udn,
+                                   service_type=self.service_type, service_id=self.service_id).encode('utf-8')
+
+    def action(self, action: str, arguments: Dict[str, str]) -> Sequence[Tuple[str, object]]:
+        raise ActionFault(401, 'Invalid Action')
+
+    def subscribe(self, headers) -> Tuple[int, Dict[str, str]]:
+        return 412, {}
+
+    def unsubscribe(self, headers) -> int:
+        return 412
+
+    def close(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+class _Node:
+    __slots__ = ('id', 'parent_id', 'title', 'children')
+
+    def __init__(self, id_: str, parent_id: str, title: str, children: Optional[List['_Node']]):
+        self.id = id_
+        self.parent_id = parent_id
+        self.title = title
+        # None for items
+        self.children = children
+
+
+class FakeMediaServer(_FakeDevice):
+    """ContentDirectory server with a generated tree
+
+    Root '0' has containers, each container has items and (up to depth)
+    sub containers. Browse answers at most page_cap entries per request.
+    """
+    device_type = 'urn:schemas-upnp-org:device:MediaServer:1'
+    service_type = 'urn:schemas-upnp-org:service:ContentDirectory:1'
+    service_id = 'urn:upnp-org:serviceId:ContentDirectory'
+
+    def __init__(self, containers: int = 10, items: int = 100, depth: int = 1, page_cap: int = 100,
+                 latency: float = 0.0, update_id: int = 1, search_caps: str = 'upnp:class,dc:title',
+                 name: str = None):
+        """
+        :param containers: number of containers in each container above depth
+        :param items: number of items in each container
+        :param depth: depth of container tree
+        :param page_cap: max number of entries in a Browse response
+        :param latency: seconds to wait before each response
+        :param update_id: initial SystemUpdateID
+        :param search_caps: SearchCaps (empty if the server can not search)
+        :param name: friendlyName
+        """
+        self.page_cap = page_cap
+        self.system_update_id = update_id
+        self.search_caps = search_caps
+        self._nodes = {}
+        self._root = self._build('0', '-1', 'root', containers, items, depth)
+        super().__init__(latency, name)
+
+    def _build(self, id_: str, parent_id: str, title: str, containers: int, items: int, depth: int) -> _Node:
+        children = []
+        node = _Node(id_, parent_id, title, children)
+        self._nodes[id_] = node
+        if depth > 0:
+            for c in range(containers):
+                children.append(self._build(f'{id_}/{c}', id_, f'{title} {c}', containers, items, depth - 1))
+        if id_ != '0':
+            for i in range(items):
+                item = _Node(f'{id_}/i{i}', id_, f'video {i} of {title}', None)
+                self._nodes[item.id] = item
+                children.append(item)
+        return node
+
+    @property
+    def item_count(self) -> int:
+        return sum(1 for n in self._nodes.values() if n.children is None)
+
+    @property
+    def container_count(self) -> int:
+        return sum(1 for n in self._nodes.values() if n.children is not None)
+
+    def touch(self):
+        """Increment SystemUpdateID (as if contents changed)"""
+        self.system_update_id += 1
+
+    def _didl(self, nodes: Sequence[_Node]) -> str:
+        out = ['<DIDL-Lite xmlns="urn:schemas-upnp-org:metadata-1-0/DIDL-Lite/" '
+               'xmlns:dc="http://purl.org/dc/elements/1.1/" xmlns:upnp="urn:schemas-upnp-org:metadata-1-0/upnp/">']
+        for n in nodes:
+            if n.children is not None:
+                out.append(f'<container id="{escape(n.id)}" parentID="{escape(n.parent_id)}" '
+                           f'childCount="{len(n.children)}" restricted="1"><dc:title>{escape(n.title)}</dc:title>'
+                           '<upnp:class>object.container.storageFolder</upnp:class></container>')
+            else:
+                out.append(f'<item id="{escape(n.id)}" parentID="{escape(n.parent_id)}" restricted="1">'
+                           f'<dc:title>{escape(n.title)}</dc:title><dc:date>2020-01-02</dc:date>'
+                           '<upnp:class>object.item.videoItem</upnp:class>'
+                           '<res protocolInfo="http-get:*:video/mp4:*" size="1000000" duration="0:01:00.000" '
+                           f'resolution="1920x1080">{self.base_url}/content/{escape(n.id)}.mp4</res></item>')
+        out.append('</DIDL-Lite>')
+        return ''.join(out)
+
+    def _descendants(self, node: _Node) -> List[_Node]:
+        ret = []
+        stack = [node]
+        while stack:
+            for c in reversed(stack.pop().children):
+                if c.children is None:
+                    ret.append(c)
+                else:
+                    stack.append(c)
+        return ret
+
+    def _page(self, entries: List[_Node], arguments: Dict[str, str]) -> Sequence[Tuple[str, object]]:
+        start = int(arguments.get('StartingIndex') or 0)
+        count = int(arguments.get('RequestedCount') or 0)
+        count = self.page_cap if count == 0 else min(count, self.page_cap)
+        page = entries[start:start + count]
+        return (('Result', self._didl(page)), ('NumberReturned', len(page)), ('TotalMatches', len(entries)),
+                ('UpdateID', self.system_update_id))
+
+    def action(self, action: str, arguments: Dict[str, str]) -> Sequence[Tuple[str, object]]:
+        if action == 'Browse':
+            node = self._nodes.get(arguments.get('ObjectID'))
+            if node is None:
+                raise ActionFault(701, 'No such object')
+            if arguments.get('BrowseFlag') == 'BrowseMetadata':
+                return self._page([node], {})
+            return self._page(node.children or [], arguments)
+        elif action == 'Search':
+            if not self.search_caps:
+                raise ActionFault(401, 'Invalid Action')
+            node = self._nodes.get(arguments.get('ContainerID'))
+            if node is None or node.children is None:
+                raise ActionFault(710, 'No such container')
+            try:
+                match = search_criteria.compile_criteria(arguments.get('SearchCriteria') or '*')
+            except search_criteria.CriteriaError:
+                raise ActionFault(708, 'Unsupported or invalid search criteria')
+            entries = [n for n in self._descendants(node)
+                       if match({'title': n.title, 'class': 'object.item.videoItem', 'id': n.id})]
+            return self._page(entries, arguments)
+        elif action == 'GetSystemUpdateID':
+            return (('Id', self.system_update_id),)
+        elif action == 'GetSearchCapabilities':
+            return (('SearchCaps', self.search_caps),)
+        elif action == 'GetSortCapabilities':
+            return (('SortCaps', ''),)
+        return super().action(action, arguments)
+
+
+class FakeRenderer(_FakeDevice):
+    """AVTransport renderer
+
+    Tracks do not play by themselves, call end_track() to finish the
+    current one (the renderer moves to NextAVTransportURI if it is set).
+    Subscribers get LastChange events by GENA NOTIFY.
+    """
+    device_type = 'urn:schemas-upnp-org:device:MediaRenderer:1'
+    service_type = 'urn:schemas-upnp-org:service:AVTransport:1'
+    service_id = 'urn:upnp-org:serviceId:AVTransport'
+
+    def __init__(self, latency: float = 0.0, support_next: bool = True, track_duration: str = '0:01:00',
+                 name: str = None):
+        """
+        :param latency: seconds to wait before each response
+        :param support_next: whether SetNextAVTransportURI is supported
+        :param track_duration: TrackDuration of every track
+        :param name: friendlyName
+        """
+        self.support_next = support_next
+        self.track_duration = track_duration
+        self.state = {'TransportState': 'NO_MEDIA_PRESENT', 'AVTransportURI': '', 'AVTransportURIMetaData': '',
+                      'NextAVTransportURI': '', 'NextAVTransportURIMetaData': '', 'RelTime': '0:00:00'}
+        # (action, time.time()) of each action
+        self.calls = []
+        self._subscriptions = {}
+        self._lock = threading.Lock()
+        # events are sent in order by one thread, not to delay responses
+        self._events = queue.Queue()
+        threading.Thread(target=self._send_events, name='fake-renderer-events', daemon=True).start()
+        super().__init__(latency, name)
+
+    def _set(self, **values):
+        with self._lock:
+            self.state.update(values)
+        self._notify()
+
+    def end_track(self):
+        """Finish the current track"""
+        if self.state['NextAVTransportURI']:
+            self._set(AVTransportURI=self.state['NextAVTransportURI'],
+                      AVTransportURIMetaData=self.state['NextAVTransportURIMetaData'],
+                      NextAVTransportURI='', NextAVTransportURIMetaData='', RelTime='0:00:00',
+                      TransportState='PLAYING')
+        else:
+            self._set(TransportState='STOPPED', RelTime='0:00:00')
+
+    def action(self, action: str, arguments: Dict[str, str]) -> Sequence[Tuple[str, object]]:
+        self.calls.append((action, time.time()))
+        state = self.state
+        if action == 'SetAVTransportURI':
+            self._set(AVTransportURI=arguments.get('CurrentURI', ''),
+                      AVTransportURIMetaData=arguments.get('CurrentURIMetaData', ''),
+                      TransportState='STOPPED', RelTime='0:00:00')
+            return ()
+        elif action == 'SetNextAVTransportURI' and self.support_next:
+            self._set(NextAVTransportURI=arguments.get('NextURI', ''),
+                      NextAVTransportURIMetaData=arguments.get('NextURIMetaData', ''))
+            return ()
+        elif action == 'Play':
+            if not state['AVTransportURI']:
+                raise ActionFault(701, 'Transition not available')
+            self._set(TransportState='PLAYING')
+            return ()
+        elif action == 'Pause':
+            self._set(TransportState='PAUSED_PLAYBACK')
+            return ()
+        elif action == 'Stop':
+            self._set(TransportState='STOPPED')
+            return ()
+        elif action == 'GetTransportInfo':
+            return (('CurrentTransportState', state['TransportState']), ('CurrentTransportStatus', 'OK'),
+                    ('CurrentSpeed', '1'))
+        elif action == 'GetPositionInfo':
+            return (('Track', 1), ('TrackDuration', self.track_duration),
+                    ('TrackMetaData', state['AVTransportURIMetaData']), ('TrackURI', state['AVTransportURI']),
+                    ('RelTime', state['RelTime']), ('AbsTime', state['RelTime']),
+                    ('RelCount', 2147483647), ('AbsCount', 2147483647))
+        elif action == 'GetMediaInfo':
+            return (('NrTracks', 1), ('MediaDuration', self.track_duration),
+                    ('CurrentURI', state['AVTransportURI']), ('CurrentURIMetaData', state['AVTransportURIMetaData']),
+                    ('NextURI', state['NextAVTransportURI']),
+                    ('NextURIMetaData', state['NextAVTransportURIMetaData']), ('PlayMedium', 'NETWORK'),
+                    ('RecordMedium', 'NOT_IMPLEMENTED'), ('WriteStatus', 'NOT_IMPLEMENTED'))
+        return super().action(action, arguments)
+
+    def _last_change(self) -> str:
+        values = ''.join(f'<{k} val="{escape(v, {chr(34): "&quot;"})}"/>' for k, v in self.state.items()
+                         if k != 'RelTime')
+        return ('<Event xmlns="urn:schemas-upnp-org:metadata-1-0/AVT/">'
+                f'<InstanceID val="0">{values}</InstanceID></Event>')
+
+    def subscribe(self, headers) -> Tuple[int, Dict[str, str]]:
+        sid = headers.get('SID')
+        with self._lock:
+            if sid:
+                if sid not in self._subscriptions:
+                    return 412, {}
+            else:
+                callback = headers.get('CALLBACK', '').strip('<>')
+                if not callback:
+                    return 412, {}
+                sid = f'uuid:{uuid.uuid4()}'
+                self._subscriptions[sid] = [callback, 0]
+                # initial event
+                self._events.put(sid)
+        return 200, {'SID': sid, 'TIMEOUT': headers.get('TIMEOUT', 'Second-1800')}
+
+    def unsubscribe(self, headers) -> int:
+        with self._lock:
+            return 200 if self._subscriptions.pop(headers.get('SID'), None) else 412
+
+    def _notify(self):
+        with self._lock:
+            sids = list(self._subscriptions)
+        for sid in sids:
+            self._events.put(sid)
+
+    def _send_events(self):
+        while True:
+            self._send_event(self._events.get())
+
+    def _send_event(self, sid: str):
+        with self._lock:
+            subscription = self._subscriptions.get(sid)
+            if subscription is None:
+                return
+            callback, seq = subscription
+            subscription[1] += 1
+            last_change = self._last_change()
+        body = ('<?xml version="1.0"?><e:propertyset xmlns:e="urn:schemas-upnp-org:event-1-0"><e:property>'
+                f'<LastChange>{escape(last_change)}</LastChange></e:property></e:propertyset>')
+        request = urllib.request.Request(callback, data=body.encode('utf-8'), method='NOTIFY',
+                                         headers={'NT': 'upnp:event', 'NTS': 'upnp:propchange', 'SID': sid,
+                                                  'SEQ': str(seq), 'Content-Type': 'text/xml; charset="utf-8"'})
+        try:
+            urllib.request.urlopen(request, timeout=2).close()
+        except OSError as e:
+            _logger.debug(f'fake renderer notify error : {e}')
+
+
+class FakeSsdpResponder:
+    """SSDP responder on loopback answering M-SEARCH for fake devices
+
+    Point server_search.SSDP_ADDR at address to discover the devices.
+    """
+
+    def __init__(self, devices: Sequence[_FakeDevice], delay: float = 0.0, max_age: int = 1800):
+        """
+        :param devices: devices to announce
+        :param delay: seconds to wait before each response
+        :param max_age: max-age of CACHE-CONTROL
+        """
+        self.devices = list(devices)
+        self.delay = delay
+        self.max_age = max_age
+        self.requests = 0
+        self._sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._sock.bind(('127.0.0.1', 0))
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name='fake-ssdp', daemon=True)
+        self._thread.start()
+
+    @property
+    def address(self) -> Tuple[str, int]:
+        return self._sock.getsockname()
+
+    def _targets(self, device: _FakeDevice) -> List[str]:
+        return ['upnp:rootdevice', device.udn, device.device_type, device.service_type,
+                'urn:schemas-upnp-org:service:ConnectionManager:1']
+
+    def _run(self):
+        while self._running:
+            try:
+                data, addr = self._sock.recvfrom(4096)
+            except OSError:
+                break
+            if not data.startswith(b'M-SEARCH'):
+                continue
+            self.requests += 1
+            st = ''
+            for line in data.decode('utf-8', errors='replace').split('\r\n'):
+                k, _, v = line.partition(':')
+                if k.strip().upper() == 'ST':
+                    st = v.strip()
+            responses = []
+            for device in self.devices:
+                for target in self._targets(device):
+                    if st in ('ssdp:all', target):
+                        usn = device.udn if target == device.udn else f'{device.udn}::{target}'
+                        responses.append(('HTTP/1.1 200 OK\r\n'
+                                          f'CACHE-CONTROL: max-age={self.max_age}\r\n'
+                                          'EXT:\r\n'
+                                          f'LOCATION: {device.location}\r\n'
+                                          'SERVER: dlnautil/1.0 UPnP/1.0 fake/1.0\r\n'
+                                          f'ST: {target}\r\n'
+                                          f'USN: {usn}\r\n'
+                                          '\r\n').encode('utf-8'))
+            if responses:
+                threading.Thread(target=self._respond, args=(responses, addr), daemon=True).start()
+
+    def _respond(self, responses: List[bytes], addr):
+        if self.delay:
+            time.sleep(self.delay)
+        for r in responses:
+            try:
+                self._sock.sendto(r, addr)
+            except OSError:
+                return
+
+    def close(self):
+        self._running = False
+        self._sock.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
@@ -0,0 +1,97 @@
+import logging
+import threading
+from typing import Tuple, Union
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+
+_logger = logging.getLogger('dlnautil')
+
+DEFAULT_POOL_SIZE = 8
+DEFAULT_TIMEOUT = (5.0, 30.0)
+
+
+class SessionPool:
+    """Keep-alive HTTP sessions shared per host
+
+    One requests.Session is kept for each scheme://host:port, so requests to
+    the same device reuse pooled connections instead of opening a new one.
+    A pool can be passed to content_browse, content_play and server_search
+    functions to share connections between them.
+    """
+
+    def __init__(self, pool_size: int = DEFAULT_POOL_SIZE,
+                 timeout: Union[float, Tuple[float, float]] = DEFAULT_TIMEOUT, max_retries: int = 0):
+        """
+        :param pool_size: max number of keep-alive connections per host
+        :param timeout: default timeout of requests (connect, read) in seconds
+        :param max_retries: number of retries on connection errors
+        """
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self._sessions = {}
+        self._lock = threading.Lock()
+
+    def session(self, url: str) -> requests.Session:
+        """Get keep-alive session for host of url
+
+        :param url: request URL
+        :return: session bound to the host
+        """
+        urlinfo = urlparse(url)
+        key = f'{urlinfo.scheme}://{urlinfo.netloc}'
+        with self._lock:
+            session = self._sessions.get(key)
+            if session is None:
+                _logger.debug(f'new session : {key}')
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size, max_retries=self.max_retries)
+                session.mount(f'{key}/', adapter)
+                self._sessions[key] = session
+        return session
+
+    def request(self, method: str, url: str, **kwargs) -> requests.Response:
+        kwargs.setdefault('timeout', self.timeout)
+        return self.session(url).request(method, url, **kwargs)
+
+    def get(self, url: str, **kwargs) -> requests.Response:
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url: str, **kwargs) -> requests.Response:
+        return self.request('POST', url, **kwargs)
+
+    def close(self):
+        with self._lock:
+            sessions = list(self._sessions.values())
+            self._sessions.clear()
+        for session in sessions:
+            session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+_default_pool = SessionPool()
+
+
+def get_default_pool() -> SessionPool:
+    """Get pool used when no pool is passed"""
+    return _default_pool
+
+
+def set_default_pool(pool: SessionPool):
+    """Replace pool used when no pool is passed
+
+    :param pool: new default pool
+    """
+    global _default_pool
+    _default_pool = pool
+
+
+def get_pool(pool: SessionPool = None) -> SessionPool:
+    return pool if pool is not None else _default_pool
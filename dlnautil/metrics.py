@@ -0,0 +1,291 @@
+import argparse
+from bisect import bisect_left
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import logging
+import threading
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+_logger = logging.getLogger('dlnautil')
+
+# histogram buckets of seconds
+TIME_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# histogram buckets of bytes (for names ending with _bytes)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216)
+
+# names of metrics recorded by dlnautil modules
+REQUEST_SECONDS = 'dlnautil_request_seconds'
+RESPONSE_BYTES = 'dlnautil_response_bytes'
+REQUEST_ERRORS = 'dlnautil_request_errors_total'
+PAGES = 'dlnautil_pages_total'
+ITEMS_PARSED = 'dlnautil_items_parsed_total'
+PARSE_SECONDS = 'dlnautil_parse_seconds'
+CACHE_REQUESTS = 'dlnautil_cache_requests_total'
+SSDP_RESPONSES = 'dlnautil_ssdp_responses_total'
+DISCOVERY_SECONDS = 'dlnautil_discovery_seconds'
+
+COUNTER = 'counter'
+HISTOGRAM = 'histogram'
+
+_Labels = Tuple[Tuple[str, str], ...]
+
+
+class Histogram:
+    """Counts of observed values in cumulative buckets (Prometheus histogram)"""
+
+    def __init__(self, buckets: Sequence[float]):
+        self.buckets = tuple(buckets)
+        # the last one counts values over the largest bucket
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def cumulative(self) -> List[Tuple[float, int]]:
+        """(upper bound, count of values <= upper bound) of each bucket including +Inf"""
+        ret = []
+        total = 0
+        for bound, count in zip(self.buckets + (float('inf'),), self.counts):
+            total += count
+            ret.append((bound, total))
+        return ret
+
+    def quantile(self, q: float) -> Optional[float]:
+        """Upper bound of the bucket which has the q-quantile (None if nothing is observed)"""
+        if not self.count:
+            return None
+        rank = q * self.count
+        for bound, total in self.cumulative():
+            if total >= rank:
+                return bound
+        return None
+
+    def __repr__(self):
+        return f'Histogram(count={self.count}, sum={self.sum:.6g})'
+
+
+class Metrics:
+    """Counters and histograms recorded by dlnautil modules
+
+    Nothing is recorded until a Metrics is installed with enable() (or
+    set_metrics), and instrumented code only checks get_metrics() for None
+    while disabled. Recorded values can be read with counter / histogram,
+    exported in Prometheus text format with prometheus(), or followed with
+    a callback which receives each record as it happens (e.g. for tracing).
+
+    usage:
+        m = metrics.enable()
+        content_browse.browse(url, st)
+        print(m.prometheus())
+    """
+
+    def __init__(self, buckets: Dict[str, Sequence[float]] = None):
+        """
+        :param buckets: histogram buckets by metric name (TIME_BUCKETS or SIZE_BUCKETS if not given)
+        """
+        self._buckets = dict(buckets) if buckets else {}
+        self._counters = {}
+        self._histograms = {}
+        self._callbacks = []
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(labels: dict) -> _Labels:
+        return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+    def _buckets_for(self, name: str) -> Sequence[float]:
+        buckets = self._buckets.get(name)
+        if buckets is None:
+            buckets = SIZE_BUCKETS if name.endswith('_bytes') else TIME_BUCKETS
+        return buckets
+
+    def add_callback(self, callback: Callable[[str, str, float, dict], None]):
+        """Add function called with (kind, name, value, labels) for each record
+
+        kind is COUNTER or HISTOGRAM. The callback runs in the thread which
+        records the value, so it should return quickly.
+        """
+        self._callbacks.append(callback)
+
+    def remove_callback(self, callback: Callable[[str, str, float, dict], None]):
+        self._callbacks.remove(callback)
+
+    def _notify(self, kind: str, name: str, value: float, labels: dict):
+        for callback in self._callbacks:
+            try:
+                callback(kind, name, value, labels)
+            except Exception as e:
+                _logger.warning(f'metrics callback error : {e}')
+
+    def inc(self, name: str, value: float = 1, **labels):
+        """Add value to counter
+
+        :param name: metric name
+        :param value: value to add
+        :param labels: labels of the counter
+        """
+        key = (name, self._key(labels))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+        if self._callbacks:
+            self._notify(COUNTER, name, value, labels)
+
+    def observe(self, name: str, value: float, **labels):
+        """Record value in histogram
+
+        :param name: metric name
+        :param value: observed value
+        :param labels: labels of the histogram
+        """
+        key = (name, self._key(labels))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram(self._buckets_for(name))
+            histogram.observe(value)
+        if self._callbacks:
+            self._notify(HISTOGRAM, name, value, labels)
+
+    def counter(self, name: str, **labels) -> float:
+        """Value of counter (sum over all labels if no labels are given)"""
+        with self._lock:
+            if labels:
+                return self._counters.get((name, self._key(labels)), 0)
+            return sum(v for (n, _), v in self._counters.items() if n == name)
+
+    def histogram(self, name: str, **labels) -> Optional[Histogram]:
+        """Histogram of name and labels (None if nothing is observed)"""
+        with self._lock:
+            return self._histograms.get((name, self._key(labels)))
+
+    def reset(self):
+        with self._lock:
+            self._counters.clear()
+            self._histograms.clear()
+
+    def snapshot(self) -> dict:
+        """Recorded values as a dict which can be dumped as json
+
+        :return: {'counters': [{name, labels, value}], 'histograms': [{name, labels, count, sum, buckets}]}
+        """
+        with self._lock:
+            counters = [{'name': n, 'labels': dict(k), 'value': v} for (n, k), v in sorted(self._counters.items())]
+            histograms = [{'name': n, 'labels': dict(k), 'count': h.count, 'sum': h.sum,
+                           'buckets': [[str(b), c] for b, c in h.cumulative()]}
+                          for (n, k), h in sorted(self._histograms.items())]
+        return {'counters': counters, 'histograms': histograms}
+
+    def prometheus(self) -> str:
+        """Recorded values in Prometheus text exposition format"""
+        def labels_text(labels: _Labels, extra: Tuple = ()) -> str:
+            pairs = labels + extra
+            if not pairs:
+                return ''
+            escaped = (v.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, v in pairs)
+            return '{' + ','.join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + '}'
+
+        lines = []
+        with self._lock:
+            last = None
+            for (name, labels), value in sorted(self._counters.items()):
+                if name != last:
+                    lines.append(f'# TYPE {name} counter')
+                    last = name
+                lines.append(f'{name}{labels_text(labels)} {value:.15g}')
+            last = None
+            for (name, labels), h in sorted(self._histograms.items()):
+                if name != last:
+                    lines.append(f'# TYPE {name} histogram')
+                    last = name
+                for bound, count in h.cumulative():
+                    le = '+Inf' if bound == float('inf') else f'{bound:.12g}'
+                    lines.append(f'{name}_bucket{labels_text(labels, (("le", le),))} {count}')
+                lines.append(f'{name}_sum{labels_text(labels)} {h.sum:.9g}')
+                lines.append(f'{name}_count{labels_text(labels)} {h.count}')
+        return '\n'.join(lines) + '\n' if lines else ''
+
+
+_metrics = None
+
+
+def get_metrics() -> Optional[Metrics]:
+    """Get installed metrics (None while disabled)"""
+    return _metrics
+
+
+def set_metrics(metrics: Optional[Metrics]):
+    """Install metrics recorded by dlnautil modules
+
+    :param metrics: metrics to record to (disabled if None)
+    """
+    global _metrics
+    _metrics = metrics
+
+
+def enable(metrics: Metrics = None) -> Metrics:
+    """Start recording metrics
+
+    :param metrics: metrics to record to (installed one or a new one if None)
+    :return: installed metrics
+    """
+    if metrics is None:
+        metrics = _metrics if _metrics is not None else Metrics()
+    set_metrics(metrics)
+    return metrics
+
+
+def disable():
+    """Stop recording metrics"""
+    set_metrics(None)
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        _logger.debug(f'metrics server : {format % args}')
+
+    def do_GET(self):
+        metrics = self.server.metrics if self.server.metrics is not None else _metrics
+        body = (metrics.prometheus() if metrics else '').encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def start_http_server(port: int, host: str = '', metrics: Metrics = None) -> ThreadingHTTPServer:
+    """Serve metrics in Prometheus text format for scraping
+
+    :param port: port to listen (any free port if 0)
+    :param host: address to listen (all addresses if empty)
+    :param metrics: metrics to serve (installed one at each request if None)
+    :return: server (call shutdown() to stop)
+    """
+    httpd = ThreadingHTTPServer((host, port), _MetricsHandler)
+    httpd.daemon_threads = True
+    httpd.metrics = metrics
+    threading.Thread(target=httpd.serve_forever, name='metrics-server', daemon=True).start()
+    _logger.debug(f'metrics server on port {httpd.server_address[1]}')
+    return httpd
+
+
+def _main():
+    p = argparse.ArgumentParser(description='browse DLNA server and print metrics in Prometheus text format')
+    p.add_argument('url', help='control URL of DLNA ContentDirectory server')
+    p.add_argument('--item_id', default='0', help='container to browse recursively')
+    p.add_argument('--st', default='urn:schemas-upnp-org:service:ContentDirectory:1', help='service type')
+    args = p.parse_args()
+
+    import content_browse
+    metrics = enable()
+    _, stats = content_browse.crawl(args.url, args.st, args.item_id)
+    _logger.info(stats)
+    print(metrics.prometheus(), end='')
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    _main()
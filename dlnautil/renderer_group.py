@@ -0,0 +1,154 @@
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+import logging
+import time
+from typing import Callable, List, Optional, Sequence, Tuple
+
+import requests
+
+from content_play import ActionResult, Renderer, SoapError
+
+_logger = logging.getLogger('dlnautil')
+
+# seconds from sync_play call to the start (added to the slowest round trip)
+DEFAULT_SYNC_DELAY = 0.3
+
+
+class GroupResult:
+    """Result of an action on one renderer of a group
+
+    latency has seconds from the start of the group call to the response,
+    error has the exception if the action failed.
+    """
+
+    def __init__(self, renderer: Renderer, result: Optional[ActionResult], error: Optional[Exception],
+                 latency: float):
+        self.renderer = renderer
+        self.result = result
+        self.error = error
+        self.latency = latency
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+    def __repr__(self):
+        status = 'OK' if self.ok else f'Error {self.error}'
+        return f'GroupResult({self.renderer.control_url}, {status}, {self.latency * 1000:.1f}ms)'
+
+
+class RendererGroup:
+    """Renderers controlled together
+
+    An action is sent to all renderers at once from a thread pool, so the
+    time of a group call is bounded by the slowest renderer instead of the
+    sum of them. sync_play schedules Play on each renderer at the same
+    time, compensating the round trip time of each one.
+    """
+
+    def __init__(self, renderers: Sequence[Renderer], max_workers: int = None):
+        """
+        :param renderers: renderer clients
+        :param max_workers: max number of concurrent requests (number of renderers if None),
+                            sync_play uses a thread per renderer anyway
+        """
+        self.renderers = list(renderers)
+        self._max_workers = max_workers if max_workers else max(len(self.renderers), 1)
+        self._executor = ThreadPoolExecutor(max_workers=self._max_workers)
+
+    def close(self):
+        self._executor.shutdown()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def _run(self, func: Callable[[Renderer], ActionResult],
+             executor: ThreadPoolExecutor = None) -> List[GroupResult]:
+        start = time.perf_counter()
+
+        def run(renderer: Renderer) -> GroupResult:
+            try:
+                result, error = func(renderer), None
+            except (SoapError, requests.RequestException) as e:
+                _logger.warning(f'group action error : {renderer.control_url} : {e}')
+                result, error = None, e
+            return GroupResult(renderer, result, error, time.perf_counter() - start)
+
+        return list((executor if executor else self._executor).map(run, self.renderers))
+
+    def call(self, action: str, arguments: Sequence[Tuple[str, object]] = ()) -> List[GroupResult]:
+        """Call action on all renderers at once
+
+        :param action: action name (e.g. Play)
+        :param arguments: input arguments of the action (InstanceID is not included)
+        :return: results in the order of renderers
+        """
+        return self._run(lambda r: r.call(action, arguments))
+
+    def set_content_uri(self, item_url: str, metadata: str = '') -> List[GroupResult]:
+        return self._run(lambda r: r.set_content_uri(item_url, metadata))
+
+    def play(self, speed: str = '1') -> List[GroupResult]:
+        return self._run(lambda r: r.play(speed))
+
+    def pause(self) -> List[GroupResult]:
+        return self._run(lambda r: r.pause())
+
+    def stop(self) -> List[GroupResult]:
+        return self._run(lambda r: r.stop())
+
+    def sync_play(self, start_at: float = None, delay: float = DEFAULT_SYNC_DELAY) -> List[GroupResult]:
+        """Start playing on all renderers at the same time
+
+        Round trip time of each renderer is measured with GetTransportInfo
+        (which also warms up connections), and Play is sent to each one
+        half of its round trip before start_at.
+
+        :param start_at: time.time() to start (slowest round trip + delay from now if None)
+        :param delay: seconds added to the slowest round trip when start_at is None
+        :return: results in the order of renderers (latency is from the call to the response)
+        """
+        rtts = {}
+        for r in self._run(lambda r: r.call('GetTransportInfo')):
+            rtts[id(r.renderer)] = r.result.elapsed if r.ok else 0.0
+        if start_at is None:
+            start_at = time.time() + max(rtts.values(), default=0.0) + delay
+        _logger.debug(f'sync play at {start_at} : rtt {rtts}')
+
+        def play(renderer: Renderer) -> ActionResult:
+            wait = start_at - rtts[id(renderer)] / 2 - time.time()
+            if wait > 0:
+                time.sleep(wait)
+            return renderer.play()
+
+        if self._max_workers >= len(self.renderers):
+            return self._run(play)
+        # each Play holds its worker until its time, renderers waiting for a free worker would start late
+        with ThreadPoolExecutor(max_workers=len(self.renderers)) as executor:
+            return self._run(play, executor)
+
+
+def _main():
+    p = argparse.ArgumentParser()
+    p.add_argument('action', help='action to be called ("set" or "play" or "sync_play" or "pause" or "stop")')
+    p.add_argument('url', nargs='+', help='renderer urls for description')
+    p.add_argument('--item_url', help='item url (needed for action "set")')
+    args = p.parse_args()
+    with RendererGroup([Renderer.from_description(u) for u in args.url]) as group:
+        if args.action == 'set':
+            results = group.set_content_uri(args.item_url)
+        elif args.action in ('play', 'sync_play', 'pause', 'stop'):
+            results = getattr(group, args.action)()
+        else:
+            _logger.error(f'Error : {args.action} not found')
+            return
+    for r in results:
+        _logger.info(r)
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    _main()
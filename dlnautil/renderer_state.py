@@ -0,0 +1,207 @@
+import argparse
+from concurrent.futures import Future
+import logging
+import threading
+import time
+from typing import Callable, Generic, TypeVar
+
+from content_event import TransportEvent
+from content_play import MediaInfo, PositionInfo, Renderer, TransportInfo
+
+_logger = logging.getLogger('dlnautil')
+
+# seconds between polls while playing
+DEFAULT_INTERVAL = 1.0
+# seconds between polls near the end of a track
+DEFAULT_MIN_INTERVAL = 0.25
+# seconds between polls while paused or stopped
+DEFAULT_MAX_INTERVAL = 5.0
+# remaining seconds of a track regarded as near the end
+DEFAULT_NEAR_END = 5.0
+
+T = TypeVar('T')
+
+
+class _CachedQuery(Generic[T]):
+    """Result of a query shared by readers
+
+    A reader gets the cached value while it is newer than max_age.
+    Otherwise one reader sends the query and the others wait for its result.
+    """
+
+    def __init__(self, fetch: Callable[[], T]):
+        self.fetch = fetch
+        self.value = None
+        self.updated = 0.0
+        self.requests = 0
+        self._inflight = None
+        self._lock = threading.Lock()
+
+    def get(self, max_age: float) -> T:
+        with self._lock:
+            if self.value is not None and time.monotonic() - self.updated < max_age:
+                return self.value
+            future = self._inflight
+            owner = future is None
+            if owner:
+                future = self._inflight = Future()
+        if not owner:
+            return future.result()
+
+        try:
+            value = self.fetch()
+            with self._lock:
+                self.value = value
+                self.updated = time.monotonic()
+                self.requests += 1
+            future.set_result(value)
+            return value
+        except Exception as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                self._inflight = None
+
+    def set(self, value: T):
+        with self._lock:
+            self.value = value
+            self.updated = time.monotonic()
+
+
+class RendererState:
+    """Cached transport state of a renderer shared by many readers
+
+    Readers within the poll interval get the cached result and concurrent
+    readers share one request, so one upstream request is sent per interval
+    however many viewers there are. The interval adapts to the state:
+    min_interval near the end of a track, max_interval while paused or
+    stopped. start() polls in background so that readers never wait.
+    """
+
+    def __init__(self, renderer: Renderer, interval: float = DEFAULT_INTERVAL,
+                 min_interval: float = DEFAULT_MIN_INTERVAL, max_interval: float = DEFAULT_MAX_INTERVAL,
+                 near_end: float = DEFAULT_NEAR_END):
+        """
+        :param renderer: renderer client
+        :param interval: seconds between polls while playing
+        :param min_interval: seconds between polls near the end of a track
+        :param max_interval: seconds between polls while paused or stopped
+        :param near_end: remaining seconds of a track regarded as near the end
+        """
+        self.renderer = renderer
+        self.min_interval = min_interval
+        self.default_interval = interval
+        self.max_interval = max_interval
+        self.near_end = near_end
+        self._position = _CachedQuery(renderer.get_position_info)
+        self._transport = _CachedQuery(renderer.get_transport_info)
+        self._media = _CachedQuery(renderer.get_media_info)
+        self._callbacks = []
+        self._stop = threading.Event()
+        self._wakeup = threading.Event()
+        self._thread = None
+
+    def interval(self) -> float:
+        """Current poll interval"""
+        transport = self._transport.value
+        if transport is not None and not transport.playing:
+            return self.max_interval
+        position = self._position.value
+        if position is not None and position.remaining is not None and position.remaining <= self.near_end:
+            return self.min_interval
+        return self.default_interval
+
+    def position_info(self, max_age: float = None) -> PositionInfo:
+        """
+        :param max_age: max seconds of cached result (current interval if None)
+        """
+        return self._position.get(self.interval() if max_age is None else max_age)
+
+    def transport_info(self, max_age: float = None) -> TransportInfo:
+        """
+        :param max_age: max seconds of cached result (current interval if None)
+        """
+        return self._transport.get(self.interval() if max_age is None else max_age)
+
+    def media_info(self, max_age: float = None) -> MediaInfo:
+        """
+        :param max_age: max seconds of cached result (max_interval if None)
+        """
+        return self._media.get(self.max_interval if max_age is None else max_age)
+
+    @property
+    def requests(self) -> int:
+        """Number of requests sent to the renderer"""
+        return self._position.requests + self._transport.requests + self._media.requests
+
+    def on_event(self, event: TransportEvent):
+        """Update cached transport state by an event (pass as callback of Renderer.subscribe)"""
+        state = event.changes.get('TransportState')
+        if state:
+            transport = self._transport.value
+            self._transport.set(TransportInfo({
+                'CurrentTransportState': state,
+                'CurrentTransportStatus': event.state.get('TransportStatus', transport.status if transport else None),
+                'CurrentSpeed': event.state.get('TransportPlaySpeed', transport.speed if transport else None),
+            }))
+        if 'AVTransportURI' in event.changes or 'NextAVTransportURI' in event.changes:
+            # fetched again by the next reader
+            self._media.updated = 0.0
+        # wake poller to follow the new state
+        self._wakeup.set()
+
+    def start(self, callback: Callable[['RendererState'], None] = None):
+        """Poll transport state and position in background
+
+        :param callback: function called after each poll
+        """
+        if callback:
+            self._callbacks.append(callback)
+        if self._thread:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='renderer-state', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._wakeup.set()
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self._transport.get(0)
+                self._position.get(0)
+                for callback in self._callbacks:
+                    callback(self)
+            except Exception as e:
+                _logger.warning(f'poll error : {self.renderer.control_url} : {e}')
+            self._wakeup.wait(self.interval())
+            self._wakeup.clear()
+
+
+def _main():
+    p = argparse.ArgumentParser()
+    p.add_argument('url', help='renderer url for description')
+    args = p.parse_args()
+    state = RendererState(Renderer.from_description(args.url))
+
+    def on_poll(s: RendererState):
+        _logger.info(f'{s.transport_info()} {s.position_info()} (next poll in {s.interval()}s)')
+
+    state.start(on_poll)
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        pass
+    state.stop()
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    _main()
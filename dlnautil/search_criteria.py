@@ -0,0 +1,155 @@
+import re
+from typing import Callable, List, Set
+
+# UPnP ContentDirectory SearchCriteria tokens: parentheses, quoted strings and words
+_TOKEN = re.compile(r'\(|\)|"(?:[^"\\]|\\.)*"|[^\s()]+')
+
+_OPERATORS = ('=', '!=', '<', '<=', '>', '>=', 'contains', 'doesNotContain', 'derivedfrom', 'exists')
+
+
+class CriteriaError(ValueError):
+    pass
+
+
+def field_name(prop: str) -> str:
+    """Get Item field name of SearchCriteria property
+
+    e.g. upnp:class -> class, res@size -> size, @id -> id
+
+    :param prop: property name in SearchCriteria
+    :return: field name of content_browse.Item
+    """
+    return re.split('[:@]', prop)[-1]
+
+
+def _unquote(s: str) -> str:
+    if len(s) >= 2 and s[0] == '"' and s[-1] == '"':
+        return re.sub(r'\\(.)', r'\1', s[1:-1])
+    return s
+
+
+def _compare(op: str, value, expected: str) -> bool:
+    if op == 'exists':
+        return (value is not None) == (expected.lower() == 'true')
+    if value is None:
+        return op in ('!=', 'doesNotContain')
+
+    if isinstance(value, int):
+        try:
+            v, e = value, int(expected)
+        except ValueError:
+            v, e = str(value), expected
+    else:
+        v, e = value.lower(), expected.lower()
+
+    if op == '=':
+        return v == e
+    elif op == '!=':
+        return v != e
+    elif op == '<':
+        return v < e
+    elif op == '<=':
+        return v <= e
+    elif op == '>':
+        return v > e
+    elif op == '>=':
+        return v >= e
+    elif op == 'contains':
+        return str(e) in str(v)
+    elif op == 'doesNotContain':
+        return str(e) not in str(v)
+    elif op == 'derivedfrom':
+        return str(v).startswith(str(e))
+    raise CriteriaError(f'unknown operator : {op}')
+
+
+class _Parser:
+
+    def __init__(self, criteria: str):
+        self.tokens = _TOKEN.findall(criteria)
+        self.pos = 0
+        self.properties = set()
+
+    def _peek(self) -> str:
+        return self.tokens[self.pos] if self.pos < len(self.tokens) else None
+
+    def _next(self) -> str:
+        token = self._peek()
+        if token is None:
+            raise CriteriaError('unexpected end of criteria')
+        self.pos += 1
+        return token
+
+    def parse(self) -> Callable[[dict], bool]:
+        if not self.tokens:
+            return lambda data: True
+        ret = self._or()
+        if self._peek() is not None:
+            raise CriteriaError(f'unexpected token : {self._peek()}')
+        return ret
+
+    def _or(self) -> Callable[[dict], bool]:
+        terms = [self._and()]
+        while self._peek() == 'or':
+            self._next()
+            terms.append(self._and())
+        return terms[0] if len(terms) == 1 else lambda data: any(t(data) for t in terms)
+
+    def _and(self) -> Callable[[dict], bool]:
+        factors = [self._factor()]
+        while self._peek() == 'and':
+            self._next()
+            factors.append(self._factor())
+        return factors[0] if len(factors) == 1 else lambda data: all(f(data) for f in factors)
+
+    def _factor(self) -> Callable[[dict], bool]:
+        token = self._next()
+        if token == '(':
+            ret = self._or()
+            if self._next() != ')':
+                raise CriteriaError('missing )')
+            return ret
+        if token == '*':
+            return lambda data: True
+
+        op = self._next()
+        if op not in _OPERATORS:
+            raise CriteriaError(f'unknown operator : {op}')
+        expected = _unquote(self._next())
+        self.properties.add(token)
+        field = field_name(token)
+        return lambda data: _compare(op, data.get(field), expected)
+
+
+def compile_criteria(criteria: str) -> Callable[[dict], bool]:
+    """Compile SearchCriteria into a predicate for client side filtering
+
+    :param criteria: UPnP ContentDirectory SearchCriteria string
+    :return: function which takes Item (or its get_data()) and returns whether it matches
+    """
+    return _Parser(criteria).parse()
+
+
+def criteria_properties(criteria: str) -> Set[str]:
+    """Get properties used in SearchCriteria
+
+    :param criteria: UPnP ContentDirectory SearchCriteria string
+    :return: set of property names (e.g. upnp:class)
+    """
+    parser = _Parser(criteria)
+    parser.parse()
+    return parser.properties
+
+
+def is_supported(criteria: str, capabilities: List[str]) -> bool:
+    """Whether server can search with criteria
+
+    :param criteria: UPnP ContentDirectory SearchCriteria string
+    :param capabilities: SearchCaps of server
+    :return: True if all properties in criteria are searchable
+    """
+    if not capabilities:
+        return False
+    if '*' in capabilities:
+        return True
+    return criteria_properties(criteria) <= set(capabilities)
@@ -1,82 +1,208 @@
+import argparse
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
 from io import StringIO
 import logging
+import re
+import requests
 import socket
+import struct
+import threading
 import time
-from typing import List, Optional
+from typing import TYPE_CHECKING, AsyncIterator, Callable, List, Optional, Sequence, Tuple, Union
 
-import requests
-from urllib.parse import urlparse
 from xml.etree import ElementTree
 
+import async_http
+import device_description
+from http_session import SessionPool, get_pool
+import metrics
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+if TYPE_CHECKING:
+    from device_registry import DeviceRegistry
+
 logging.basicConfig(level=logging.INFO)
 _logger = logging.getLogger('dlnautil')
 
-_MSEARCH_QUERY = """\
-M-SEARCH * HTTP/1.1\r\n
-HOST: 239.255.255.250:1900\r\n
-MAN: "ssdp:discover"\r\n
-MX: 1\r\n
-ST: ssdp:all\r\n
-"""
+SSDP_ADDR = ('239.255.255.250', 1900)
+ST_CONTENT_DIRECTORY = 'urn:schemas-upnp-org:service:ContentDirectory:1'
+ST_AV_TRANSPORT = 'urn:schemas-upnp-org:service:AVTransport:1'
+ST_MEDIA_SERVER = 'urn:schemas-upnp-org:device:MediaServer:1'
+ST_MEDIA_RENDERER = 'urn:schemas-upnp-org:device:MediaRenderer:1'
+# every device and service answers with its own ST
+ST_ALL = 'ssdp:all'
+DEFAULT_SEARCH_TYPES = (ST_CONTENT_DIRECTORY,)
+# servers and renderers at once
+MEDIA_SEARCH_TYPES = (ST_CONTENT_DIRECTORY, ST_AV_TRANSPORT)
+DEFAULT_MX = 1
+# seconds to wait responses
+DEFAULT_TIMEOUT = 1.5
+# max number of device descriptions fetched at once
+DEFAULT_MAX_FETCHES = 8
+# timeout of each device description request
+DEFAULT_DETAIL_TIMEOUT = 3.0
+# seconds to wait device descriptions still being fetched after the response window
+DEFAULT_DETAIL_WAIT = 0.5
+# seconds without new responses after which the command line search stops waiting
+DEFAULT_IDLE_TIMEOUT = 0.3
+
+DETAIL_PENDING = 'pending'
+DETAIL_OK = 'ok'
+DETAIL_FAILED = 'failed'
+
+# max-age used if CACHE-CONTROL is missing (UPnP recommends at least 1800 seconds)
+DEFAULT_MAX_AGE = 1800
+
+# search on every IPv4 interface (except loopback)
+ALL_INTERFACES = 'all'
+DEFAULT_MULTICAST_TTL = 2
+
+# ST header in raw response, checked before decoding the whole packet
+_ST_HEADER = re.compile(rb'^ST:[ \t]*(\S*)', re.IGNORECASE | re.MULTILINE)
+
+# service whose URLs are taken from description of a device type
+_DEVICE_SERVICES = {
+    'MediaServer': 'ContentDirectory',
+    'MediaRenderer': 'AVTransport',
+}
+
+
+def _msearch_query(st: str = ST_CONTENT_DIRECTORY, mx: int = DEFAULT_MX) -> bytes:
+    return ('M-SEARCH * HTTP/1.1\r\n'
+            f'HOST: {SSDP_ADDR[0]}:{SSDP_ADDR[1]}\r\n'
+            'MAN: "ssdp:discover"\r\n'
+            f'MX: {mx}\r\n'
+            f'ST: {st}\r\n'
+            '\r\n').encode('utf-8')
+
+
+def _max_age(info: dict) -> int:
+    for directive in info.get('CACHE-CONTROL', '').split(','):
+        k, _, v = directive.partition('=')
+        if k.strip().lower() == 'max-age':
+            try:
+                return int(v.strip())
+            except ValueError:
+                break
+    return DEFAULT_MAX_AGE
 
 
 class Server:
     def __init__(self, info: dict):
         self.info = info
         self.detail = None
+        self.detail_status = DETAIL_PENDING
+        self.expires = time.time() + _max_age(info)
+        # name of network interface the device answered on (None if default route)
+        self.interface = None
+        # parsed device description (see device_description.DeviceDescription)
+        self.description = None
+        # validators of the fetched device description for conditional GET
+        self.detail_location = None
+        self.etag = None
+        self.last_modified = None
+
+    def update_info(self, info: dict):
+        """Update SSDP headers (e.g. by a new M-SEARCH response) and extend expiration
+
+        :param info: SSDP headers
+        """
+        self.info = info
+        self.expires = time.time() + _max_age(info)
 
-    def _parse_xml(self, node: ElementTree) -> dict:
-        ret = {}
-        is_retrieve = False
-        for c in node:
-            # print(f'{c.tag} : {c.attrib} : {c.text}')
-            child_ret = self._parse_xml(c)
-            ret[c.tag] = c.text
-            if child_ret:
-                ret = child_ret
-                is_retrieve = True
-                break
-
-            if c.text and 'ContentDirectory' in c.text:
-                is_retrieve = True
+    def is_expired(self, now: float = None) -> bool:
+        return (now if now else time.time()) >= self.expires
 
-        if is_retrieve:
-            return ret
-        else:
-            return None
+    def _service_name(self) -> str:
+        # e.g. urn:schemas-upnp-org:service:AVTransport:1 -> AVTransport
+        parts = self.info.get('ST', '').split(':')
+        if len(parts) >= 2 and 'service' in parts:
+            return parts[-2]
+        if len(parts) >= 2 and 'device' in parts:
+            return _DEVICE_SERVICES.get(parts[-2], 'ContentDirectory')
+        return 'ContentDirectory'
 
-    def _build_control_url(self, location: str, xml_item: dict) -> dict:
-        parse_key = ['controlURL', 'serviceType', 'serviceId', 'SCPDURL', 'eventSubURL']
-        ret = {}
-        for k in xml_item.keys():
-            for pk in parse_key:
-                if pk in k:
-                    ret[pk] = xml_item[k]
-                    break
-
-        path = ret['controlURL']
-        if path:
-            urlinfo = urlparse(location)
-            ret['url'] = f'{urlinfo.scheme}://{urlinfo.netloc}{path}'
-            del ret['controlURL']
-        return ret
-
-    def fetch_detail(self):
+    def _prepare_detail(self) -> Optional[str]:
         location = self.info.get('LOCATION')
-        stype = self.info.get('ST')
-        if not location or not stype:
+        if not location or not self.info.get('ST'):
             _logger.error('lack of info')
+            self.detail_status = DETAIL_FAILED
+            return None
+
+        if not self.detail or self.detail_location != location:
+            self.detail = None
+            self.etag = None
+            self.last_modified = None
+        return location
+
+    def _validators(self) -> Tuple[Optional[str], Optional[str]]:
+        # a 304 is useless without a parsed description to keep using
+        # (e.g. a device restored from a registry file has only its validators)
+        if self.description is None:
+            return None, None
+        return self.etag, self.last_modified
+
+    def _set_description(self, location: str, description: device_description.DeviceDescription):
+        self.description = description
+        service = description.find_service(self._service_name())
+        self.detail = service.get_data() if service else None
+        self.detail_location = location
+        self.etag = description.etag
+        self.last_modified = description.last_modified
+
+    def fetch_detail(self, pool: SessionPool = None, timeout: float = None):
+        """Fetch device description and set detail
+
+        detail_status becomes 'ok' or 'failed' when finished. The parsed
+        description (all devices and services) is kept in description.
+
+        :param pool: HTTP session pool (default pool if None)
+        :param timeout: request timeout in seconds (default timeout of pool if None)
+        """
+        location = self._prepare_detail()
+        if not location:
+            return
+        try:
+            # revalidate the description already fetched
+            description = device_description.fetch_description(location, pool, timeout, *self._validators())
+            self._set_description(location, description)
+        except (requests.RequestException, ElementTree.ParseError) as e:
+            _logger.warning(f'fetch detail error : {location} : {e}')
+        self.detail_status = DETAIL_OK if self.detail else DETAIL_FAILED
+
+    async def async_fetch_detail(self, pool: async_http.AsyncSessionPool = None, timeout: float = None):
+        """Fetch device description and set detail without blocking the event loop (see fetch_detail)
+
+        :param pool: async HTTP session pool (default pool of the event loop if None)
+        :param timeout: request timeout in seconds (default timeout of pool if None)
+        """
+        location = self._prepare_detail()
+        if not location:
             return
+        try:
+            description = await device_description.async_fetch_description(location, pool, timeout,
+                                                                           *self._validators())
+            self._set_description(location, description)
+        except (requests.RequestException, ElementTree.ParseError) as e:
+            _logger.warning(f'fetch detail error : {location} : {e}')
+        self.detail_status = DETAIL_OK if self.detail else DETAIL_FAILED
+
+    def find_service(self, service: str) -> Optional[device_description.Service]:
+        """Find service of the device (fetch_detail should be called before)
 
-        res = requests.get(location)
-        _logger.debug(res)
-        if res and res.status_code == 200:
-            result = res.text
-            # print(result)
-            et = ElementTree.fromstring(result)
-            ret = self._parse_xml(et)
-            if ret:
-                self.detail = self._build_control_url(location, ret)
+        :param service: serviceType, short name (e.g. RenderingControl) or serviceId
+        :return: service or None
+        """
+        return self.description.find_service(service) if self.description else None
 
     def uniqueid(self):
         return self.info.get('USN')
@@ -85,7 +211,7 @@ class Server:
         return self.info.copy()
 
     def get_detail(self):
-        return self.detail.copy()
+        return self.detail.copy() if self.detail else {}
 
     def dump_info(self, is_debug=True):
         logger_func = _logger.debug if is_debug else _logger.info
@@ -94,7 +220,7 @@ class Server:
 
     def dump_detail(self, is_debug=True):
         logger_func = _logger.debug if is_debug else _logger.info
-        for k, v in self.detail.items():
+        for k, v in (self.detail or {}).items():
             logger_func(f'{k} : {v}')
 
     def __eq__(self, other):
@@ -107,7 +233,7 @@ class Server:
         for k, v in self.info.items():
             ret += f'{k} : {v}\n'
         ret += '--- detail ---\n'
-        for k, v in self.detail.items():
+        for k, v in (self.detail or {}).items():
             ret += f'{k} : {v}\n'
         return ret
 
@@ -115,77 +241,430 @@ class Server:
         return hash(self.uniqueid())
 
 
-def _parse_server(s: str) -> dict:
-    results = {}
-    f = StringIO(s)
-    for l in f.readlines():
-        x = l.split(':')
-        if len(x) > 2:
-            k = x[0].strip()
-            v = l.replace(f'{x[0]}:', '').strip()
-            results[k] = v
-    return results
-
+def _split_version(st: str) -> Tuple[str, Optional[int]]:
+    # urn:...:device:MediaServer:2 -> (urn:...:device:MediaServer, 2)
+    prefix, _, version = st.rpartition(':')
+    return (prefix, int(version)) if st.startswith('urn:') and version.isdigit() else (st, None)
 
-def _get_servers() -> List:
-    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-    sock.setblocking(False)
-    sock.settimeout(10)
 
-    sock.sendto(bytearray(_MSEARCH_QUERY, 'utf-8'), ('239.255.255.250', 1900))
-    recvs = []
+def _type_matcher(search_types: Sequence[str]) -> Callable[[Optional[str]], bool]:
+    """Get function which tells whether ST of a response answers search_types
 
-    now = time.time()
-    while True:
-        try:
-            res, from_ = sock.recvfrom(4096)
-            if res:
-                _logger.debug(f'*** from={from_}')
-                _logger.debug(res)
-                _logger.debug(res.decode())
-                recvs.append(res.decode())
-        except socket.timeout:
-            _logger.debug('Fin')
-            break
+    Devices answer ssdp:all with their own STs, and a newer version of a
+    type may answer with its own version (e.g. MediaServer:2 to MediaServer:1).
+    """
+    if ST_ALL in search_types:
+        return lambda st: st is not None
+    exact = set(search_types)
+    min_versions = {}
+    for prefix, version in map(_split_version, search_types):
+        if version is not None:
+            min_versions[prefix] = min(version, min_versions.get(prefix, version))
 
-        duration = time.time()-now
-        if duration > 10:
-            _logger.debug('timeout')
-            break
-        if not res:
-            time.sleep(1)
+    def matches(st: Optional[str]) -> bool:
+        if st is None:
+            return False
+        if st in exact:
+            return True
+        prefix, version = _split_version(st)
+        return version is not None and prefix in min_versions and version >= min_versions[prefix]
+    return matches
 
-    results_set = set()
-    for s in recvs:
-        item = _parse_server(s)
 
-        if item['USN'] in results_set:
-            continue
+def _match_type(data: bytes, matches: Callable[[Optional[str]], bool]) -> bool:
+    m = _ST_HEADER.search(data)
+    return matches(m.group(1).decode('latin-1') if m else None)
 
-        if 'ContentDirectory' not in item.get('ST', ''):
-            continue
 
-        _logger.debug('***** found ContentDirectory')
+def _parse_server(s: str) -> dict:
+    results = {}
+    f = StringIO(s)
+    for l in f.readlines():
+        k, sep, v = l.partition(':')
+        if sep and k.strip():
+            results[k.strip().upper()] = v.strip()
+    return results
 
-        server = Server(item)
-        server.fetch_detail()
-        server.dump_info()
-        results_set.add(server)
 
-    sock.close()
-    return list(results_set)
+def get_interfaces(include_loopback: bool = False) -> List[Tuple[str, str]]:
+    """Get IPv4 network interfaces
 
+    psutil is used if available, ioctl on Linux otherwise.
 
-def search() -> List[Server]:
-    """Search DLNA ContentDirectory server information
+    :param include_loopback: include loopback interfaces
+    :return: list of (interface name, IPv4 address)
+    """
+    ret = []
+    if psutil is not None:
+        for name, addrs in psutil.net_if_addrs().items():
+            ret += [(name, a.address) for a in addrs if a.family == socket.AF_INET]
+    elif fcntl is not None and hasattr(socket, 'if_nameindex'):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        try:
+            for _, name in socket.if_nameindex():
+                try:
+                    # SIOCGIFADDR
+                    res = fcntl.ioctl(sock.fileno(), 0x8915, struct.pack('256s', name[:15].encode('utf-8')))
+                    ret.append((name, socket.inet_ntoa(res[20:24])))
+                except OSError:
+                    pass
+        finally:
+            sock.close()
+    else:
+        _logger.warning('can not list interfaces, install psutil')
+    return [(n, a) for n, a in ret if include_loopback or not a.startswith('127.')]
+
+
+def _resolve_interfaces(interfaces: Union[str, Sequence[str]]) -> List[Tuple[str, str]]:
+    if interfaces == ALL_INTERFACES:
+        return get_interfaces()
+    known = get_interfaces(include_loopback=True)
+    ret = []
+    for i in interfaces:
+        matched = [(n, a) for n, a in known if i in (n, a)]
+        if matched:
+            ret += matched
+        else:
+            # address not listed (e.g. neither psutil nor ioctl available)
+            ret.append((i, i))
+    # an interface given by both name and address is searched once
+    return list(dict.fromkeys(ret))
+
+
+def _open_socket(address: str, ttl: int) -> socket.socket:
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP)
+    sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, ttl)
+    sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_IF, socket.inet_aton(address))
+    # responses are sent back to the address of the interface
+    sock.bind((address, 0))
+    sock.setblocking(False)
+    return sock
+
+
+class _SsdpProtocol(asyncio.DatagramProtocol):
+
+    def __init__(self, queue: asyncio.Queue, interface: str = None):
+        self.queue = queue
+        self.interface = interface
+
+    def datagram_received(self, data: bytes, addr):
+        self.queue.put_nowait((data, addr, self.interface))
+
+    def error_received(self, exc: Exception):
+        _logger.warning(f'SSDP error : {exc}')
+
+
+async def discover(mx: int = DEFAULT_MX, timeout: float = DEFAULT_TIMEOUT, max_results: int = None,
+                   pool: Union[SessionPool, async_http.AsyncSessionPool] = None, fetch_detail: bool = True,
+                   max_fetches: int = DEFAULT_MAX_FETCHES,
+                   detail_timeout: float = DEFAULT_DETAIL_TIMEOUT, detail_wait: float = DEFAULT_DETAIL_WAIT,
+                   registry: 'DeviceRegistry' = None,
+                   search_types: Sequence[str] = DEFAULT_SEARCH_TYPES,
+                   interfaces: Union[str, Sequence[str]] = None,
+                   ttl: int = DEFAULT_MULTICAST_TTL, idle_timeout: float = None) -> AsyncIterator[Server]:
+    """Discover DLNA devices and yield each one as soon as it answers
+
+    One M-SEARCH is sent for each of search_types, and responses of other
+    types are dropped without decoding them. Newer versions of a type are
+    accepted (e.g. MediaServer:2 for MediaServer:1), and ssdp:all accepts
+    every response (a device answers with an entry for each of its types).
+    With interfaces, M-SEARCH is sent on each interface at once from its
+    own socket, results are merged by USN and Server.interface tells
+    which interface a device answered on.
+
+    Device descriptions are fetched concurrently (at most max_fetches at once)
+    and each server is yielded when its description is fetched. Servers whose
+    description is not fetched within detail_wait after the response window
+    are yielded with detail_status 'pending' (the fetch goes on in background),
+    and servers whose fetch failed with detail_status 'failed'.
+
+    usage: async for server in discover(): ...
+
+    :param mx: MX of M-SEARCH (max seconds devices wait before answering)
+    :param timeout: seconds to wait responses in total
+    :param max_results: stop after this number of servers are found (no limit if None)
+    :param pool: HTTP session pool used to fetch device descriptions (default pool if None),
+                 descriptions are fetched on the event loop instead of threads with async_http.AsyncSessionPool
+    :param fetch_detail: whether fetch device description before yielding server
+    :param max_fetches: max number of device descriptions fetched at once
+    :param detail_timeout: timeout of each device description request
+    :param detail_wait: seconds to wait descriptions still being fetched after the response window
+    :param registry: device registry to update (known devices are revalidated with conditional GET)
+    :param search_types: ST of devices to search (e.g. MEDIA_SEARCH_TYPES for servers and renderers)
+    :param interfaces: 'all' or names / IPv4 addresses of interfaces (default route only if None)
+    :param ttl: multicast TTL of M-SEARCH sent on interfaces
+    :param idle_timeout: end the response window when no new device has answered for this many seconds
+                         after the first one (wait whole timeout if None)
+    :return: async iterator of devices (ST header tells the type)
+    """
+    loop = asyncio.get_running_loop()
+    queue = asyncio.Queue()
+    transports = []
+    if interfaces:
+        for name, address in _resolve_interfaces(interfaces):
+            try:
+                sock = _open_socket(address, ttl)
+            except OSError as e:
+                _logger.warning(f'can not open socket on {name} ({address}) : {e}')
+                continue
+            transport, _ = await loop.create_datagram_endpoint(lambda n=name: _SsdpProtocol(queue, n), sock=sock)
+            transports.append(transport)
+            _logger.debug(f'search on {name} ({address})')
+    else:
+        transport, _ = await loop.create_datagram_endpoint(lambda: _SsdpProtocol(queue), family=socket.AF_INET)
+        transports.append(transport)
+    use_async = isinstance(pool, async_http.AsyncSessionPool)
+    executor = None if use_async else ThreadPoolExecutor(max_workers=max_fetches)
+    fetch_limit = asyncio.Semaphore(max_fetches)
+
+    async def async_fetch(server: Server):
+        async with fetch_limit:
+            await server.async_fetch_detail(pool, detail_timeout)
+
+    receiving = asyncio.ensure_future(queue.get())
+    fetching = {}
+    accept_types = _type_matcher(search_types)
+    m = metrics.get_metrics()
+    try:
+        for transport in transports:
+            for st in search_types:
+                transport.sendto(_msearch_query(st, mx), SSDP_ADDR)
+        deadline = loop.time() + timeout
+        found = set()
+        count = 0
+        # loop time of the last new device
+        last_found = None
+        while receiving or fetching:
+            now = loop.time()
+            remaining = deadline - now
+            if receiving and idle_timeout and last_found is not None:
+                remaining = min(remaining, last_found + idle_timeout - now)
+            if receiving and remaining <= 0:
+                _logger.debug('timeout')
+                receiving.cancel()
+                receiving = None
+                deadline = loop.time() + detail_wait
+                continue
+            waits = set(fetching) | ({receiving} if receiving else set())
+            done, _ = await asyncio.wait(waits, timeout=max(remaining, 0), return_when=asyncio.FIRST_COMPLETED)
+            if not done and not receiving:
+                break
 
-    :return: list of ContentDirectory server information
+            for task in done:
+                if task is not receiving:
+                    server = fetching.pop(task)
+                    _logger.debug(f'detail {server.detail_status} : {server.uniqueid()}')
+                    yield server
+                    count += 1
+                    if max_results and count >= max_results:
+                        return
+                    continue
+
+                res, from_, interface = task.result()
+                receiving = asyncio.ensure_future(queue.get())
+                if not _match_type(res, accept_types):
+                    if m is not None:
+                        m.inc(metrics.SSDP_RESPONSES, result='dropped')
+                    continue
+                _logger.debug(f'*** from={from_} on {interface}')
+                _logger.debug(res)
+                item = _parse_server(res.decode('utf-8', errors='replace'))
+                usn = item.get('USN')
+                if not usn or usn in found:
+                    if m is not None:
+                        m.inc(metrics.SSDP_RESPONSES, result='duplicate')
+                    continue
+                if m is not None:
+                    m.inc(metrics.SSDP_RESPONSES, result='accepted')
+
+                _logger.debug(f'***** found {item.get("ST")}')
+                found.add(usn)
+                last_found = loop.time()
+                server = registry.get(usn) if registry else None
+                if server:
+                    server.update_info(item)
+                else:
+                    server = Server(item)
+                server.interface = interface
+                if registry:
+                    registry.add(server)
+                server.dump_info()
+                if fetch_detail:
+                    if use_async:
+                        fetching[asyncio.ensure_future(async_fetch(server))] = server
+                    else:
+                        fetching[loop.run_in_executor(executor, server.fetch_detail, pool, detail_timeout)] = server
+                    continue
+                yield server
+                count += 1
+                if max_results and count >= max_results:
+                    return
+
+        # descriptions not fetched in time
+        for server in fetching.values():
+            _logger.debug(f'detail pending : {server.uniqueid()}')
+            yield server
+            count += 1
+            if max_results and count >= max_results:
+                return
+    finally:
+        if receiving:
+            receiving.cancel()
+        for transport in transports:
+            transport.close()
+        if executor:
+            executor.shutdown(wait=False)
+
+
+async def _collect(mx: int, timeout: float, max_results: int, pool: Union[SessionPool, async_http.AsyncSessionPool],
+                   registry: 'DeviceRegistry' = None, search_types: Sequence[str] = DEFAULT_SEARCH_TYPES,
+                   interfaces: Union[str, Sequence[str]] = None, idle_timeout: float = None) -> List[Server]:
+    return [s async for s in discover(mx, timeout, max_results, pool, registry=registry, search_types=search_types,
+                                      interfaces=interfaces, idle_timeout=idle_timeout)]
+
+
+async def _async_scan(mx: int, timeout: float, max_results: int, pool: Union[SessionPool, async_http.AsyncSessionPool],
+                      registry: 'DeviceRegistry', search_types: Sequence[str],
+                      interfaces: Union[str, Sequence[str]], idle_timeout: float = None) -> List[Server]:
+    start = time.perf_counter()
+    servers = await _collect(mx, timeout, max_results, pool, registry, search_types, interfaces, idle_timeout)
+    m = metrics.get_metrics()
+    if m is not None:
+        m.observe(metrics.DISCOVERY_SECONDS, time.perf_counter() - start)
+    if registry:
+        registry.remove_expired()
+        registry.save()
+    return servers
+
+
+def _scan(mx: int, timeout: float, max_results: int, pool: SessionPool, registry: 'DeviceRegistry',
+          search_types: Sequence[str], interfaces: Union[str, Sequence[str]],
+          idle_timeout: float = None) -> List[Server]:
+    def run() -> List[Server]:
+        return asyncio.run(_async_scan(mx, timeout, max_results, pool, registry, search_types, interfaces,
+                                       idle_timeout))
+
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return run()
+    # called from a running loop (e.g. Jupyter), asyncio.run needs its own thread
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        return executor.submit(run).result()
+
+
+def _known_servers(registry: 'DeviceRegistry', search_types: Sequence[str]) -> List[Server]:
+    matches = _type_matcher(search_types)
+    servers = [s for s in registry.servers() if matches(s.info.get('ST'))]
+    m = metrics.get_metrics()
+    if m is not None:
+        m.inc(metrics.CACHE_REQUESTS, cache='registry', result='hit' if servers else 'miss')
+    return servers
+
+
+def search(pool: SessionPool = None, mx: int = DEFAULT_MX, timeout: float = DEFAULT_TIMEOUT,
+           max_results: int = None, registry: 'DeviceRegistry' = None,
+           search_types: Sequence[str] = DEFAULT_SEARCH_TYPES,
+           interfaces: Union[str, Sequence[str]] = None, idle_timeout: float = None) -> List[Server]:
+    """Search DLNA ContentDirectory server (and renderer with search_types) information
+
+    Servers whose device description could not be fetched in time are
+    returned with detail_status 'pending' or 'failed'.
+    With registry, known servers whose SSDP max-age has not expired are
+    returned at once without scanning. If some of them have expired, a new
+    scan runs in background to refresh the registry.
+
+    :param pool: HTTP session pool used to fetch device descriptions (default pool if None)
+    :param mx: MX of M-SEARCH (max seconds devices wait before answering)
+    :param timeout: seconds to wait responses in total
+    :param max_results: return as soon as this number of servers are found (no limit if None)
+    :param registry: device registry to use and update (see device_registry.DeviceRegistry)
+    :param search_types: ST of devices to search (e.g. MEDIA_SEARCH_TYPES for servers and renderers)
+    :param interfaces: 'all' or names / IPv4 addresses of interfaces to search on (default route only if None)
+    :param idle_timeout: stop waiting when no new device has answered for this many seconds (see discover)
+    :return: list of device information
+    """
+    if registry:
+        servers = _known_servers(registry, search_types)
+        if servers:
+            if registry.has_expired() and registry.start_scan():
+                def scan():
+                    try:
+                        _scan(mx, timeout, None, pool, registry, search_types, interfaces, idle_timeout)
+                    finally:
+                        registry.finish_scan()
+                threading.Thread(target=scan, daemon=True).start()
+            return servers[:max_results] if max_results else servers
+
+    return _scan(mx, timeout, max_results, pool, registry, search_types, interfaces, idle_timeout)
+
+
+# background scans started by async_search (kept until done)
+_async_scans = set()
+
+
+async def async_search(pool: async_http.AsyncSessionPool = None, mx: int = DEFAULT_MX,
+                       timeout: float = DEFAULT_TIMEOUT, max_results: int = None, registry: 'DeviceRegistry' = None,
+                       search_types: Sequence[str] = DEFAULT_SEARCH_TYPES,
+                       interfaces: Union[str, Sequence[str]] = None, idle_timeout: float = None) -> List[Server]:
+    """Search DLNA devices without blocking the event loop (see search)
+
+    M-SEARCH and responses go through asyncio datagram endpoints and device
+    descriptions are fetched with async_http, so no thread is used.
+    The background scan of an expired registry runs as a task of the loop.
+    The search can be cancelled or bounded with asyncio.wait_for.
+
+    :param pool: async HTTP session pool (default pool of the event loop if None)
+    :param mx: MX of M-SEARCH (max seconds devices wait before answering)
+    :param timeout: seconds to wait responses in total
+    :param max_results: return as soon as this number of servers are found (no limit if None)
+    :param registry: device registry to use and update (see device_registry.DeviceRegistry)
+    :param search_types: ST of devices to search (e.g. MEDIA_SEARCH_TYPES for servers and renderers)
+    :param interfaces: 'all' or names / IPv4 addresses of interfaces to search on (default route only if None)
+    :param idle_timeout: stop waiting when no new device has answered for this many seconds (see discover)
+    :return: list of device information
     """
-    return _get_servers()
+    pool = async_http.get_pool(pool)
+    if registry:
+        servers = _known_servers(registry, search_types)
+        if servers:
+            if registry.has_expired() and registry.start_scan():
+                def scanned(task: asyncio.Future):
+                    _async_scans.discard(task)
+                    registry.finish_scan()
+                    if not task.cancelled() and task.exception():
+                        _logger.warning(f'background scan error : {task.exception()}')
+
+                task = asyncio.ensure_future(_async_scan(mx, timeout, None, pool, registry, search_types,
+                                                         interfaces, idle_timeout))
+                _async_scans.add(task)
+                task.add_done_callback(scanned)
+            return servers[:max_results] if max_results else servers
+
+    return await _async_scan(mx, timeout, max_results, pool, registry, search_types, interfaces, idle_timeout)
 
 
 def _main():
-    server_infos = search()
+    from device_registry import DeviceRegistry
+
+    p = argparse.ArgumentParser()
+    p.add_argument('--mx', type=int, default=DEFAULT_MX, help='MX of M-SEARCH')
+    p.add_argument('--timeout', type=float, default=DEFAULT_TIMEOUT, help='seconds to wait responses')
+    p.add_argument('--max_results', type=int, help='stop after this number of servers are found')
+    p.add_argument('--idle_timeout', type=float, default=DEFAULT_IDLE_TIMEOUT,
+                   help='stop when no new device has answered for this many seconds (0 to wait whole timeout)')
+    p.add_argument('--registry', help='file of device registry to start warm')
+    p.add_argument('--renderer', action='store_true', help='search renderers (AVTransport) too')
+    p.add_argument('--type', action='append', help='ST to search (can be repeated)')
+    p.add_argument('--interface', action='append',
+                   help='interface name or IPv4 address to search on (can be repeated, "all" for every interface)')
+    args = p.parse_args()
+    registry = DeviceRegistry(args.registry) if args.registry else None
+    search_types = list(MEDIA_SEARCH_TYPES if args.renderer else DEFAULT_SEARCH_TYPES)
+    search_types += args.type if args.type else []
+    server_infos = search(mx=args.mx, timeout=args.timeout, max_results=args.max_results, registry=registry,
+                          search_types=search_types, idle_timeout=args.idle_timeout,
+                          interfaces=ALL_INTERFACES if args.interface == [ALL_INTERFACES] else args.interface)
     _logger.info('****** Found Servers ********')
     for s in server_infos:
         _logger.info('---')
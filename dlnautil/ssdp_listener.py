@@ -0,0 +1,194 @@
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+import logging
+import socket
+import struct
+import threading
+import time
+from typing import Tuple
+
+from device_registry import DeviceRegistry
+from http_session import SessionPool
+from server_search import DEFAULT_DETAIL_TIMEOUT, DEFAULT_MAX_FETCHES, SSDP_ADDR, Server, _parse_server
+
+_logger = logging.getLogger('dlnautil')
+
+# NT of devices kept in registry (substring match)
+DEFAULT_TYPES = ('ContentDirectory', 'AVTransport')
+# seconds between checks of expired devices
+DEFAULT_EXPIRE_INTERVAL = 10.0
+
+NTS_ALIVE = 'ssdp:alive'
+NTS_BYEBYE = 'ssdp:byebye'
+NTS_UPDATE = 'ssdp:update'
+
+
+class NotifyListener:
+    """Listen SSDP NOTIFY messages and keep a registry of live devices
+
+    Devices announced by ssdp:alive / ssdp:update are added to the registry
+    (their descriptions are fetched in background), devices sent
+    ssdp:byebye are removed, and devices whose max-age passed without a
+    new announcement are removed periodically. Lookups go to the registry
+    without network traffic, and changes are notified by its callbacks.
+
+    usage:
+        with NotifyListener() as listener:
+            listener.registry.add_callback(lambda event, server: ...)
+    """
+
+    def __init__(self, registry: DeviceRegistry = None, types: Tuple[str, ...] = DEFAULT_TYPES,
+                 pool: SessionPool = None, fetch_detail: bool = True, max_fetches: int = DEFAULT_MAX_FETCHES,
+                 interface: str = None, port: int = SSDP_ADDR[1],
+                 expire_interval: float = DEFAULT_EXPIRE_INTERVAL):
+        """
+        :param registry: registry to update (new memory only registry if None)
+        :param types: NT of devices to keep (substring match, all devices if empty)
+        :param pool: HTTP session pool used to fetch device descriptions (default pool if None)
+        :param fetch_detail: whether fetch device descriptions of new devices
+        :param max_fetches: max number of device descriptions fetched at once
+        :param interface: IPv4 address of interface to join multicast group (default interface if None)
+        :param port: UDP port to listen
+        :param expire_interval: seconds between checks of expired devices
+        """
+        self.registry = registry if registry is not None else DeviceRegistry()
+        self.types = types
+        self.pool = pool
+        self.fetch_detail = fetch_detail
+        self.interface = interface
+        self.port = port
+        self.expire_interval = expire_interval
+        self._executor = ThreadPoolExecutor(max_workers=max_fetches)
+        self._sock = None
+        self._thread = None
+        self._running = False
+
+    def _open_socket(self) -> socket.socket:
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        if hasattr(socket, 'SO_REUSEPORT'):
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        sock.bind(('', self.port))
+        mreq = struct.pack('4s4s', socket.inet_aton(SSDP_ADDR[0]), socket.inet_aton(self.interface or '0.0.0.0'))
+        try:
+            sock.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP, mreq)
+        except OSError as e:
+            _logger.warning(f'can not join {SSDP_ADDR[0]} : {e}')
+        sock.settimeout(0.5)
+        return sock
+
+    def start(self):
+        if self._running:
+            return
+        self._sock = self._open_socket()
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name='ssdp-listener', daemon=True)
+        self._thread.start()
+        _logger.debug(f'listening NOTIFY on port {self._sock.getsockname()[1]}')
+
+    def stop(self):
+        self._running = False
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+        if self._sock:
+            self._sock.close()
+            self._sock = None
+        self._executor.shutdown(wait=False)
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+
+    def _run(self):
+        next_expire = time.time() + self.expire_interval
+        while self._running:
+            try:
+                data, addr = self._sock.recvfrom(4096)
+                self._handle(data, addr)
+            except socket.timeout:
+                pass
+            except OSError as e:
+                if self._running:
+                    _logger.warning(f'NOTIFY receive error : {e}')
+                    time.sleep(0.5)
+
+            if time.time() >= next_expire:
+                for server in self.registry.remove_expired():
+                    _logger.debug(f'expired : {server.uniqueid()}')
+                next_expire = time.time() + self.expire_interval
+
+    def _handle(self, data: bytes, addr):
+        if not data.startswith(b'NOTIFY'):
+            return
+        info = _parse_server(data.decode('utf-8', errors='replace'))
+        nt = info.get('NT', '')
+        nts = info.get('NTS', '')
+        usn = info.get('USN')
+        if not usn:
+            return
+
+        if nts == NTS_BYEBYE:
+            if nt == 'upnp:rootdevice':
+                # the whole device has left
+                udn = usn.split('::')[0]
+                for server in self.registry.remove_device(udn):
+                    _logger.debug(f'byebye : {server.uniqueid()}')
+            elif self.registry.remove(usn):
+                _logger.debug(f'byebye : {usn}')
+            return
+
+        if self.types and not any(t in nt for t in self.types):
+            return
+        if nts not in (NTS_ALIVE, NTS_UPDATE):
+            return
+
+        # keep the same key as M-SEARCH responses
+        info['ST'] = nt
+        _logger.debug(f'{nts} from {addr} : {usn}')
+        server = self.registry.get(usn)
+        if server and nts == NTS_ALIVE and server.info.get('LOCATION') == info.get('LOCATION'):
+            # re-announcement, only extend expiration
+            server.update_info(info)
+            return
+
+        if server:
+            server.update_info(info)
+        else:
+            server = Server(info)
+        self.registry.add(server)
+        if self.fetch_detail:
+            self._executor.submit(self._fetch_detail, server)
+
+    def _fetch_detail(self, server: Server):
+        server.fetch_detail(self.pool, DEFAULT_DETAIL_TIMEOUT)
+        _logger.debug(f'detail {server.detail_status} : {server.uniqueid()}')
+        if self.registry.get(server.uniqueid()) is server:
+            self.registry.add(server)
+
+
+def _main():
+    p = argparse.ArgumentParser()
+    p.add_argument('--interface', help='IPv4 address of interface to listen')
+    p.add_argument('--registry', help='file of device registry to load and save')
+    args = p.parse_args()
+
+    def on_change(event: str, server: Server):
+        _logger.info(f'{event} : {server.uniqueid()} : {server.info.get("LOCATION")}')
+
+    registry = DeviceRegistry(args.registry)
+    registry.add_callback(on_change)
+    with NotifyListener(registry, interface=args.interface):
+        try:
+            while True:
+                time.sleep(1)
+        except KeyboardInterrupt:
+            pass
+    registry.save()
+
+
+if __name__ == '__main__':
+    _main()
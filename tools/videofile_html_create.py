@@ -189,8 +189,8 @@ items
 item = [i for i in items if i.get_data().get('title') == '全てのビデオ'][0]
 item_id = item.get_data().get('id')
 
-all_items = content_browse.browse(url=url, st=stype, item_id=item_id)
-df_dlna = pd.DataFrame([i.get_data() for i in all_items])
+all_items = content_browse.iter_browse(url=url, st=stype, item_id=item_id)
+df_dlna = pd.DataFrame(i.get_data() for i in all_items)
 df_dlna
 
 